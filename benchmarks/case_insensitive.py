@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""Compare -i against case-sensitive searches for -F, -s/-e and -t.
+
+Case folding happens inside the literal matcher rather than on a lowercased copy
+of each line, so -i should stay within a small factor of the plain search.
+
+    python benchmarks/case_insensitive.py --lines 2000000 --max-ratio 2
+"""
+import argparse
+import sys
+import tempfile
+from pathlib import Path
+
+import rygex_ext
+
+from common import best_of, make_file
+
+
+def cases(path: str) -> dict[str, tuple]:
+    """name -> (case-sensitive call, case-insensitive call)"""
+    def fixed(ci: bool):
+        query = rygex_ext.Query.fixed("DPT=8080", ci)
+        return lambda: query.count(path)
+
+    def spans(ci: bool):
+        query = rygex_ext.Query.spans("SRC=", 1, " DST", 1, 4, 4, False, ci)
+        return lambda: query.count(path)
+
+    def total(ci: bool):
+        return lambda: rygex_ext.total_count_fixed_str("PROTO=TCP", path, False, ci)
+
+    return {name: (make(False), make(True))
+            for name, make in (("-F", fixed), ("-s/-e", spans), ("-t -F", total))}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=1_000_000, help="lines in the generated file")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per search, best is reported")
+    parser.add_argument("--max-ratio", type=float, default=None,
+                        help="exit 1 if any -i search is slower than this multiple")
+    args = parser.parse_args()
+
+    worst = 0.0
+    with tempfile.TemporaryDirectory(prefix="rygex-ci-") as tmp:
+        path = Path(tmp) / "ufw.log"
+        make_file(path, args.lines, seed=0)
+        print(f"{'search':<8} {'exact':>9} {'-i':>9} {'ratio':>7}")
+        for name, (exact, folded) in cases(str(path)).items():
+            exact()  # warm the page cache
+            t_exact = best_of(args.repeat, exact)
+            t_folded = best_of(args.repeat, folded)
+            ratio = t_folded / t_exact
+            worst = max(worst, ratio)
+            print(f"{name:<8} {t_exact:8.3f}s {t_folded:8.3f}s {ratio:6.2f}x")
+
+    if args.max_ratio is not None and worst > args.max_ratio:
+        print(f"-i slower than {args.max_ratio}x", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""Helpers shared by the benchmark scripts."""
+import random
+import time
+from pathlib import Path
+from typing import Callable
+
+
+def make_file(path: Path, lines: int, seed: int) -> None:
+    """Write `lines` ufw-style log lines, the same ones for a given seed."""
+    rng = random.Random(seed)
+    with path.open("w") as f:
+        for i in range(lines):
+            src = f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}"
+            f.write(
+                f"Jan {1 + i % 28:2d} 12:{i % 60:02d}:00 host kernel: [UFW BLOCK] "
+                f"SRC={src} DST=192.168.0.1 LEN=60 PROTO=TCP SPT={rng.randrange(1024, 65535)} "
+                f"DPT={rng.choice((22, 80, 443, 8080))}\n"
+            )
+
+
+# The line every benchmark search looks for; corpora vary how often it appears.
+NEEDLE_IP = "203.0.113.7"
+
+
+def make_corpus(path: Path, size_bytes: int, density: float, seed: int = 0) -> None:
+    """
+    Write about `size_bytes` of ufw-style lines where a fraction `density` of the
+    lines have DST=NEEDLE_IP. The same arguments always give the same file.
+    """
+    rng = random.Random(seed)
+
+    def line(i: int, dst: str) -> str:
+        src = f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}"
+        return (
+            f"Jan {1 + i % 28:2d} 12:{i % 60:02d}:{i % 59:02d} host kernel: [UFW BLOCK] "
+            f"SRC={src} DST={dst} LEN=60 PROTO=TCP SPT={rng.randrange(1024, 65535)} "
+            f"DPT={rng.choice((22, 80, 443, 3306, 8080))}\n"
+        )
+
+    written = 0
+    i = 0
+    with path.open("w") as f:
+        while written < size_bytes:
+            batch = []
+            for _ in range(10_000):
+                hit = rng.random() < density
+                dst = NEEDLE_IP if hit else f"192.168.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+                batch.append(line(i, dst))
+                i += 1
+            text = "".join(batch)
+            f.write(text)
+            written += len(text)
+
+
+def best_of(repeat: int, fn: Callable[[], object]) -> float:
+    """The fastest of `repeat` timed calls to `fn`, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
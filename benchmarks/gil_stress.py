@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Check that rygex_ext scans release the GIL.
+
+Runs the same Query over N generated files, first one after another, then from
+N Python threads, and reports the speedup. With the GIL released the threaded
+run should approach N times the serial throughput (bounded by cores and disk).
+
+    python benchmarks/gil_stress.py --threads 8 --lines 500000 --min-speedup 3
+"""
+import argparse
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import rygex_ext
+
+from common import make_file
+
+PATTERN = r"SRC=([\d.]+).*?DPT=(\d+)"
+
+
+def run_serial(query: rygex_ext.Query, paths: list[str]) -> float:
+    start = time.perf_counter()
+    for path in paths:
+        query.count(path)
+    return time.perf_counter() - start
+
+
+def run_threaded(query: rygex_ext.Query, paths: list[str]) -> float:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(len(paths)) as pool:
+        list(pool.map(query.count, paths))
+    return time.perf_counter() - start
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=4, help="files and threads to use")
+    parser.add_argument("--lines", type=int, default=200_000, help="lines per generated file")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per mode, best is reported")
+    parser.add_argument("--min-speedup", type=float, default=None,
+                        help="exit 1 if the threaded speedup is below this")
+    args = parser.parse_args()
+
+    query = rygex_ext.Query.regex(PATTERN, [1, 2])
+    with tempfile.TemporaryDirectory(prefix="rygex-gil-") as tmp:
+        paths = []
+        for n in range(args.threads):
+            path = Path(tmp) / f"ufw.{n}"
+            make_file(path, args.lines, seed=n)
+            paths.append(str(path))
+
+        # Warm the page cache so both modes read from memory.
+        run_serial(query, paths)
+        serial = min(run_serial(query, paths) for _ in range(args.repeat))
+        threaded = min(run_threaded(query, paths) for _ in range(args.repeat))
+
+    speedup = serial / threaded
+    print(f"files/threads : {args.threads} x {args.lines} lines")
+    print(f"serial        : {serial:.3f}s")
+    print(f"threaded      : {threaded:.3f}s")
+    print(f"speedup       : {speedup:.2f}x ({speedup / args.threads:.0%} efficiency)")
+
+    if args.min_speedup is not None and speedup < args.min_speedup:
+        print(f"speedup below {args.min_speedup}x", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Check that rygex starts quickly and only imports what each mode needs.
+
+Runs the `rygex` command (rygex.client, as the console script does) with
+`python -X importtime` over a tiny file for several modes and sums the self
+time of every module imported beyond a bare interpreter. Exits 1 if the best
+run of any mode exceeds the budget, or if a plain search imports a module that
+only other modes need (-p's process pool, checkpoints, ...).
+
+    python benchmarks/import_time.py --budget-ms 50
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+# name -> rygex arguments, before -f
+CASES = {
+    "F": ["-F", "DST="],
+    "rp": ["-rp", r"DPT=(\d+)", "1"],
+    "s-e": ["-s", "SRC=", "1", "-e", " DST", "1", "-O"],
+    "F-c": ["-F", "DST=", "-c"],
+    "F-cached": ["-F", "DST=", "--cache"],
+}
+# modules a plain search must not pull in
+DEFERRED = (
+    "rygex.python_regex",
+    "rygex.checkpoint",
+    "concurrent.futures",
+    "multiprocessing",
+    "dataclasses",
+)
+LINE = "Feb  1 00:00:00 host kernel: [UFW BLOCK] SRC=10.0.0.1 DST=203.0.113.7 LEN=40 DPT=22\n"
+
+
+def import_times(cmd: list[str]) -> dict[str, int]:
+    """Self time in microseconds of every module cmd imports, from -X importtime."""
+    # RYGEX_SOCKET= so a running `rygex --serve` can't take the search
+    proc = subprocess.run([sys.executable, "-X", "importtime", *cmd],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+                          env={**os.environ, "RYGEX_SOCKET": ""})
+    if proc.returncode != 0:
+        errors = [line for line in proc.stderr.splitlines() if not line.startswith("import time:")]
+        raise RuntimeError(f"{' '.join(cmd)} exited {proc.returncode}: {' '.join(errors)}")
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, _, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(own)
+    return times
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=50.0,
+                        help="most import time allowed per mode, beyond a bare interpreter")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per mode, best is reported")
+    parser.add_argument("--top", type=int, default=5, help="slowest imports listed per mode")
+    args = parser.parse_args()
+
+    bare = set(import_times(["-c", "pass"]))
+    failed = False
+    with tempfile.TemporaryDirectory(prefix="rygex-import-") as tmp:
+        path = Path(tmp) / "ufw.log"
+        path.write_text(LINE * 10)
+        for name, case in CASES.items():
+            runs = []
+            for _ in range(args.repeat):
+                times = import_times(["-m", "rygex.client", *case, "-f", str(path)])
+                runs.append({m: us for m, us in times.items() if m not in bare})
+            best = min(runs, key=lambda run: sum(run.values()))
+            total_ms = sum(best.values()) / 1000
+            slowest = sorted(best.items(), key=lambda m: m[1], reverse=True)[:args.top]
+            print(f"{name:<9} {total_ms:6.1f} ms  "
+                  + ", ".join(f"{m} {us / 1000:.1f}" for m, us in slowest))
+            if total_ms > args.budget_ms:
+                print(f"{name}: {total_ms:.1f} ms over the {args.budget_ms} ms budget", file=sys.stderr)
+                failed = True
+            deferred = sorted(m for m in best if m.startswith(DEFERRED))
+            if deferred:
+                print(f"{name}: imports {', '.join(deferred)}", file=sys.stderr)
+                failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
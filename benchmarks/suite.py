@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""End-to-end rygex benchmarks with a JSON history and regression checks.
+
+Every search mode runs as a real `rygex` process against generated corpora of
+several sizes and match densities. Wall, user and sys time and peak RSS are
+recorded per run, and the medians are written as JSON. Given a baseline (an
+earlier --output), any case that got slower or bigger than the thresholds
+allow is reported and the exit status is 1.
+
+    python benchmarks/suite.py --sizes small --output base.json
+    python benchmarks/suite.py --sizes small --baseline base.json --max-slowdown 0.1
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from common import NEEDLE_IP, make_corpus
+
+SIZES = {"small": 16 * 2**20, "medium": 256 * 2**20, "large": 2 * 2**30}
+DENSITIES = {"sparse": 0.001, "dense": 0.5}
+
+NEEDLE_RE = NEEDLE_IP.replace(".", r"\.")
+# name -> rygex arguments, before -f
+CASES = {
+    "rp": ["-rp", f"DST=({NEEDLE_RE}) ", "1"],
+    "rp-m": ["-rp", f"DST=({NEEDLE_RE}) ", "1", "-m"],
+    "p": ["-p", f"DST=({NEEDLE_RE}) ", "1"],
+    "p-m": ["-p", f"DST=({NEEDLE_RE}) ", "1", "-m"],
+    "F": ["-F", f"DST={NEEDLE_IP} "],
+    "F-i": ["-F", f"dst={NEEDLE_IP} ", "-i"],
+    "s-e": ["-s", f"DST={NEEDLE_IP}", "1", "-e", " LEN", "1", "-O"],
+    "g": ["-g", f"DST={NEEDLE_RE} .*?DPT=(\\d+)", "1"],
+    "g-m": ["-g", f"DST={NEEDLE_RE} .*?DPT=(\\d+)", "1", "-m"],
+    "rp-c": ["-rp", f"DST={NEEDLE_RE} .*?DPT=(\\d+)", "1", "-c"],
+    "rp-Sc-top": ["-rp", r"SRC=(10\.\d+)\.", "1", "-S", "-r", "-c", "-l", ":10"],
+    "s-e-c": ["-s", "SRC=", "1", "-e", " DST", "1", "-O", "-c"],
+    "rp-t": ["-rp", f"DST={NEEDLE_RE} ", "-t"],
+    "F-t": ["-F", f"DST={NEEDLE_IP} ", "-t"],
+    "F-t-m": ["-F", f"DST={NEEDLE_IP} ", "-t", "-m"],
+}
+METRICS = ("wall", "user", "sys", "max_rss_kib")
+
+
+def rygex_command() -> list[str]:
+    exe = shutil.which("rygex")
+    return [exe] if exe else [sys.executable, "-m", "rygex.cli"]
+
+
+def run_once(cmd: list[str]) -> dict:
+    """Run cmd, counting its output lines, and measure it with wait4."""
+    with tempfile.TemporaryFile() as err:
+        start = time.perf_counter()
+        # RYGEX_SOCKET= keeps a running `rygex --serve` from answering instead
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=err,
+                                env={**os.environ, "RYGEX_SOCKET": ""})
+        lines = 0
+        while chunk := proc.stdout.read(1 << 20):
+            lines += chunk.count(b"\n")
+        _, status, usage = os.wait4(proc.pid, 0)
+        wall = time.perf_counter() - start
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        proc.stdout.close()
+        if proc.returncode != 0:
+            err.seek(0)
+            raise RuntimeError(f"{' '.join(cmd)} exited {proc.returncode}: {err.read().decode().strip()}")
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    rss = usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+    return {"wall": wall, "user": usage.ru_utime, "sys": usage.ru_stime,
+            "max_rss_kib": rss, "lines": lines}
+
+
+def corpus(directory: Path, size: str, density: str) -> Path:
+    """The corpus for size and density, generated on first use."""
+    path = directory / f"ufw-{size}-{density}.log"
+    if not path.exists():
+        partial = path.with_suffix(".tmp")
+        make_corpus(partial, SIZES[size], DENSITIES[density], seed=0)
+        partial.rename(path)
+    return path
+
+
+def compare(results: list[dict], baseline: dict, args: argparse.Namespace) -> list[str]:
+    """Regressions against baseline, as readable lines."""
+    limits = {"wall": args.max_slowdown, "user": args.max_slowdown, "sys": None,
+              "max_rss_kib": args.max_rss_growth}
+    old = {(r["case"], r["size"], r["density"]): r for r in baseline["results"]}
+    problems = []
+    for r in results:
+        before = old.get((r["case"], r["size"], r["density"]))
+        if before is None:
+            continue
+        label = f"{r['case']} {r['size']}/{r['density']}"
+        if before["lines"] != r["lines"]:
+            problems.append(f"{label}: output changed from {before['lines']} to {r['lines']} lines")
+        for metric, limit in limits.items():
+            if limit is None:
+                continue
+            if metric != "max_rss_kib" and before[metric] < args.noise_floor:
+                continue
+            growth = r[metric] / max(before[metric], 1e-9) - 1
+            if growth > limit:
+                problems.append(f"{label}: {metric} {before[metric]:.3f} -> {r[metric]:.3f} (+{growth:.0%})")
+    return problems
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="small", help=f"comma separated, from {', '.join(SIZES)}")
+    parser.add_argument("--densities", default=",".join(DENSITIES), help=f"comma separated, from {', '.join(DENSITIES)}")
+    parser.add_argument("--cases", default=",".join(CASES), help="comma separated case names")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case, medians are reported")
+    parser.add_argument("--corpus-dir", type=Path, default=Path(tempfile.gettempdir()) / "rygex-bench",
+                        help="where generated corpora are kept between runs")
+    parser.add_argument("--output", type=Path, help="write the results as JSON")
+    parser.add_argument("--baseline", type=Path, help="JSON from an earlier --output to compare with")
+    parser.add_argument("--max-slowdown", type=float, default=0.15,
+                        help="allowed growth in wall and user time, as a fraction")
+    parser.add_argument("--max-rss-growth", type=float, default=0.25,
+                        help="allowed growth in peak RSS, as a fraction")
+    parser.add_argument("--noise-floor", type=float, default=0.05,
+                        help="ignore time regressions of cases faster than this many seconds")
+    args = parser.parse_args()
+
+    sizes, densities, cases = (args.sizes.split(","), args.densities.split(","), args.cases.split(","))
+    for name, chosen, known in (("size", sizes, SIZES), ("density", densities, DENSITIES), ("case", cases, CASES)):
+        unknown = [c for c in chosen if c not in known]
+        if unknown:
+            parser.error(f"unknown {name}: {', '.join(unknown)}")
+
+    args.corpus_dir.mkdir(parents=True, exist_ok=True)
+    base = rygex_command()
+    results = []
+    print(f"{'case':<11} {'corpus':<14} {'wall':>8} {'user':>8} {'sys':>7} {'rss MiB':>8} {'lines':>9}")
+    for size in sizes:
+        for density in densities:
+            path = corpus(args.corpus_dir, size, density)
+            for case in cases:
+                cmd = base + CASES[case] + ["-f", str(path)]
+                run_once(cmd)  # warm the page cache
+                runs = [run_once(cmd) for _ in range(args.repeat)]
+                row = {"case": case, "size": size, "density": density, "command": cmd[len(base):],
+                       "lines": runs[0]["lines"], "runs": runs}
+                row.update({m: statistics.median(r[m] for r in runs) for m in METRICS})
+                results.append(row)
+                print(f"{case:<11} {size + '/' + density:<14} {row['wall']:7.3f}s {row['user']:7.3f}s "
+                      f"{row['sys']:6.3f}s {row['max_rss_kib'] / 1024:8.1f} {row['lines']:9d}")
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+
+    if args.baseline:
+        problems = compare(results, json.loads(args.baseline.read_text()), args)
+        for problem in problems:
+            print(f"REGRESSION {problem}", file=sys.stderr)
+        if problems:
+            return 1
+        print("no regressions against", args.baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""Time selective searches of one large log with and without its trigram index.
+
+    python benchmarks/trigram_index.py --lines 5000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import rygex_ext
+
+from common import best_of, make_file
+
+# ufw-style lines, so these only turn up in a handful of blocks
+QUERIES = {
+    "-F": lambda: rygex_ext.Query.fixed("SRC=10.200.100.50 "),
+    "-F -i": lambda: rygex_ext.Query.fixed("src=10.200.100.50 ", True),
+    "-rp": lambda: rygex_ext.Query.regex(r"SRC=10\.200\.100\.5\d .*DPT=(\d+)", [1]),
+    "-s/-e": lambda: rygex_ext.Query.spans("SRC=10.200.100.", 1, " DST", 1, 4, 4),
+}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=2_000_000, help="lines in the generated file")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per search, best is reported")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="rygex-index-") as tmp:
+        path = Path(tmp) / "ufw.log"
+        make_file(path, args.lines, seed=0)
+        path = str(path)
+        queries = {name: make() for name, make in QUERIES.items()}
+        for query in queries.values():
+            query.count(path)  # warm the page cache
+
+        plain = {name: best_of(args.repeat, lambda q=q: q.count(path)) for name, q in queries.items()}
+        start = time.perf_counter()
+        blocks = rygex_ext.build_index(path)
+        built = time.perf_counter() - start
+        indexed = {name: best_of(args.repeat, lambda q=q: q.count(path)) for name, q in queries.items()}
+        size = os.path.getsize(path + ".rygex-index")
+
+    print(f"index         : {blocks} blocks, {size / 2**20:.1f} MiB, built in {built:.2f}s")
+    print(f"{'search':<8} {'full scan':>10} {'indexed':>10} {'speedup':>8}")
+    for name in queries:
+        print(f"{name:<8} {plain[name]:9.3f}s {indexed[name]:9.4f}s {plain[name] / indexed[name]:7.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,6 +5,7 @@ import os
 from pathlib import Path
 from typing import Optional, Union, NamedTuple
 from .version import __version__
+from .utils import cache_home
 
 # __version__ = importlib.metadata.version("rygex")
 
@@ -13,14 +14,14 @@ from .version import __version__
 class PythonArgs(NamedTuple):
     start:        Optional[list[str]]         = None
     end:          Optional[list[str]]         = None
-    fixed_string: Optional[str]               = None
-    file:         Optional[Path]              = None
+    fixed_string: Optional[list[str]]         = None
+    file:         Optional[list[Path]]        = None
     insensitive:  bool                        = False
     omitfirst:    Optional[int]               = None
     omitlast:     Optional[int]               = None
     omitall:      bool                        = False
     pyreg:        Optional[list[str]]         = None
-    rpyreg:       Optional[list[str]]         = None
+    rpyreg:       Optional[list[list[str]]]   = None
     lines:        Optional[Union[int, slice]] = None
     sort:         bool                        = False
     rev:          bool                        = False
@@ -29,6 +30,25 @@ class PythonArgs(NamedTuple):
     totalcounts:  bool                        = False
     multi:        Optional[int]               = None
     gen:          Optional[list[str]]         = None
+    exclude:      Optional[list[str]]         = None
+    with_filename: bool                       = False
+    fixed_file:   Optional[Path]              = None
+    rpyreg_file:  Optional[Path]              = None
+    build_index:  Optional[list[Path]]        = None
+    checkpoint:   Optional[Path]              = None
+    cache:        bool                        = False
+    stats:        Optional[str]               = None
+    format:       Optional[str]               = None
+    agg:          Optional[list[str]]         = None
+    percentiles:  Optional[list[float]]       = None
+    histogram:    Optional[list[str]]         = None
+    bucket:       Optional[int]               = None
+    time_format:  Optional[str]               = None
+    year:         Optional[int]               = None
+    sort_key:     Optional[str]               = None
+    sort_memory:  Optional[int]               = None
+    approx:       Optional[float]             = None
+    serve:        Optional[Union[Path, bool]] = None
     # Note: we do NOT store “version” here, because we're using argparse’s built-in
     #       action="version" (which never puts a “version” attribute in the Namespace).
 
@@ -56,21 +76,69 @@ def parse_slice(s: str) -> Union[int, slice]:
         raise argparse.ArgumentTypeError(f"Invalid integer index: {s!r}")
 
 
+INTERVAL_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_interval(s: str) -> int:
+    """
+    Turn a bucket width into seconds:
+      '90' or '90s' → 90
+      '5m'          → 300
+      '1h'          → 3600
+      '1d'          → 86400
+    """
+    unit = INTERVAL_UNITS.get(s[-1:].lower())
+    try:
+        seconds = int(s[:-1] if unit else s) * (unit or 1)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid interval: {s!r}")
+    if seconds < 1:
+        raise argparse.ArgumentTypeError(f"Interval must be at least 1 second: {s!r}")
+    return seconds
+
+
+SIZE_UNITS = {"k": 1 << 10, "m": 1 << 20, "g": 1 << 30}
+
+
+def parse_size(s: str) -> int:
+    """
+    Turn a memory size into bytes:
+      '65536' → 65536
+      '512K'  → 524288
+      '256M'  → 268435456
+      '2G'    → 2147483648
+    """
+    unit = SIZE_UNITS.get(s[-1:].lower())
+    try:
+        size = int(s[:-1] if unit else s) * (unit or 1)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid size: {s!r}")
+    if size < 1:
+        raise argparse.ArgumentTypeError(f"Size must be at least 1 byte: {s!r}")
+    return size
+
+
 class NoEllipsisFormatter(argparse.HelpFormatter):
     def _format_action_invocation(self, action):
         # For -s/--start, -e/--end, -p/--pyreg, -rp/--rpyreg: force "PATTERN [INDEX]"
         if action.dest in ("start", "end", "pyreg", "rpyreg"):
             opts = ", ".join(action.option_strings)
             return f"{opts} PATTERN [INDEX]"
+        if action.dest == "agg":
+            return f"{', '.join(action.option_strings)} VALUE [BY]"
+        if action.dest == "histogram":
+            return f"{', '.join(action.option_strings)} TIME [BY]"
         return super()._format_action_invocation(action)
 
 
 
-def get_args() -> PythonArgs:
+def get_args(argv: Optional[list[str]] = None) -> PythonArgs:
     """
-    Parse command-line args and always return a PythonArgs. If `-v/--version`
-    is passed, argparse will do its own print+exit, so we never “fall off the end.”
+    Parse command-line args (or argv, for a request to `rygex --serve`) and always
+    return a PythonArgs. If `-v/--version` is passed, argparse will do its own
+    print+exit, so we never “fall off the end.”
     """
+    cache = cache_home()
     pk = argparse.ArgumentParser(
         prog="rygex",
         description="Search files with keywords, characters or python regex",
@@ -104,17 +172,53 @@ def get_args() -> PythonArgs:
     pk.add_argument(
         "-F", "--fixed-string",
         metavar="TEXT",
-        help="Search and print lines containing exactly TEXT",
+        help=(
+            "Search and print lines containing exactly TEXT. Repeat to search "
+            "for several strings in one pass."
+        ),
         type=str,
+        action="append",
+        required=False,
+        default=None,
+    )
+
+    pk.add_argument(
+        "--fixed-file",
+        metavar="FILE",
+        help="Like -F, with one string per line of FILE (e.g. a blocklist)",
+        type=Path,
         required=False,
         default=None,
     )
 
     pk.add_argument(
         "-f", "--file",
-        metavar="PATH/FILENAME",
-        help="Filename to search through",
+        metavar="PATH",
+        help=(
+            "Files, directories or glob patterns to search through. "
+            "Directories are searched recursively, quote globs such as '**/*.log'."
+        ),
         type=Path,
+        nargs="+",
+        required=False,
+    )
+
+    pk.add_argument(
+        "-x", "--exclude",
+        metavar="PATTERN",
+        help=(
+            "gitignore-style pattern of files or directories to skip when "
+            "searching directories or globs, e.g. '*.gz' or 'archive/'. Repeatable."
+        ),
+        action="append",
+        required=False,
+        default=None,
+    )
+
+    pk.add_argument(
+        "-H", "--with-filename",
+        help="Prefix each output line with the file it came from",
+        action="store_true",
         required=False,
     )
 
@@ -162,10 +266,108 @@ def get_args() -> PythonArgs:
     pk.add_argument(
         "-rp", "--rpyreg",
         metavar=("PATTERN", "INDEX"),
-        help="Reversed Python regex: PATTERN [INDEX]",
+        help=(
+            "Reversed Python regex: PATTERN [INDEX]. Repeat to search for several "
+            "patterns in one pass (INDEX is only used with a single pattern)."
+        ),
         type=str,
         nargs="+",
+        action="append",
+        required=False,
+    )
+
+    pk.add_argument(
+        "--rpyreg-file",
+        metavar="FILE",
+        help="Like -rp, with one regex per line of FILE",
+        type=Path,
+        required=False,
+        default=None,
+    )
+
+    pk.add_argument(
+        "--build-index",
+        metavar="FILE",
+        help=(
+            "Write a trigram index next to each FILE (FILE.rygex-index) and exit. "
+            "Later -F, -rp and -s/-e searches of FILE only read the parts that can "
+            "match, until FILE changes."
+        ),
+        type=Path,
+        nargs="+",
+        required=False,
+        default=None,
+    )
+
+    pk.add_argument(
+        "--checkpoint",
+        metavar="DIR",
+        help=(
+            "Remember how far each file was scanned (in DIR, default "
+            f"{cache / 'checkpoints'}) along with its -c, -u or -t results, and "
+            "next time only scan what was appended. Rotated or truncated files "
+            "are scanned from the start again."
+        ),
+        type=Path,
+        nargs="?",
+        const=cache / "checkpoints",
+        required=False,
+        default=None,
+    )
+
+    pk.add_argument(
+        "--cache",
+        help=(
+            f"Store the output (in {cache / 'results'}) and reuse it when the same "
+            "search runs again over the same unchanged files. Not for piped input, "
+            "--checkpoint or --format arrow."
+        ),
+        action="store_true",
+        required=False,
+    )
+
+    pk.add_argument(
+        "--format",
+        help=(
+            "Write every -rp or -g match as a row of its capture groups, named after "
+            "the group or numbered (full for the whole match), for pandas, DuckDB "
+            "and the like: jsonl prints a JSON object per match, arrow writes an "
+            "Arrow IPC stream to stdout. With -H the file is a path column."
+        ),
+        choices=["jsonl", "arrow"],
+        required=False,
+        default=None,
+    )
+
+    pk.add_argument(
+        "--stats",
+        metavar="FORMAT",
+        help=(
+            "After the output, report to stderr the bytes and lines scanned, the "
+            "records matched, the time spent in each phase and each worker's chunk "
+            "timings. FORMAT is text (the default) or json."
+        ),
+        choices=["text", "json"],
+        nargs="?",
+        const="text",
+        required=False,
+        default=None,
+    )
+
+    pk.add_argument(
+        "--serve",
+        metavar="SOCKET",
+        help=(
+            "Run a resident rygex on the Unix socket SOCKET (default $RYGEX_SOCKET, "
+            "else $XDG_RUNTIME_DIR/rygex.sock or rygex.sock in the cache directory), keeping compiled patterns, file maps and -m pools "
+            "warm. rygex commands with --file then run in it; set RYGEX_SOCKET to "
+            "use another default socket, or empty to run in-process."
+        ),
+        type=Path,
+        nargs="?",
+        const=True,
         required=False,
+        default=None,
     )
 
     pk.add_argument(
@@ -187,6 +389,31 @@ def get_args() -> PythonArgs:
         required=False,
     )
 
+    pk.add_argument(
+        "--sort-key",
+        choices=["auto", "lexical", "numeric", "ip", "natural"],
+        help=(
+            "How -S orders records: lexical, numeric, ip (IPv4 then IPv6), natural "
+            "(digit runs as numbers, e.g. versions) or auto, ip when the first record "
+            "is an address and lexical otherwise (default auto). Records that aren't "
+            "numbers or addresses go last"
+        ),
+        required=False,
+        default=None,
+    )
+
+    pk.add_argument(
+        "--sort-memory",
+        metavar="SIZE",
+        type=parse_size,
+        help=(
+            "Memory -S holds records in before sorting them into runs in the temporary "
+            "directory and merging those, e.g. 64M or 2G (default 256M)"
+        ),
+        required=False,
+        default=None,
+    )
+
     pk.add_argument(
         "-r", "--rev",
         help="Reverse the sort order",
@@ -215,6 +442,93 @@ def get_args() -> PythonArgs:
         required=False,
     )
 
+    pk.add_argument(
+        "--approx",
+        metavar="ERROR",
+        nargs="?",
+        type=float,
+        const=0.01,
+        help=(
+            "Approximate in fixed memory, for inputs with too many distinct records to "
+            "hold: -u -t estimates the distinct count (HyperLogLog, ERROR relative "
+            "standard error), -c or -g the records making up more than ERROR of the "
+            "total, with counts within ERROR of it (Space-Saving with Count-Min). "
+            "Default ERROR 0.01"
+        ),
+        required=False,
+        default=None,
+    )
+
+    pk.add_argument(
+        "--agg",
+        metavar=("VALUE", "BY"),
+        nargs="+",
+        help=(
+            "Sum, min, max, mean and percentiles of the numbers in capture group "
+            "VALUE of -rp or -g, per distinct BY groups (e.g. \"1 2\"), or over all "
+            "matches without BY. Groups are numbers or names. -S sorts by the sum"
+        ),
+        required=False,
+        default=None,
+    )
+
+    pk.add_argument(
+        "--percentiles",
+        metavar="P",
+        nargs="+",
+        type=float,
+        help="Percentiles (0-100) reported by --agg, approximate to within 1%% (default 50 90 99)",
+        required=False,
+        default=None,
+    )
+
+    pk.add_argument(
+        "--histogram",
+        metavar=("TIME", "BY"),
+        nargs="+",
+        help=(
+            "Count matches per --bucket of the timestamp in capture group TIME of "
+            "-rp or -g, as a time series with every bucket from the first to the "
+            "last, one series per distinct BY groups (e.g. \"2\") or one without BY. "
+            "Groups are numbers or names"
+        ),
+        required=False,
+        default=None,
+    )
+
+    pk.add_argument(
+        "--bucket",
+        metavar="INTERVAL",
+        type=parse_interval,
+        help="Width of the --histogram buckets, seconds or e.g. 30s, 5m, 1h, 1d (default 1m)",
+        required=False,
+        default=None,
+    )
+
+    pk.add_argument(
+        "--time-format",
+        choices=["syslog", "iso", "epoch"],
+        help=(
+            "How --histogram reads TIME: syslog \"Feb  1 00:00:00\" (within the last "
+            "twelve months, or in --year), iso \"2025-02-01T00:00:00\" with optional "
+            "fraction and offset, or epoch seconds (default syslog)"
+        ),
+        required=False,
+        default=None,
+    )
+
+    pk.add_argument(
+        "--year",
+        type=int,
+        help=(
+            "Year of every syslog --histogram time, for logs older than twelve months. "
+            "Without it each time is placed in the twelve months up to now, so a log "
+            "running over New Year keeps December in the year before"
+        ),
+        required=False,
+        default=None,
+    )
+
     pk.add_argument(
         "-m", "--multi",
         metavar="CORES",
@@ -244,6 +558,6 @@ def get_args() -> PythonArgs:
         required=False,
     )
 
-    args = pk.parse_args()
+    args = pk.parse_args(argv)
 
     return PythonArgs(**vars(args))
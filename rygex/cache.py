@@ -0,0 +1,111 @@
+import hashlib, json, os, tempfile, time
+from pathlib import Path
+from typing import Iterable, Iterator
+from rygex.args import PythonArgs
+from rygex.converters import search_patterns
+from rygex.utils import cache_home, resolve
+from rygex.version import __version__
+
+# total size of stored results; the least recently used are evicted past it
+RESULT_CACHE_BYTES = 256 * 2**20
+# results still being written are left alone by evict() for this long
+PARTIAL_GRACE_SECONDS = 60
+# options that don't change the output: the file list is keyed by identity instead
+NOT_IN_KEY = {'file', 'exclude', 'multi', 'cache', 'checkpoint', 'build_index', 'stats', 'serve', 'sort_memory'}
+
+
+def result_dir() -> Path:
+    return cache_home() / 'results'
+
+
+def file_identity(path: str) -> list:
+    path = resolve(path)
+    st = os.stat(path)
+    return [os.path.realpath(path), st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns]
+
+
+def result_key(args: PythonArgs, files: list[str]) -> str:
+    '''
+    The search options (with the contents of any pattern files) and the
+    device, inode, size and mtime of every file searched, so changing either
+    misses the cache. With -H the names as given are in it too, as the output
+    carries them.
+    '''
+    spec = {k: v for k, v in args._asdict().items() if k not in NOT_IN_KEY}
+    spec['patterns'] = search_patterns(args)
+    spec['files'] = [file_identity(path) for path in files]
+    if args.with_filename:
+        spec['names'] = files
+    spec['version'] = __version__
+    return hashlib.sha256(json.dumps(spec, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def load_result(key: str) -> list[str] | None:
+    '''The stored output for key, marked as just used, or None.'''
+    path = result_dir() / f'{key}.json'
+    try:
+        output = json.loads(path.read_text())
+        os.utime(path)
+    except (OSError, ValueError):
+        return None
+    return output
+
+
+def evict(directory: Path, limit: int) -> None:
+    '''
+    Delete the least recently used results until the rest fit in limit bytes.
+    Partial results younger than PARTIAL_GRACE_SECONDS are another search still
+    writing; older ones were abandoned and go like any other.
+    '''
+    written_since = time.time_ns() - PARTIAL_GRACE_SECONDS * 10**9
+    entries = []
+    for entry in os.scandir(directory):
+        try:
+            st = entry.stat()
+        except OSError:
+            continue
+        if entry.name.endswith('.tmp') and st.st_mtime_ns > written_since:
+            continue
+        entries.append((st.st_mtime_ns, st.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+
+
+def save_result(key: str, output: list[str]) -> None:
+    directory = result_dir()
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+        # a name of its own, as another search may be storing the same key
+        fd, partial = tempfile.mkstemp(prefix=f'{key}.', suffix='.tmp', dir=directory)
+        with open(fd, 'w') as f:
+            f.write(json.dumps(output))
+        os.replace(partial, directory / f'{key}.json')
+        evict(directory, RESULT_CACHE_BYTES)
+    except OSError:
+        pass  # a cache that can't be written just means searching next time
+
+
+def store_result(key: str, output: Iterable[str]) -> Iterator[str]:
+    '''
+    Pass output through, saving it under key once it has all been consumed.
+    Streamed output is kept only while it stays under a quarter of the cache.
+    '''
+    kept: list[str] | None = []
+    size = 0
+    for line in output:
+        if kept is not None:
+            size += len(line) + 4
+            if size > RESULT_CACHE_BYTES // 4:
+                kept = None
+            else:
+                kept.append(line)
+        yield line
+    if kept is not None:
+        save_result(key, kept)
@@ -0,0 +1,149 @@
+import hashlib, json, os
+from pathlib import Path
+import rygex_ext as regex
+from rygex.args import PythonArgs
+from rygex.converters import search_patterns
+from rygex.formatting import format_counts
+from rygex.utils import print_err, resolve
+
+STATE_VERSION = 1
+# leading bytes hashed into a checkpoint, to notice a file replaced in place
+HEAD_BYTES = 4096
+# options that only change how results are printed, not what is aggregated
+OUTPUT_ONLY = {'file', 'exclude', 'with_filename', 'sort', 'rev', 'lines', 'multi', 'cache', 'checkpoint', 'build_index', 'stats', 'serve', 'sort_key', 'sort_memory'}
+
+
+def checkpoint_mode(args: PythonArgs) -> str:
+    '''The aggregation a checkpointed run keeps, in the order main_seq picks them.'''
+    if args.gen or (args.counts and not args.unique):
+        return 'counts'
+    if args.totalcounts:
+        return 'total'
+    return 'unique'
+
+
+def checkpoint_key(args: PythonArgs, patterns: list[str], file_path: str) -> str:
+    '''One checkpoint per search and file, so different queries never share state.'''
+    spec = {k: v for k, v in args._asdict().items() if k not in OUTPUT_ONLY}
+    spec['patterns'] = patterns
+    spec['path'] = os.path.realpath(file_path)
+    return hashlib.sha256(json.dumps(spec, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def head_digest(file_path: str, length: int) -> str:
+    with open(file_path, 'rb') as f:
+        return hashlib.sha256(f.read(min(length, HEAD_BYTES))).hexdigest()
+
+
+def load_state(state_path: Path, file_path: str) -> dict | None:
+    '''
+    The saved state, if it still describes the start of file_path: the same
+    inode and device, at least as long as the checkpoint offset, and the same
+    leading bytes. Rotation, truncation or a rewrite all mean starting over.
+    '''
+    try:
+        state = json.loads(state_path.read_text())
+    except (OSError, ValueError):
+        return None
+    st = os.stat(file_path)
+    if state.get('version') != STATE_VERSION:
+        return None
+    if (state['dev'], state['inode']) != (st.st_dev, st.st_ino) or state['offset'] > st.st_size:
+        return None
+    if state['head'] != head_digest(file_path, state['offset']):
+        return None
+    return state
+
+
+def save_state(state_path: Path, state: dict) -> None:
+    '''Replace the checkpoint in one rename, so a crash never leaves half a file.'''
+    partial = state_path.with_suffix('.tmp')
+    partial.write_text(json.dumps(state))
+    os.replace(partial, state_path)
+
+
+def scan_appended(args: PythonArgs, query: regex.Query, patterns: list[str],
+                  file_path: str, start: int, data, parallel: bool):
+    '''Fold the complete lines after start into data, returning it and the new offset.'''
+    mode = checkpoint_mode(args)
+    if mode == 'total' and len(patterns) == 1 and not args.gen:
+        total, end = regex.total_count_appended(
+            patterns[0], file_path, start, parallel,
+            fixed_string=not (args.rpyreg or args.rpyreg_file),
+            case_insensitive=args.insensitive)
+        return data + total, end
+
+    rows, end = query.count_appended(file_path, start, parallel)
+    if mode == 'total' and len(patterns) > 1:
+        # records look like "2,5:line", matching lines per pattern
+        for record, n in rows:
+            for pattern_id in record.split(':', 1)[0].split(','):
+                data[int(pattern_id) - 1] += n
+    elif mode == 'total':
+        data += sum(n for _, n in rows)
+    else:
+        counts = dict(data)
+        for key, n in rows:
+            counts[key] = counts.get(key, 0) + n
+        data = list(counts.items())
+    return data, end
+
+
+def checkpoint_search(args: PythonArgs, query: regex.Query | None, files: list[str],
+                      parallel: bool = False, names: list[str] | None = None) -> list[str]:
+    '''
+    --checkpoint: counts (-c, -g), totals (-t) or unique records (-u) of every
+    file, scanning only what was appended since the last run with the same
+    search. Counts and totals come back formatted; unique records are returned
+    in first-seen order for main_seq to sort and slice, prefixed with their
+    file's entry in names when given (-H).
+    '''
+    if query is None:
+        print_err('error, --checkpoint needs -F, -rp, -g or -s/-e')
+    directory = Path(resolve(args.checkpoint))
+    directory.mkdir(parents=True, exist_ok=True)
+    patterns = search_patterns(args)
+    mode = checkpoint_mode(args)
+    per_pattern = mode == 'total' and len(patterns) > 1 and not args.gen
+
+    def empty():
+        if mode == 'total':
+            return [0] * len(patterns) if per_pattern else 0
+        return []
+
+    merged = {}
+    totals = empty()
+    for n, file_path in enumerate(files):
+        state_path = directory / f'{checkpoint_key(args, patterns, file_path)}.json'
+        st = os.stat(file_path)
+        state = load_state(state_path, file_path)
+        start, data = (state['offset'], state['data']) if state else (0, empty())
+        try:
+            data, end = scan_appended(args, query, patterns, file_path, start, data, parallel)
+        except (OSError, ValueError) as e:
+            print_err(f'error, --checkpoint {file_path}: {e}')
+        save_state(state_path, {
+            'version': STATE_VERSION,
+            'path': file_path,
+            'dev': st.st_dev,
+            'inode': st.st_ino,
+            'offset': end,
+            'head': head_digest(file_path, end),
+            'data': data,
+        })
+        if mode != 'total':
+            prefix = f'{names[n]}:' if names and mode == 'unique' else ''
+            for key, count in data:
+                merged[prefix + key] = merged.get(prefix + key, 0) + count
+        elif per_pattern:
+            totals = [a + b for a, b in zip(totals, data)]
+        else:
+            totals += data
+
+    if mode == 'counts':
+        return format_counts(list(merged.items()), args)
+    if per_pattern:
+        return format_counts(list(zip(patterns, totals)), args)
+    if mode == 'total':
+        return [str(totals)]
+    return list(merged)
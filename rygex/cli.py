@@ -54,116 +54,333 @@ Examples
 ./rygex.py -p 'SRC=(\d+\.\d+\.\d+\.\d+)\s+DST=123.12.123.12' -f ufw.test
 """
 
-import re, sys, gc
-from typing import Generator
+# Only what a plain -F/-rp/-s search needs is imported here: rygex runs once per
+# call from scripts, so startup counts. Modes that need more (-p, --file,
+# --checkpoint, --stats, the result cache, counts and other formatted output)
+# import it where they branch off.
+import sys, gc
+from contextlib import AbstractContextManager, nullcontext
+from itertools import chain, islice
+from pathlib import Path
+from typing import Iterable, Iterator
 import rygex_ext as regex
-from collections import Counter
-from rygex.args import get_args
-from rygex.python_regex import multi_cpu, rygex_mmap
-from rygex.utils import getting_slice
+from rygex.args import get_args, PythonArgs
+from rygex.utils import getenv, group_refs, print_err, resolve
 from rygex.validation import sense_check
-from rygex.converters import rust_args_parser
-from rygex.formatting import format_counts, gen_keys
-from rygex.parallel import parallel_bytewise_count
+from rygex.converters import rust_args_parser, rust_query, search_patterns
 
 
-def main_seq():
+def stats():
+    '''The --stats collector once main_seq has turned it on, else None.'''
+    module = sys.modules.get('rygex.stats')
+    return module.STATS if module and module.STATS.enabled else None
+
+
+def stats_phase(name: str) -> AbstractContextManager:
+    '''Time a phase of the run for --stats; nothing without it.'''
+    collector = stats()
+    return collector.phase(name) if collector else nullcontext()
+
+
+def stats_count(name: str, n: int) -> None:
+    '''Add n to a --stats count; nothing without it.'''
+    collector = stats()
+    if collector:
+        collector.count(name, n)
+
+
+def streams_output(args: PythonArgs) -> bool:
+    '''
+    True when no later stage needs the full result set, so records can be
+    printed while the scan is still running. Sort, unique, counts and totals
+    all need every record, and so do negative --lines indexes.
+    '''
+    if args.sort or args.unique or args.counts or args.totalcounts:
+        return False
+    if args.gen and not args.format:
+        return False
+    return forward_lines(args.lines)
+
+
+def forward_lines(lines: int | slice | None) -> bool:
+    '''True when --lines only picks records counting from the front, so it can pick them as they arrive.'''
+    if lines is None:
+        return True
+    if isinstance(lines, int):
+        return lines >= 0
+    return all(x is None or x >= 0 for x in (lines.start, lines.stop)) \
+        and (lines.step is None or lines.step > 0)
+
+
+def sorts_records(args: PythonArgs) -> bool:
+    '''True when -S orders the records themselves, not counts or aggregates of them.'''
+    return args.sort and not (args.counts or args.totalcounts or (args.gen and not args.format))
+
+
+def dedupes_records(args: PythonArgs) -> bool:
+    '''True when -u alone (no sort, counts or totals) decides which records print.'''
+    return args.unique and not (args.sort or args.counts or args.totalcounts or (args.gen and not args.format))
+
+
+def stream_lines(batches: Iterable[list[str]], lines: int | slice | None) -> Iterator[str]:
+    '''Flatten record batches from Rust, applying a non-negative --lines slice.'''
+    batches = iter(batches)
+    first = next(batches, None)
+    if first is None:
+        print('No Pattern Found')
+        sys.exit(0)
+    records = chain(first, chain.from_iterable(batches))
+    if lines is None:
+        return records
+    if isinstance(lines, int):
+        return islice(records, lines, lines + 1)
+    return islice(records, lines.start, lines.stop, lines.step)
+
+
+def pick_lines(batches: Iterable[list[str]], lines: int | slice | None) -> Iterable[str]:
+    '''stream_lines, or for --lines counting from the back, the records it picks once all have arrived.'''
+    if forward_lines(lines):
+        return stream_lines(batches, lines)
+    records = list(stream_lines(batches, None))
+    return [records[lines]] if isinstance(lines, int) else records[lines]
+
+
+def write_arrow(parts: Iterable[bytes]) -> list[str]:
+    '''Write the --format arrow stream to stdout as it is scanned, leaving no lines to print.'''
+    out = sys.stdout.buffer
+    for part in parts:
+        out.write(part)
+        stats_count('arrow bytes', len(part))
+    out.flush()
+    return []
+
+
+def pyreg_batches(args: PythonArgs, files: list[str], with_filename: bool) -> Iterator[list[str]]:
+    '''The -p -m search as record batches in input order, file after file.'''
+    from rygex.python_regex import multi_cpu
+    for file_path in files or [None]:
+        for found in multi_cpu(args=args, file_path=file_path and resolve(file_path), n_cores=args.multi):
+            if with_filename and file_path:
+                found = [f'{file_path}:{record}' for record in found]
+            yield found
+
+
+def pyreg_search(args: PythonArgs, file_path: str | None) -> list[str]:
+    '''The Python -p search over one file, or stdin when file_path is None.'''
+    import os, time
+    from rygex.python_regex import chunked_line_reader, multi_cpu, rygex_mmap, rygex_search
+    from rygex.stats import STATS
+    if args.multi:
+        return list(chain.from_iterable(multi_cpu(args=args, file_path=file_path, n_cores=args.multi)))
+    if file_path is None:
+        # piped input can't be mapped, so it is searched a chunk of lines at a time
+        return list(chain.from_iterable(rygex_search(args=args, func_search=lines)
+                                        for lines in chunked_line_reader(10_000, stdin=sys.stdin)))
+    started = time.perf_counter()
+    found = rygex_mmap(args=args, file_path=file_path)
+    if file_path:
+        STATS.chunk('python', None, os.path.getsize(file_path), time.perf_counter() - started)
+    return found
+
+
+def build_indexes(paths: list[Path]) -> list[str]:
+    '''--build-index: index each file and report where the index went.'''
+    from rygex.files import INDEX_SUFFIX
+    report = []
+    for path in paths:
+        if not Path(resolve(path)).is_file():
+            print_err(f'error, --build-index {path} is not a file')
+        try:
+            blocks = regex.build_index(resolve(path))
+        except (OSError, ValueError) as e:
+            print_err(f'error, could not index {path}: {e}')
+        report.append(f'{path}: {blocks} blocks indexed in {path}{INDEX_SUFFIX}')
+    return report
+
+
+def main_seq(argv: list[str] | None = None):
     '''main sequence for arguments to run'''
-    pattern_search: list[str] = []
-    args = get_args()
+    args = get_args(argv)
 
-    sense_check(args=args, argTty=sys.stdin.isatty())
+    if args.stats:
+        from rygex.stats import STATS
+        STATS.enable(args.stats)
 
-    rp = rust_args_parser(args)
-    if args.gen:
-        if args.multi:
-            counts = parallel_bytewise_count(args.gen, str(args.file), args.multi)
-            return format_counts(list(counts.items()), args)
-        else:
-            count_dict = Counter()
-            split_int = getting_slice(args.gen)
-            count_dict.update(gen_keys(regex.FileRegexGen, args.gen[0], str(args.file), split_int))
-            pattern_search_list = list(count_dict.items())
-            return format_counts(pattern_search_list, args)
+    if args.build_index:
+        return build_indexes(args.build_index)
+    if args.serve:
+        from rygex.daemon import serve
+        serve(args.serve)
+        return []
 
-    if args.start:
+    with stats_phase('setup'):
+        sense_check(args=args, argTty=sys.stdin.isatty())
+        files = []
+        if args.file:
+            from rygex.files import expand_paths
+            files = expand_paths(args.file, args.exclude)
+    if args.file and not files:
+        print_err('error, --file matched no files')
+
+    # the cache is opt-in: piped input can't be identified, checkpointed runs
+    # must always scan, and Arrow output isn't lines
+    if not args.cache or not files or args.checkpoint or args.format == 'arrow':
+        return run_search(args, files)
+    from rygex.cache import load_result, result_key, store_result
+    with stats_phase('cache'):
+        key = result_key(args, files)
+        cached = load_result(key)
+    if cached is not None:
+        stats_count('cached', len(cached))
+        return cached
+    return store_result(key, run_search(args, files))
 
-        if args.multi:
-            pattern_search = regex.extract_fixed_spans_parallel(**rp)
-        else:
-            pattern_search = regex.extract_fixed_spans(**rp)
 
+def run_search(args: PythonArgs, files: list[str]):
+    '''Run the search over files (stdin when empty) and return the output lines.'''
+    paths = [resolve(path) for path in files]
+    rp = rust_args_parser(args, paths)
     multi = True if args.multi else False
+    # counts and totals aggregate across files, so only listed records get a prefix,
+    # naming the files as given even when a server opens them from the client's directory
+    with_filename = args.with_filename and not (args.counts or args.totalcounts)
+    names = (files or True) if with_filename else False
 
-    if args.fixed_string:
-        if args.totalcounts:
-            return regex.total_count_fixed_str(args.fixed_string, rp['file_path'], multi, rp['case_insensitive'])
-        if args.multi:
-            pattern_search = regex.extract_fixed_lines_parallel(
-                file_path=rp['file_path'],
-                pattern=args.fixed_string,
-                case_insensitive=rp['case_insensitive']                
-            )
-        else:
-            pattern_search = regex.extract_fixed_lines(
-                file_path=rp['file_path'],
-                pattern=args.fixed_string,
-                case_insensitive=rp['case_insensitive']
-            )
-    if args.pyreg:
-        if args.multi:
-            import itertools
-            pattern_search = list(itertools.chain.from_iterable(multi_cpu(args=args, file_path=str(args.file), n_cores=args.multi)))
-        else:
-            pattern_search = rygex_mmap(args=args, file_path=args.file)
+    with stats_phase('search'):
+        query = rust_query(args, rp)
 
-    if args.rpyreg:
-        if len(args.rpyreg) > 1:
-            cg_str: str = args.rpyreg[1]
-            cg_list = cg_str.split(' ')
-            cg_list = [int(x) for x in cg_list]
-        else:
-            cg_list = None
+        if args.checkpoint:
+            from rygex.checkpoint import checkpoint_mode, checkpoint_search
+        if args.checkpoint and checkpoint_mode(args) != 'unique':
+            found = checkpoint_search(args, query, paths, parallel=multi)
+            if not found:
+                print('No Pattern Found')
+                sys.exit(0)
+            return found
 
-        if args.totalcounts:
-            return regex.total_count(args.rpyreg[0], str(args.file), multi)
+        if args.agg:
+            from rygex.formatting import DEFAULT_PERCENTILES, format_aggregates
+            rows = query.aggregate(rp['file_path'], group_refs(args.agg[0])[0],
+                                   by=group_refs(args.agg[1]) if len(args.agg) > 1 else [],
+                                   percentiles=args.percentiles or DEFAULT_PERCENTILES, parallel=multi)
+            if not rows:
+                print('No Pattern Found')
+                sys.exit(0)
+            stats_count('groups', len(rows))
+            return format_aggregates(rows, args)
+        if args.histogram:
+            from rygex.formatting import DEFAULT_BUCKET, format_histogram
+            start, series = query.histogram(rp['file_path'], group_refs(args.histogram[0])[0],
+                                            time_format=args.time_format or 'syslog', year=args.year,
+                                            bucket_seconds=args.bucket or DEFAULT_BUCKET,
+                                            by=group_refs(args.histogram[1]) if len(args.histogram) > 1 else [],
+                                            parallel=multi)
+            if not series:
+                print('No Pattern Found')
+                sys.exit(0)
+            stats_count('buckets', len(series[0][1]))
+            return format_histogram(start, series, args)
+        # sketches of a fixed size per chunk, however many distinct records there are
+        if args.approx is not None and query is not None:
+            from rygex.formatting import format_counts
+            if args.totalcounts:
+                distinct = query.approx_distinct(rp['file_path'], error=args.approx, parallel=multi)
+                if not distinct:
+                    print('No Pattern Found')
+                    sys.exit(0)
+                return [str(distinct)]
+            counts = query.heavy_hitters(rp['file_path'], error=args.approx, parallel=multi)
+            if not counts:
+                print('No Pattern Found')
+                sys.exit(0)
+            stats_count('distinct', len(counts))
+            return format_counts(counts, args)
+        # records are sorted in Rust as the scan goes, spilling to disk past --sort-memory
+        if sorts_records(args) and query is not None and not args.checkpoint:
+            batches = query.sorted(rp['file_path'], key=args.sort_key or 'auto', descending=args.rev,
+                                   unique=args.unique, parallel=multi, with_filename=names,
+                                   memory_limit=args.sort_memory, temp_dir=getenv('TMPDIR'))
+            return pick_lines(batches, args.lines)
+        # repeats are dropped in Rust, so only distinct records reach Python
+        if dedupes_records(args) and query is not None and not args.checkpoint:
+            batches = query.unique(rp['file_path'], parallel=multi, with_filename=names)
+            return pick_lines(batches, args.lines)
+        if args.format == 'arrow':
+            return write_arrow(query.arrow(rp['file_path'], parallel=multi, with_filename=names))
+        # the scan runs as the records are printed, so its time lands in "print"
+        if streams_output(args) and query is not None:
+            batches = query.stream(rp['file_path'], parallel=multi, with_filename=names)
+            return stream_lines(batches, args.lines)
+        if streams_output(args) and args.pyreg and args.multi:
+            return stream_lines(pyreg_batches(args, files, with_filename), args.lines)
 
-        if args.multi:
-            pattern_search = regex.find_joined_matches_in_file_by_line_parallel(args.rpyreg[0], str(args.file), cg_list)
-        else:
-            pattern_search = regex.find_joined_matches_in_file(args.rpyreg[0], str(args.file), cg_list)
+        if ((args.gen and not args.format) or (args.counts and not args.unique)) and query is not None:
+            from rygex.formatting import format_counts, top_k_request
+            counts = query.count(rp['file_path'], parallel=multi,
+                                 top_k=top_k_request(args), descending=args.rev)
+            if not counts:
+                print('No Pattern Found')
+                sys.exit(0)
+            stats_count('distinct', len(counts))
+            return format_counts(counts, args)
+
+        patterns = search_patterns(args)
+        if args.totalcounts and len(patterns) > 1:
+            # one pass, matching lines per pattern
+            from rygex.formatting import format_counts
+            totals = query.pattern_totals(rp['file_path'], parallel=multi)
+            return format_counts(list(zip(patterns, totals)), args)
+        if args.totalcounts and (args.rpyreg or args.rpyreg_file):
+            return regex.total_count(patterns[0], rp['file_path'], multi)
+        if args.totalcounts and (args.fixed_string or args.fixed_file):
+            return regex.total_count_fixed_str(patterns[0], rp['file_path'], multi, rp['case_insensitive'])
+
+        pattern_search = search_records(args, query, rp, files, multi, names)
+        stats_count('matched', len(pattern_search))
 
     gc.collect()
     if not pattern_search:
         print('No Pattern Found')
         sys.exit(0)
+    with stats_phase('aggregate'):
+        return aggregate(args, pattern_search)
+
+
+def search_records(args: PythonArgs, query: regex.Query | None, rp: dict, files: list[str],
+                   multi: bool, with_filename: bool | list[str]) -> list[str]:
+    '''Every record found, for main_seq to unique, sort, count or slice.'''
+    if args.checkpoint:
+        from rygex.checkpoint import checkpoint_search
+        return checkpoint_search(args, query, [resolve(path) for path in files], parallel=multi,
+                                 names=files if with_filename else None)
+    if query is not None:
+        return query.collect(rp['file_path'], parallel=multi, with_filename=with_filename)
+    pattern_search: list[str] = []
+    if args.pyreg:
+        for file_path in files or [None]:
+            found = pyreg_search(args, file_path and resolve(file_path))
+            if with_filename and file_path:
+                found = [f'{file_path}:{record}' for record in found]
+            pattern_search.extend(found)
+    return pattern_search
+
+
+def aggregate(args: PythonArgs, pattern_search: list[str]) -> list[str]:
+    '''Unique, sort, count, total or slice the records, as the options ask.'''
     # unique search
     if args.unique:
         pattern_search = list(dict.fromkeys(pattern_search))
     # sort search
     if args.counts != True and args.sort:
-        test_re = re.compile(r'^[\d]{1,3}\.[\d]{1,3}\.[\d]{1,3}\.[\d]{1,3}$')
-        test_ip = test_re.findall(pattern_search[0])
-        if args.sort:
-            if test_ip:
-                import ipaddress
-                pattern_search.sort(key=ipaddress.IPv4Address)
-            else:
-                pattern_search.sort()
-        if args.rev:
-            if test_ip:
-                import ipaddress
-                pattern_search.sort(key=ipaddress.IPv4Address, reverse=True)
-            else:
-                pattern_search.sort(reverse=True)
+        pattern_search = regex.sort_records(pattern_search, key=args.sort_key or 'auto',
+                                            descending=args.rev, parallel=bool(args.multi))
     # counts search
     if args.counts:
-        # from collections import Counter
+        from collections import Counter
+        from rygex.formatting import format_counts
         pattern_search_list = list(Counter(pattern_search).items())
         return format_counts(pattern_search_list, args=args)
     if args.totalcounts:
-        if isinstance(pattern_search, Generator):
-            pattern_search = list(pattern_search)
         return [str(len(pattern_search))]
     # lines search
     if args.lines:
@@ -176,12 +393,22 @@ def main_seq():
         return pattern_search
 
 
-def main():
+def main(argv: list[str] | None = None):
+    printed = 0
     try:
-        for line in main_seq():
-            print(line)
+        output = main_seq(argv)
+        with stats_phase('print'):
+            for line in output:
+                print(line)
+                printed += 1
     except KeyboardInterrupt:
         sys.exit(1)
+    finally:
+        collector = stats()
+        if collector:
+            sys.stdout.flush()
+            collector.count('printed', printed)
+            collector.report()
 
 
 
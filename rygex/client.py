@@ -0,0 +1,91 @@
+'''
+The `rygex` command. When a resident `rygex --serve` is listening, searches of
+files run there and only their output comes back over the socket, which saves
+starting Python and loading rygex for every call. Anything else (piped input,
+no server, a server of another version) runs in this process as usual.
+
+This module is imported on every call, so it only uses what Python has
+already loaded at startup until it knows a server is there.
+'''
+import os, sys
+from rygex.version import __version__
+
+PROTOCOL = 2
+
+
+def default_socket() -> str:
+    '''$XDG_RUNTIME_DIR/rygex.sock, or rygex.sock in the rygex cache directory.'''
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime:
+        return os.path.join(runtime, 'rygex.sock')
+    cache = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache, 'rygex', 'rygex.sock')
+
+
+def socket_path() -> str:
+    '''$RYGEX_SOCKET, or default_socket(). Empty means no server.'''
+    return os.environ.get('RYGEX_SOCKET', default_socket())
+
+
+def searches_files(argv: list[str]) -> bool:
+    '''
+    Whether argv searches --file for text output, since the server can't read
+    our stdin and only sends text back. --stats runs here too, to report on
+    this process rather than the server's.
+    '''
+    if '--serve' in argv or '--format=arrow' in argv or ('--format', 'arrow') in zip(argv, argv[1:]):
+        return False
+    if any(arg == '--stats' or arg.startswith('--stats=') for arg in argv):
+        return False
+    return any(arg in ('-f', '--file') or arg.startswith('--file=')
+               or (arg.startswith('-f') and not arg.startswith('--')) for arg in argv)
+
+
+def run_remote(path: str, argv: list[str]) -> int | None:
+    '''
+    Run argv in the server listening on path, copying its output here, and
+    return its exit status. None if no server of this version answered, in
+    which case nothing has been printed.
+    '''
+    import json, socket
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    request = {'protocol': PROTOCOL, 'version': __version__, 'argv': argv,
+               'cwd': os.getcwd(), 'env': dict(os.environ)}
+    with sock, sock.makefile('rb') as replies:
+        sock.sendall(json.dumps(request).encode() + b'\n')
+        for reply in replies:
+            kind, data = json.loads(reply)
+            if kind == 'o':
+                sys.stdout.write(data)
+            elif kind == 'e':
+                sys.stdout.flush()
+                sys.stderr.write(data)
+                sys.stderr.flush()
+            elif kind == 'x':
+                sys.stdout.flush()
+                return data
+            else:
+                return None  # the server speaks another protocol or version
+    print(f'rygex server on {path} stopped mid-search', file=sys.stderr)
+    return 1
+
+
+def main():
+    argv = sys.argv[1:]
+    # RYGEX_SOCKET= (empty) turns the server off for this call
+    path = socket_path()
+    if path and searches_files(argv) and os.path.exists(path):
+        status = run_remote(path, argv)
+        if status is not None:
+            sys.exit(status)
+    from rygex.cli import main as run_local
+    run_local()
+
+
+if __name__ == '__main__':
+    main()
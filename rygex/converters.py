@@ -1,10 +1,16 @@
+from pathlib import Path
+import rygex_ext as regex
 from rygex.args import PythonArgs
 from rygex.models import RustParsed, new_rustparsed
+from rygex.utils import getting_slice, print_err, resolve
 
-def rust_args_parser(args: PythonArgs) -> dict:
+# rygex_ext reads standard input when given this path
+STDIN_PATH = '-'
+
+def rust_args_parser(args: PythonArgs, files: list[str] | None = None) -> dict:
     rp: RustParsed = new_rustparsed()
-    if args.file:
-        rp['file_path'] = str(args.file)
+    # without --file the input is piped, sense_check has already made sure of that
+    rp['file_path'] = files or STDIN_PATH
     if args.start:
         rp['start_delim'] = args.start[0]
         if len(args.start) > 1:
@@ -48,4 +54,114 @@ def rust_args_parser(args: PythonArgs) -> dict:
     call_args = {k: v for k, v in rp.items() if v is not None}
 
     # now call with keyword-args
-    return call_args
\ No newline at end of file
+    return call_args
+
+
+def read_patterns(path: Path) -> list[str]:
+    '''One pattern per line of a --fixed-file/--rpyreg-file, skipping blank lines.'''
+    with open(resolve(path), encoding='utf-8') as f:
+        patterns = [line.rstrip('\r\n') for line in f if line.strip()]
+    if not patterns:
+        print_err(f'error, pattern file {path} has no patterns')
+    return patterns
+
+
+def rpyreg_patterns(args: PythonArgs) -> list[list[str]]:
+    '''Every -rp as [PATTERN, INDEX?], followed by the lines of --rpyreg-file.'''
+    patterns = [list(p) for p in args.rpyreg or []]
+    if args.rpyreg_file:
+        patterns += [[p] for p in read_patterns(args.rpyreg_file)]
+    return patterns
+
+
+def fixed_patterns(args: PythonArgs) -> list[str]:
+    '''Every -F, followed by the lines of --fixed-file.'''
+    patterns = list(args.fixed_string or [])
+    if args.fixed_file:
+        patterns += read_patterns(args.fixed_file)
+    return patterns
+
+
+def search_patterns(args: PythonArgs) -> list[str]:
+    '''
+    The patterns of the active -rp or -F search, in the order their matches are
+    numbered. Empty for the other modes.
+    '''
+    if args.gen:
+        return []
+    rpyregs = rpyreg_patterns(args)
+    if rpyregs:
+        return [p[0] for p in rpyregs]
+    if args.pyreg:
+        return []
+    return fixed_patterns(args)
+
+
+# compiled queries kept by a resident `rygex --serve`, see keep_queries()
+QUERY_CACHE: dict[str, regex.Query | None] | None = None
+QUERY_CACHE_SIZE = 256
+# the server's request threads share QUERY_CACHE
+QUERY_LOCK = None
+
+
+def keep_queries() -> None:
+    """Reuse compiled queries across searches with the same patterns and options."""
+    import threading
+    global QUERY_CACHE, QUERY_LOCK
+    QUERY_CACHE = {}
+    QUERY_LOCK = threading.Lock()
+
+
+def rust_query(args: PythonArgs, rp: dict) -> regex.Query | None:
+    """
+    Compile the Rust engine for the chosen search mode (-g, -rp, -F or -s/-e),
+    or return None when the mode is handled in Python (-p). Several -rp or -F
+    patterns compile to one multi-pattern query.
+    """
+    if QUERY_CACHE is None:
+        return compile_query(args, rp)
+    import json
+    key = json.dumps([args.format, args.gen, rpyreg_patterns(args), bool(args.pyreg), fixed_patterns(args),
+                      {k: v for k, v in rp.items() if k != 'file_path'}])
+    with QUERY_LOCK:
+        if key not in QUERY_CACHE:
+            if len(QUERY_CACHE) >= QUERY_CACHE_SIZE:
+                QUERY_CACHE.pop(next(iter(QUERY_CACHE)))
+            QUERY_CACHE[key] = compile_query(args, rp)
+        return QUERY_CACHE[key]
+
+
+def compile_query(args: PythonArgs, rp: dict) -> regex.Query | None:
+    if args.format:
+        return rows_query(args)
+    if args.gen:
+        return regex.Query.captures(args.gen[0], getting_slice(args.gen))
+    rpyregs = rpyreg_patterns(args)
+    if len(rpyregs) == 1:
+        return regex.Query.regex(rpyregs[0][0], getting_slice(rpyregs[0]) or None)
+    if rpyregs:
+        if args.agg or args.histogram:
+            print_err('error, --agg and --histogram need a single -rp pattern')
+        if any(len(p) > 1 for p in rpyregs):
+            print_err('error, -rp INDEX is only supported with a single -rp pattern')
+        return regex.Query.regex_set([p[0] for p in rpyregs])
+    if args.pyreg:
+        return None
+    fixed = fixed_patterns(args)
+    if len(fixed) == 1:
+        return regex.Query.fixed(fixed[0], case_insensitive=rp['case_insensitive'])
+    if fixed:
+        return regex.Query.literals(fixed, case_insensitive=rp['case_insensitive'])
+    if args.start:
+        return regex.Query.spans(**{k: v for k, v in rp.items() if k != 'file_path'})
+    return None
+
+
+def rows_query(args: PythonArgs) -> regex.Query:
+    """--format: the -g or single -rp pattern as a Query.rows over its capture groups."""
+    if args.gen:
+        return regex.Query.rows(args.gen[0], getting_slice(args.gen) or None, whole_file=True)
+    rpyregs = rpyreg_patterns(args)
+    if len(rpyregs) > 1:
+        print_err('error, --format needs a single -rp pattern')
+    return regex.Query.rows(rpyregs[0][0], getting_slice(rpyregs[0]) or None)
@@ -0,0 +1,232 @@
+'''
+`rygex --serve`: a resident rygex answering the searches of `rygex` commands
+over a Unix socket. Between requests it keeps compiled queries, file maps
+(reused while a file's size, mtime and inode are unchanged) and the -m process
+pools, so a repeated query costs little more than its scan.
+
+Each request runs in a thread of its own, up to WORKERS at once, with the
+client's working directory and environment: relative paths are opened from the
+client's directory, and its XDG_CACHE_HOME, HOME and TMPDIR place the result
+cache, checkpoints and sort runs, without touching the server's own.
+Every message is one JSON line: the client sends
+{"protocol", "version", "argv", "cwd", "env"} and gets back ["o", stdout text]
+and ["e", stderr text] pieces, then ["x", exit status]. A client of another
+version, or a search the client should run itself (see for_server), gets
+["r", reason].
+'''
+import io, json, os, signal, socket, sys, threading, traceback
+from contextvars import ContextVar
+from pathlib import Path
+import rygex_ext as regex
+from rygex.args import get_args
+from rygex.client import PROTOCOL, searches_files, socket_path
+from rygex.converters import keep_queries
+from rygex.python_regex import keep_pools, shutdown_pools
+from rygex.utils import REQUEST_CWD, REQUEST_ENV, print_err
+from rygex.version import __version__
+
+# file maps kept open between requests
+MAPS_KEPT = 64
+# requests running at once; the scans of each already spread over the cores
+WORKERS = 8
+# stdout goes to the client in pieces of about this many characters
+SEND_CHARS = 64 * 1024
+
+# the channels of the request running in this thread
+STDOUT: ContextVar['Channel | None'] = ContextVar('STDOUT', default=None)
+STDERR: ContextVar['Channel | None'] = ContextVar('STDERR', default=None)
+
+
+class Shutdown(BaseException):
+    '''SIGTERM: stop serving, without being mistaken for a request's own exit.'''
+
+
+def send(conn: socket.socket, kind: str, data) -> None:
+    conn.sendall(json.dumps([kind, data]).encode() + b'\n')
+
+
+class Channel(io.TextIOBase):
+    '''
+    stdout or stderr of one request, sent to the client as kind messages.
+    Buffered output goes in SEND_CHARS pieces; unbuffered output (stderr) is sent
+    at once, after whatever `before` still holds, so the two stay in order.
+    '''
+
+    def __init__(self, conn: socket.socket, kind: str, buffered: bool, before: 'Channel | None' = None):
+        self.conn = conn
+        self.kind = kind
+        self.buffered = buffered
+        self.before = before
+        self.pending: list[str] = []
+        self.size = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        self.pending.append(text)
+        self.size += len(text)
+        if not self.buffered or self.size >= SEND_CHARS:
+            self.flush()
+        return len(text)
+
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        if self.before is not None:
+            self.before.flush()
+        text = ''.join(self.pending)
+        self.pending.clear()
+        self.size = 0
+        send(self.conn, self.kind, text)
+
+
+class Dispatch(io.TextIOBase):
+    '''
+    The server's sys.stdout or sys.stderr: what a request's thread writes goes to
+    that request's channel, anything else to the server's own stream.
+    '''
+
+    def __init__(self, stream: io.TextIOBase, current: ContextVar):
+        self.stream = stream
+        self.current = current
+
+    def target(self) -> io.TextIOBase:
+        return self.current.get() or self.stream
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        return self.target().write(text)
+
+    def flush(self) -> None:
+        self.target().flush()
+
+
+def for_server(argv: list[str]) -> bool:
+    '''
+    searches_files, checked again on argv as parsed: abbreviations such as
+    `--form arrow` or `--stat` get past its spelling checks, and Arrow output
+    needs a binary stdout no channel has. Argv that doesn't parse is served, so
+    the client gets the error.
+    '''
+    if not searches_files(argv):
+        return False
+    quiet = io.StringIO()
+    tokens = [(var, var.set(quiet)) for var in (STDOUT, STDERR)]
+    try:
+        args = get_args(argv)
+    except SystemExit:
+        return True
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+    return args.format != 'arrow' and not args.stats and not args.serve
+
+
+def run(request: dict, out: Channel, err: Channel) -> int:
+    '''Run one request's rygex command in its client's directory and environment, and return its exit status.'''
+    from rygex.cli import main
+    tokens = [(var, var.set(value)) for var, value in
+              ((STDOUT, out), (STDERR, err), (REQUEST_CWD, request['cwd']), (REQUEST_ENV, request['env']))]
+    try:
+        main(request['argv'])
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        err.write(f'{e.code}\n')
+        return 1
+    except OSError as e:
+        # most likely the client went away; tell it in case it didn't
+        err.write(f'rygex server: {e}\n')
+        return 1
+    except Exception:
+        err.write(traceback.format_exc())
+        return 1
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+    return 0
+
+
+def handle(conn: socket.socket) -> None:
+    with conn, conn.makefile('rb') as requests:
+        try:
+            request = json.loads(requests.readline())
+            if request.get('protocol') != PROTOCOL or request.get('version') != __version__:
+                send(conn, 'r', f'rygex {__version__} is serving')
+                return
+            if not for_server(request['argv']):
+                send(conn, 'r', 'not a search for the server')
+                return
+            out = Channel(conn, 'o', buffered=True)
+            err = Channel(conn, 'e', buffered=False, before=out)
+            status = run(request, out, err)
+            out.flush()
+            send(conn, 'x', status)
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass  # a client that went away or sent nonsense only loses its own request
+
+
+def serve(path: Path | bool = True) -> None:
+    '''
+    Answer requests on the Unix socket at path (True for the default socket)
+    until interrupted or terminated.
+    '''
+    path = Path(socket_path() if path is True else path)
+    if path.exists():
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(str(path))
+            except OSError:
+                path.unlink()  # left behind by a server that didn't shut down
+            else:
+                print_err(f'error, a rygex server is already listening on {path}')
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    def terminate(signum, frame):
+        raise Shutdown
+
+    signal.signal(signal.SIGTERM, terminate)
+    # searches never read the server's own stdin
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+
+    regex.set_map_cache(MAPS_KEPT)
+    keep_queries()
+    keep_pools()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o177)  # only this user may connect
+    try:
+        server.bind(str(path))
+    finally:
+        os.umask(umask)
+    server.listen(64)
+    print(f'rygex {__version__} serving on {path}', file=sys.stderr)
+    streams = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = Dispatch(sys.stdout, STDOUT), Dispatch(sys.stderr, STDERR)
+    slots = threading.BoundedSemaphore(WORKERS)
+
+    def work(conn: socket.socket) -> None:
+        try:
+            handle(conn)
+        finally:
+            slots.release()
+
+    try:
+        while True:
+            conn, _ = server.accept()
+            # with every worker busy, new clients wait in the listen queue
+            slots.acquire()
+            threading.Thread(target=work, args=(conn,), name='rygex-request', daemon=True).start()
+    except (KeyboardInterrupt, Shutdown):
+        pass
+    finally:
+        # requests still running end with the process
+        server.close()
+        path.unlink(missing_ok=True)
+        sys.stdout, sys.stderr = streams
+        shutdown_pools()
+        regex.set_map_cache(0)
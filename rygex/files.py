@@ -0,0 +1,130 @@
+import glob, os, re
+from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple
+from rygex.utils import REQUEST_CWD, resolve
+
+
+# trigram index sidecars written by --build-index, never searched themselves
+INDEX_SUFFIX = '.rygex-index'
+
+
+class ExcludeRule(NamedTuple):
+    regex: re.Pattern
+    negate: bool
+    dir_only: bool
+
+
+def _glob_to_regex(pattern: str) -> str:
+    '''
+    Translate one gitignore glob to a regex body. "*" and "?" stay inside a path
+    component, "**" crosses them.
+    '''
+    out: list[str] = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            out.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('/**', i) and i + 3 == len(pattern):
+            out.append('(?:/.*)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            out.append('.*')
+            i += 2
+        elif pattern[i] == '*':
+            out.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            out.append('[^/]')
+            i += 1
+        elif pattern[i] == '[' and ']' in pattern[i + 2:]:
+            end = pattern.index(']', i + 2)
+            body = pattern[i + 1:end].replace('\\', '\\\\')
+            if body.startswith('!'):
+                body = '^' + body[1:]
+            out.append(f'[{body}]')
+            i = end + 1
+        else:
+            out.append(re.escape(pattern[i]))
+            i += 1
+    return ''.join(out)
+
+
+def compile_excludes(patterns: Iterable[str] | None) -> list[ExcludeRule]:
+    '''
+    gitignore-style rules: a trailing "/" only matches directories, a leading "!"
+    re-includes, and a pattern with a "/" anywhere else is anchored to the
+    searched directory, while one without matches at any depth.
+    '''
+    rules: list[ExcludeRule] = []
+    for pattern in patterns or []:
+        negate = pattern.startswith('!')
+        if negate:
+            pattern = pattern[1:]
+        dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        if not pattern:
+            continue
+        anchored = '/' in pattern
+        body = _glob_to_regex(pattern.lstrip('/'))
+        regex = re.compile(f'^{body}$' if anchored else f'^(?:.*/)?{body}$')
+        rules.append(ExcludeRule(regex=regex, negate=negate, dir_only=dir_only))
+    return rules
+
+
+def is_excluded(rel_path: str, is_dir: bool, rules: list[ExcludeRule]) -> bool:
+    '''The last matching rule wins, like in a .gitignore file.'''
+    excluded = False
+    for rule in rules:
+        if rule.dir_only and not is_dir:
+            continue
+        if rule.regex.match(rel_path):
+            excluded = not rule.negate
+    return excluded
+
+
+def _walk(root: str, rules: list[ExcludeRule]) -> Iterator[str]:
+    '''Regular files below root in sorted order, skipping excluded entries.'''
+    top = resolve(root)
+    for dirpath, dirnames, filenames in os.walk(top):
+        rel_dir = os.path.relpath(dirpath, top)
+        rel_dir = '' if rel_dir == '.' else rel_dir.replace(os.sep, '/') + '/'
+        dirnames[:] = sorted(d for d in dirnames if not is_excluded(rel_dir + d, True, rules))
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            if name.endswith(INDEX_SUFFIX):
+                continue
+            if os.path.isfile(path) and not is_excluded(rel_dir + name, False, rules):
+                # named from root as given, like os.walk(root) would
+                yield root + path[len(top):]
+
+
+def has_glob(spec: str) -> bool:
+    return glob.has_magic(spec)
+
+
+def expand_paths(specs: Iterable[Path], excludes: Iterable[str] | None = None) -> list[str]:
+    '''
+    Turn --file arguments into the files to search, in order and without
+    duplicates. Directories are searched recursively and glob patterns
+    (including "**") are expanded. Excludes apply to what directories and globs
+    turn up; files named explicitly are always searched. Paths are returned as
+    named, relative ones still relative to the client's directory when serving.
+    '''
+    rules = compile_excludes(excludes)
+    files: dict[str, None] = {}
+    for spec in specs:
+        spec = str(spec)
+        if has_glob(spec):
+            for match in sorted(glob.glob(spec, root_dir=REQUEST_CWD.get(), recursive=True)):
+                if os.path.isdir(resolve(match)):
+                    files.update(dict.fromkeys(_walk(match, rules)))
+                elif match.endswith(INDEX_SUFFIX):
+                    continue
+                elif os.path.isfile(resolve(match)) and not is_excluded(match.replace(os.sep, '/'), False, rules):
+                    files[match] = None
+        elif os.path.isdir(resolve(spec)):
+            files.update(dict.fromkeys(_walk(spec, rules)))
+        else:
+            files[spec] = None
+    return list(files)
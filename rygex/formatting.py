@@ -1,4 +1,4 @@
-from typing import Callable
+import time
 from collections import Counter
 from rygex.args import PythonArgs
 
@@ -32,6 +32,119 @@ def format_counts(counts: list[tuple[str,int]], args: PythonArgs) -> list[str]:
     # Format
     return [f"{k:{padding}}Line-Counts = {v}" for k, v in counts]
 
+DEFAULT_PERCENTILES = [50.0, 90.0, 99.0]
+
+
+def format_number(value: float) -> str:
+    '''Whole numbers without a fraction, others to 3 decimal places.'''
+    if value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return f'{value:.3f}'
+
+
+def format_aggregates(rows: list[tuple], args: PythonArgs) -> list[str]:
+    """
+    Given the --agg rows from Rust, (key, count, sum, min, max, mean, percentiles),
+    sort them by sum with --sort (largest first with --rev), apply --lines and
+    return lines like:
+      "{key:<{padding}}count=3 sum=120 min=20 max=60 mean=40 p50=40 ..."
+    or with --format jsonl one JSON object per key.
+    """
+    if args.sort:
+        rows.sort(key=lambda row: row[2], reverse=args.rev)
+    elif args.rev:
+        rows.reverse()
+    if isinstance(args.lines, int):
+        rows = [rows[args.lines]]
+    elif isinstance(args.lines, slice):
+        rows = rows[args.lines]
+
+    names = [f'p{p:g}' for p in args.percentiles or DEFAULT_PERCENTILES]
+    if args.format == 'jsonl':
+        import json
+        return [
+            json.dumps({'key': key, 'count': count, 'sum': total, 'min': low, 'max': high,
+                        'mean': mean, **dict(zip(names, ranks))})
+            for key, count, total, low, high, mean, ranks in rows
+        ]
+    padding = max(len(row[0]) for row in rows) + 4 if rows else 0
+    lines = []
+    for key, count, total, low, high, mean, ranks in rows:
+        fields = [('count', count), ('sum', total), ('min', low), ('max', high), ('mean', mean), *zip(names, ranks)]
+        lines.append(f'{key:{padding}}' + ' '.join(f'{name}={format_number(float(v))}' for name, v in fields))
+    return lines
+
+
+DEFAULT_BUCKET = 60
+
+
+def time_label(seconds: int, step: int) -> str:
+    '''A bucket start as UTC date and time, down to the precision the bucket width needs.'''
+    if step % 86400 == 0:
+        layout = '%Y-%m-%d'
+    elif step % 60 == 0:
+        layout = '%Y-%m-%d %H:%M'
+    else:
+        layout = '%Y-%m-%d %H:%M:%S'
+    return time.strftime(layout, time.gmtime(seconds))
+
+
+def format_histogram(start: int, series: list[tuple[str, list[int]]], args: PythonArgs) -> list[str]:
+    """
+    Given the --histogram series from Rust, (key, count per bucket) with the
+    buckets starting at start (seconds since 1970) and --bucket apart, put the
+    latest bucket first with --rev, pick buckets with --lines and return lines like:
+      "2025-02-01 00:01    12"
+    with BY groups one line per bucket and series:
+      "2025-02-01 00:01    h1    3"
+    or with --format jsonl one JSON object per bucket, with the counts per series
+    under "counts" when there are BY groups.
+    """
+    step = args.bucket or DEFAULT_BUCKET
+    buckets = list(range(len(series[0][1]))) if series else []
+    if args.rev:
+        buckets.reverse()
+    if isinstance(args.lines, int):
+        buckets = [buckets[args.lines]]
+    elif isinstance(args.lines, slice):
+        buckets = buckets[args.lines]
+
+    split = args.histogram is not None and len(args.histogram) > 1
+    if args.format == 'jsonl':
+        import json
+        lines = []
+        for i in buckets:
+            seconds = start + i * step
+            row = {'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(seconds)), 'epoch': seconds}
+            if split:
+                row['counts'] = {key: counts[i] for key, counts in series}
+            else:
+                row['count'] = series[0][1][i]
+            lines.append(json.dumps(row))
+        return lines
+    labels = {i: time_label(start + i * step, step) for i in buckets}
+    padding = max((len(label) for label in labels.values()), default=0) + 4
+    if not split:
+        return [f'{labels[i]:{padding}}{series[0][1][i]}' for i in buckets]
+    key_padding = max(len(key) for key, _ in series) + 4
+    return [f'{labels[i]:{padding}}{key:{key_padding}}{counts[i]}' for i in buckets for key, counts in series]
+
+
+def top_k_request(args: PythonArgs) -> int | None:
+    """
+    When --sort with a leading --lines slice (e.g. -S -r -l :20) only needs the
+    first K rows of the sorted count table, return K so the selection can run
+    in Rust. Returns None when the whole table is needed.
+    """
+    if not args.sort or args.lines is None:
+        return None
+    if isinstance(args.lines, int):
+        return args.lines + 1 if args.lines >= 0 else None
+    start, stop, step = args.lines.start, args.lines.stop, args.lines.step
+    if stop is None or stop < 0 or (start is not None and start < 0) or (step is not None and step < 0):
+        return None
+    return stop
+
 def counter(pattern_search, args: PythonArgs):
     pattern_search_dict = Counter(pattern_search)
     pattern_search_list = []
@@ -42,12 +155,3 @@ def counter(pattern_search, args: PythonArgs):
         return format_counts(pattern_search_list, args=args)
     else:
         return ['0']
-
-def gen_keys(func: Callable, pattern: str, file: str, split_int: list[int], *args):
-    for m in func(pattern, file, *args):
-        # Start with the first group
-        t = m[split_int[0]]
-        # For each subsequent group, prefix with a space
-        for idx in split_int[1:]:
-            t = t + " " + m[idx]
-        yield t
\ No newline at end of file
@@ -1,7 +1,7 @@
 from typing import Optional, TypedDict
 
 class RustParsed(TypedDict, total=False):
-    file_path:           Optional[str]
+    file_path:           Optional[str | list[str]]
     start_delim:         Optional[str]
     start_index:         Optional[int]
     end_delim:           Optional[str]
@@ -1,9 +1,13 @@
-from typing import Iterable, Literal, TypedDict, Any, Generator
-import re, mmap, os, math, sys, gc
+from typing import Iterable, Iterator, Literal, TypedDict, Any, Generator
+import re, mmap, os, math, sys, gc, time
 from pathlib import Path
 from rygex.args import PythonArgs
 from functools import partial
+from contextlib import contextmanager
+from collections import deque
+from itertools import islice
 from rygex.utils import getting_slice, print_err
+from rygex.stats import STATS
 from dataclasses import dataclass
 
 
@@ -128,23 +132,41 @@ def rygex_mmap(args: PythonArgs, file_path): # single threaded
     return parsed.pyreg_last_list
 
 # ——— Globals for worker processes ——————————————
-_mm: mmap.mmap
+# path -> ((size, mtime, inode), map), so a pool reused across searches maps each file once
+_maps: dict[str, tuple[tuple, mmap.mmap]] = {}
+_MAX_MAPS = 16
 
-def _init_worker(mmap_path: str):
-    """Worker initializer: open & mmap the file once, disable GC."""
-    global _mm
-    f = open(mmap_path, 'rb')
-    _mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+def _init_worker():
+    """Worker initializer: disable GC."""
     gc.disable()
 
-def _rygex_worker_lines(args: Any, lines: list[str]) -> list[Any]:
-    return rygex_search(args=args, func_search=lines)
-
-def _rygex_worker_range(args: Any, byte_range: tuple[int,int]) -> list[Any]:
-    start, end = byte_range
-    chunk = _mm[start:end]
+def _mapped(file_path: str) -> mmap.mmap:
+    """The worker's map of file_path, made again if the file has changed since."""
+    st = os.stat(file_path)
+    stamp = (st.st_size, st.st_mtime_ns, st.st_ino)
+    cached = _maps.pop(file_path, None)
+    if cached is None or cached[0] != stamp:
+        with open(file_path, 'rb') as f:
+            cached = (stamp, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    _maps[file_path] = cached
+    if len(_maps) > _MAX_MAPS:
+        _maps.pop(next(iter(_maps)))
+    return cached[1]
+
+# Workers return their records with (pid, bytes, seconds) for --stats.
+def _rygex_worker_lines(args: Any, lines: list[str]) -> tuple[list[Any], tuple]:
+    started = time.perf_counter()
+    found = rygex_search(args=args, func_search=lines)
+    size = sum(len(ln) + 1 for ln in lines)
+    return found, (os.getpid(), size, time.perf_counter() - started)
+
+def _rygex_worker_range(args: Any, task: tuple[str, int, int]) -> tuple[list[Any], tuple]:
+    started = time.perf_counter()
+    file_path, start, end = task
+    chunk = _mapped(file_path)[start:end]
     lines = [ln.decode('utf8', 'ignore') for ln in chunk.splitlines()]
-    return rygex_search(args=args, func_search=lines)
+    found = rygex_search(args=args, func_search=lines)
+    return found, (os.getpid(), end - start, time.perf_counter() - started)
 
 def _compute_byte_ranges(file_path: str, chunk_size_bytes: int) -> list[tuple[int,int]]:
     """Split the file into newline-aligned byte ranges ~chunk_size_bytes."""
@@ -185,7 +207,66 @@ def chunked_line_reader(
         if file_path:
             source.close()
 
+# ——— process pools ——————————————————————————————
+# n_cores -> pool, kept between searches once keep_pools() is called
+_pools: dict[int, Any] = {}
+_keep_pools = False
+# the server's request threads share _pools
+_pools_lock = None
+
+def keep_pools() -> None:
+    """Reuse process pools across searches, for a resident `rygex --serve`."""
+    import threading
+    global _keep_pools, _pools_lock
+    _keep_pools = True
+    _pools_lock = threading.Lock()
+
+def shutdown_pools() -> None:
+    for pool in _pools.values():
+        pool.shutdown(cancel_futures=True)
+    _pools.clear()
+
+@contextmanager
+def process_pool(n_cores: int) -> Iterator[Any]:
+    """A pool of n_cores workers: a kept one if keep_pools() was called, else a new one."""
+    # importing here to shave off some mseconds from import time if multi not used
+    from concurrent.futures import ProcessPoolExecutor
+    if not _keep_pools:
+        with ProcessPoolExecutor(max_workers=n_cores, initializer=_init_worker) as pool:
+            yield pool
+        return
+    with _pools_lock:
+        if n_cores not in _pools:
+            # forking the threaded server could copy a lock another request holds
+            import multiprocessing
+            _pools[n_cores] = ProcessPoolExecutor(max_workers=n_cores, initializer=_init_worker,
+                                                  mp_context=multiprocessing.get_context('forkserver'))
+        pool = _pools[n_cores]
+    yield pool
+
 # ——— multi_cpu that picks the right reader/worker ————
+def ordered_window(executor, worker_fn, tasks: Iterable[Any], window: int) -> Iterator[Any]:
+    """
+    Submit tasks lazily with at most `window` in flight, and yield their results
+    in task order as soon as the oldest one is done. Only `window` tasks and
+    results are ever held, however long `tasks` is.
+    """
+    tasks = iter(tasks)
+    pending: deque = deque()
+    for task in islice(tasks, window):
+        pending.append(executor.submit(worker_fn, task))
+    try:
+        while pending:
+            result = pending.popleft().result()
+            for task in islice(tasks, 1):
+                pending.append(executor.submit(worker_fn, task))
+            yield result
+    finally:
+        # an abandoned search shouldn't keep a reused pool busy
+        for future in pending:
+            future.cancel()
+
+
 def multi_cpu(
     args: PythonArgs,
     n_cores: int | None = 8,
@@ -193,46 +274,35 @@ def multi_cpu(
     # for line-reader
     chunk_size: int = 10_000,
     # for mmap reader
-    chunk_size_bytes: int = 100 * 1024 * 1024
-) -> Iterable[Any]:
+    chunk_size_bytes: int = 100 * 1024 * 1024,
+    tasks_per_core: int = 2
+) -> Iterator[list[Any]]:
     """
     Parallel regex over either:
      - mmap-sliced byte-ranges if file_path is a real file
-     - or line-based chunks otherwise.
+     - or line-based chunks otherwise (stdin is read as the chunks are needed).
+    Yields each chunk's non-empty results in input order, with at most
+    n_cores * tasks_per_core chunks in flight.
     """
     
-    # importing here to shave off some mseconds from import time if multi not used
-    from concurrent.futures import ProcessPoolExecutor, as_completed
-    # n_cores = n_cores or os.cpu_count() or 1
+    n_cores = n_cores or os.cpu_count() or 1
     use_mmap = bool(file_path and Path(file_path).is_file())
 
-    file_size = os.path.getsize(file_path)
-    #tasks_per_core = 4
-    #n_chunks = max( n_cores * tasks_per_core, 1 )
-    n_chunks = n_cores * 20
-    chunk_size_bytes = math.ceil( file_size / n_chunks )
-
-
     if use_mmap:
+        # ~20 chunks per core for an even spread, but never more than chunk_size_bytes
+        n_chunks = n_cores * 20
+        chunk_size_bytes = max(1, min(chunk_size_bytes, math.ceil(os.path.getsize(file_path) / n_chunks)))
         # Prepare byte-ranges & mmap-worker
-        ranges = _compute_byte_ranges(file_path, chunk_size_bytes)
+        tasks = ((file_path, start, end) for start, end in _compute_byte_ranges(file_path, chunk_size_bytes))
         worker_fn = partial(_rygex_worker_range, args)
-        executor_kwargs = {
-            'initializer': _init_worker,
-            'initargs': (file_path,)
-        }
-        tasks = ranges
     else:
         # Prepare line-reader & line-worker
-        reader = partial(chunked_line_reader,
-                         chunk_size,
-                         file_path,
-                         sys.stdin if not sys.stdin.isatty() else None)
+        tasks = chunked_line_reader(chunk_size, file_path,
+                                    sys.stdin if not sys.stdin.isatty() else None)
         worker_fn = partial(_rygex_worker_lines, args)
-        executor_kwargs = {}
-        tasks = list(reader())
 
-    with ProcessPoolExecutor(max_workers=n_cores, **executor_kwargs) as executor:
-        futures = [executor.submit(worker_fn, t) for t in tasks]
-        for fut in as_completed(futures):
-            yield fut.result()
\ No newline at end of file
+    with process_pool(n_cores) as executor:
+        for found, (pid, size, seconds) in ordered_window(executor, worker_fn, tasks, n_cores * tasks_per_core):
+            STATS.chunk('process', pid, size, seconds)
+            if found:
+                yield found
@@ -0,0 +1,102 @@
+import sys, time
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class Stats:
+    '''
+    --stats: wall time per phase of a run, what was matched and printed, and the
+    chunk timings of every worker, from the Rust scans and the -p process pool.
+    '''
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.enabled = False
+        self.format = 'text'
+        self.started = time.perf_counter()
+        self.phases: dict[str, float] = {}
+        self.counts: dict[str, int] = {}
+        # (pool, worker, bytes, seconds) per chunk
+        self.chunks: list[tuple[str, int | None, int, float]] = []
+        self.scan: dict = {}
+
+    def enable(self, fmt: str = 'text') -> None:
+        import rygex_ext
+        self.enabled = True
+        self.format = fmt
+        rygex_ext.set_stats(True)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name: str, n: int) -> None:
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def chunk(self, pool: str, worker: int | None, size: int, seconds: float) -> None:
+        if self.enabled:
+            self.chunks.append((pool, worker, size, seconds))
+
+    def collect(self) -> dict:
+        '''Everything gathered so far, with the Rust scan stats and per-worker totals.'''
+        import rygex_ext
+        scan = rygex_ext.take_stats()
+        for worker, size, seconds in scan.pop('chunks'):
+            self.chunks.append(('rayon' if worker is not None else 'main', worker, size, seconds))
+        for key, value in scan.items():
+            self.scan[key] = self.scan.get(key, 0) + value
+        workers: dict[tuple, list] = {}
+        for pool, worker, size, seconds in self.chunks:
+            total = workers.setdefault((pool, worker), [0, 0, 0.0])
+            total[0] += 1
+            total[1] += size
+            total[2] += seconds
+        busy = [seconds for _, _, seconds in workers.values()]
+        return {
+            'total_seconds': time.perf_counter() - self.started,
+            'phases': self.phases,
+            'counts': self.counts,
+            'scan': self.scan,
+            'workers': [
+                {'pool': pool, 'worker': worker, 'chunks': n, 'bytes': size, 'seconds': seconds}
+                for (pool, worker), (n, size, seconds) in sorted(workers.items(), key=lambda w: (w[0][0], w[0][1] or 0))
+            ],
+            # slowest worker over the average: 1.0 is a perfectly even split
+            'imbalance': max(busy) / (sum(busy) / len(busy)) if busy and sum(busy) else None,
+        }
+
+    def report(self) -> None:
+        '''Write the stats to stderr, as text or as one line of JSON.'''
+        import json, os
+        stats = self.collect()
+        if self.format == 'json':
+            print(json.dumps(stats), file=sys.stderr)
+            return
+        scan = stats['scan']
+        lines = [f"rygex stats ({stats['total_seconds']:.3f}s, pid {os.getpid()})"]
+        if scan.get('bytes'):
+            lines.append(f"  scanned   {scan['bytes']:,} bytes, {scan['lines']:,} lines, "
+                         f"{scan['maps']} files mapped in {scan['map_seconds']:.3f}s")
+        for name, n in stats['counts'].items():
+            lines.append(f'  {name:<9} {n:,}')
+        for name, seconds in stats['phases'].items():
+            lines.append(f'  {name:<9} {seconds:.3f}s')
+        if scan.get('convert_seconds'):
+            lines.append(f"  to python {scan['convert_seconds']:.3f}s (of search)")
+        for w in stats['workers']:
+            worker = '' if w['worker'] is None else f" {w['worker']}"
+            rate = w['bytes'] / w['seconds'] / 2**20 if w['seconds'] else 0.0
+            lines.append(f"  {w['pool'] + worker:<9} {w['chunks']} chunks, {w['bytes']:,} bytes, "
+                         f"{w['seconds']:.3f}s busy, {rate:,.1f} MiB/s")
+        if stats['imbalance'] is not None and len(stats['workers']) > 1:
+            lines.append(f"  imbalance {stats['imbalance']:.2f}x (slowest worker / mean)")
+        print('\n'.join(lines), file=sys.stderr)
+
+
+STATS = Stats()
@@ -1,4 +1,25 @@
-import sys
+import os, sys
+from contextvars import ContextVar
+from pathlib import Path
+
+# the working directory and environment of the client whose search a
+# `rygex --serve` thread is running; None outside the server
+REQUEST_CWD: ContextVar[str | None] = ContextVar('REQUEST_CWD', default=None)
+REQUEST_ENV: ContextVar[dict[str, str] | None] = ContextVar('REQUEST_ENV', default=None)
+
+def getenv(name: str, default: str | None = None) -> str | None:
+    '''os.environ.get, from the client's environment when serving its search.'''
+    env = REQUEST_ENV.get()
+    return (os.environ if env is None else env).get(name, default)
+
+def resolve(path: str | Path) -> str:
+    '''path to open: a relative one is taken from the client's directory when serving its search.'''
+    cwd = REQUEST_CWD.get()
+    return str(path) if cwd is None else os.path.join(cwd, path)
+
+def cache_home() -> Path:
+    '''$XDG_CACHE_HOME/rygex, or ~/.cache/rygex.'''
+    return Path(getenv('XDG_CACHE_HOME') or os.path.join(getenv('HOME') or Path.home(), '.cache')) / 'rygex'
 
 def print_err(msg):
     '''
@@ -15,4 +36,8 @@ def getting_slice(args_field: list[str]):
     except IndexError:
         split_str = []
     split_int = [int(i) for i in split_str]
-    return split_int
\ No newline at end of file
+    return split_int
+
+def group_refs(groups: str) -> list[int | str]:
+    '''Space separated capture groups, as numbers or names: "1 src" -> [1, 'src'].'''
+    return [int(g) if g.isdigit() else g for g in groups.split()]
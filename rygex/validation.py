@@ -1,5 +1,6 @@
+import os
 from rygex.args import PythonArgs
-from rygex.utils import print_err
+from rygex.utils import print_err, resolve
 
 def sense_check(args: PythonArgs, argTty: bool=False):
     '''
@@ -11,9 +12,14 @@ def sense_check(args: PythonArgs, argTty: bool=False):
         print_err('Requires stdin from somewhere, either from --file or pipe')
 
     # Removed the required field for start, with the intention to use either start or pyreg, and build a pyreg function
-    if not args.start and not args.pyreg and not args.rpyreg and not args.fixed_string and not args.gen:
+    if not (args.start or args.pyreg or args.rpyreg or args.rpyreg_file
+            or args.fixed_string or args.fixed_file or args.gen):
         print_err('This programme requires the (--start --end) or -p or -rp or - F flag to pattern match properly')
 
+    for pattern_file in (args.fixed_file, args.rpyreg_file):
+        if pattern_file and not os.path.isfile(resolve(pattern_file)):
+            print_err(f'error, pattern file {pattern_file} does not exist')
+
     if args.pyreg and len(args.pyreg) > 2:
         print_err('--pyreg can only have 2 args... search pattern and option')
 
@@ -38,5 +44,60 @@ def sense_check(args: PythonArgs, argTty: bool=False):
         if not args.end:
             print_err('error, --start requires --end ')
 
-    if args.file and not args.file.is_file():
-        print_err(f'error, --file {args.file} does not exist')
\ No newline at end of file
+    if args.format:
+        if not (args.rpyreg or args.rpyreg_file or args.gen):
+            print_err('error, --format needs -rp or -g, whose capture groups become its columns')
+        if args.counts or args.totalcounts or args.checkpoint:
+            print_err('error, --format writes rows, it can not be used with -c, -t or --checkpoint')
+        if args.format == 'arrow' and (args.unique or args.sort or args.lines is not None):
+            print_err('error, --format arrow streams every row, it can not be used with -u, -S or -l')
+
+    if args.agg:
+        if len(args.agg) > 2:
+            print_err('--agg takes a VALUE group and optionally the BY groups, e.g. --agg 3 "1 2"')
+        if not (args.rpyreg or args.rpyreg_file or args.gen):
+            print_err('error, --agg needs -rp or -g, whose capture groups it aggregates')
+        if args.counts or args.totalcounts or args.unique or args.checkpoint or args.format == 'arrow':
+            print_err('error, --agg can not be used with -c, -t, -u, --checkpoint or --format arrow')
+    if args.percentiles and not args.agg:
+        print_err('error, --percentiles needs --agg')
+    if any(not 0 <= p <= 100 for p in args.percentiles or []):
+        print_err('error, --percentiles must be between 0 and 100')
+
+    if (args.sort_key or args.sort_memory) and not args.sort:
+        print_err('error, --sort-key and --sort-memory need -S')
+    if (args.sort_key or args.sort_memory) and (args.counts or args.agg):
+        print_err('error, --sort-key and --sort-memory order records, -c and --agg sort by their totals')
+
+    if args.approx is not None:
+        if not (args.counts or args.gen or (args.unique and args.totalcounts)):
+            print_err('error, --approx needs -c or -g (frequent records) or -u -t (distinct count)')
+        if args.pyreg or args.checkpoint or args.agg or args.histogram or args.format:
+            print_err('error, --approx can not be used with -p, --checkpoint, --agg, --histogram or --format')
+        if not 0 < args.approx < 1:
+            print_err('error, --approx ERROR must be between 0 and 1, e.g. 0.01')
+
+    if args.histogram:
+        if len(args.histogram) > 2:
+            print_err('--histogram takes a TIME group and optionally the BY groups, e.g. --histogram 1 "2"')
+        if not (args.rpyreg or args.rpyreg_file or args.gen):
+            print_err('error, --histogram needs -rp or -g, whose capture groups it reads')
+        if (args.counts or args.totalcounts or args.unique or args.sort or args.agg
+                or args.checkpoint or args.format == 'arrow'):
+            print_err('error, --histogram can not be used with -c, -t, -u, -S, --agg, --checkpoint or --format arrow')
+    if (args.bucket or args.time_format or args.year is not None) and not args.histogram:
+        print_err('error, --bucket, --time-format and --year need --histogram')
+    if args.year is not None and (args.time_format or 'syslog') != 'syslog':
+        print_err('error, --year is only for --time-format syslog, whose times have no year')
+
+    if args.checkpoint:
+        if not args.file:
+            print_err('error, --checkpoint needs --file, piped input can not be resumed')
+        if not (args.counts or args.unique or args.totalcounts or args.gen):
+            print_err('error, --checkpoint needs -c, -u or -t')
+
+    if args.file:
+        from rygex.files import has_glob
+    for path in args.file or []:
+        if not has_glob(str(path)) and not os.path.exists(resolve(path)):
+            print_err(f'error, --file {path} does not exist')
\ No newline at end of file
@@ -1,4 +1,34 @@
 # regex.pyi
+"""Rust extension behind rygex.
+
+Thread safety:
+
+- Every file scan (``find_joined_*``, ``extract_fixed_*``, ``total_count*``,
+  ``Query.collect``/``count``/``stream``, ``FileRegexGen``) and the in-memory
+  ``findall_captures_*``/``search`` helpers release the GIL while they run, so
+  calls made from a ``ThreadPoolExecutor`` scan in parallel.
+- ``Query`` and ``Regex`` objects are immutable once built and can be shared
+  by any number of threads.
+- ``FileRegexGen``, ``RustRegexGen`` and ``RecordStream`` are iterators: each
+  one should be consumed by a single thread. ``RustRegexGen`` keeps the GIL,
+  since it pulls its lines from a Python iterator.
+- Calls with ``parallel=True`` (and the ``*_parallel`` functions) share the one
+  global rayon pool, sized by ``RAYON_NUM_THREADS``; combining them with many
+  Python threads oversubscribes the CPU rather than adding throughput.
+- Files are memory mapped; do not truncate a file while it is being scanned.
+
+gzip, zstd and xz input (files or stdin) is detected by its magic bytes and
+decompressed on the fly, except by ``FileRegexGen``. With ``parallel=True``,
+zstd frames and BGZF blocks are decompressed on the rayon pool.
+
+``build_index`` writes a trigram index next to a file. While the file's size,
+mtime and inode still match, ``Query`` searches (except ``captures``) and
+``total_count*`` only scan the blocks of that file that can hold a match.
+
+A ``file_path`` of ``"-"`` reads standard input instead, in newline-aligned
+chunks read ahead on a background thread. Stdin can only be consumed once.
+``FileRegexGen`` needs a real file.
+"""
 from typing import List, Optional, Any, Iterable, Iterator, Sequence, TypeVar
 
 class Regex:
@@ -31,8 +61,32 @@ def extract_fixed_spans_parallel(file_path: str, start_delim: str, start_index:
                                  omit_first: Optional[int], omit_last: Optional[int], print_line_on_match: bool, case_insensitive: bool) -> list[str]: ...
 def extract_fixed_lines(file_path: str, pattern: str, case_insensitive: bool) -> list[str]: ...
 def extract_fixed_lines_parallel(file_path: str, pattern: str, case_insensitive: bool) -> list[str]: ...
-def total_count(pattern: str, file_path: str, parallel: bool) -> list[str]: ...
-def total_count_fixed_str(pattern: str, file_path: str, parallel: bool, case_insensitive: bool) -> list[str]: ...
+def total_count(pattern: str, file_path: str | list[str], parallel: bool) -> list[str]: ...
+def total_count_fixed_str(pattern: str, file_path: str | list[str], parallel: bool, case_insensitive: bool) -> list[str]: ...
+def total_count_appended(pattern: str, file_path: str, start: int = 0, parallel: bool = False,
+                         fixed_string: bool = False, case_insensitive: bool = False) -> tuple[int, int]: ...
+def build_index(file_path: str, block_bytes: int = 1 << 20) -> int: ...
+def set_map_cache(size: int) -> None:
+    """
+    Keep up to ``size`` file maps open between calls, reused while a file's
+    size, mtime and inode are unchanged; 0 closes them and maps every call.
+    """
+def sort_records(records: list[str], key: str = "auto", descending: bool = False,
+                 unique: bool = False, parallel: bool = False) -> list[str]:
+    """
+    ``records`` sorted by ``key``: "lexical", "numeric", "ip" (IPv4 then IPv6),
+    "natural" (digit runs as numbers) or "auto" (ip when the first record is an
+    address, else lexical). Records that aren't numbers or addresses go last.
+    """
+def set_stats(enabled: bool = True) -> None:
+    """Start (or stop) collecting process-wide scan stats, clearing any collected."""
+def take_stats() -> dict[str, Any]:
+    """
+    Scan stats since ``set_stats`` or the last call, then cleared: ``maps``,
+    ``map_seconds``, ``bytes``, ``lines``, ``convert_seconds`` (building the lists
+    ``Query.collect``/``count`` return) and ``chunks``, a list of
+    ``(rayon_worker | None, bytes, seconds)`` tuples.
+    """
 
 
 class RustRegexGen:
@@ -61,3 +115,163 @@ class FileRegexGen(Iterator[str]):
     def __next__(self) -> str: ...
 
 def from_file_range(pattern: str, filename: str, start: int, end: int) -> FileRegexGen: ...
+
+
+class RecordStream(Iterator[list[str]]):
+    """
+    Iterator over batches of records produced by a background scan.
+
+    The scan works through the file a few MB at a time and pauses while
+    unread batches are queued, so memory stays flat on any file size. Batches
+    arrive in input order, also for parallel scans.
+    """
+
+    def __iter__(self) -> RecordStream: ...
+    def __next__(self) -> list[str]: ...
+
+
+class ArrowStream(Iterator[bytes]):
+    """
+    The parts of an Arrow IPC stream from `Query.arrow`, produced by a
+    background scan like a `RecordStream`: the schema, the record batches of
+    each scanned chunk with matches, then the end-of-stream marker. Written out
+    in order they can be read by `pyarrow.ipc.open_stream` or DuckDB.
+    """
+
+    def __iter__(self) -> ArrowStream: ...
+    def __next__(self) -> bytes: ...
+
+
+class MatchOffsets:
+    """
+    Byte offsets of matches from `Query.offsets`: a read-only int64 table with a
+    row per match and a (start, end) pair of columns per entry of `groups`
+    (-1, -1 where a capture group did not take part). It supports the buffer
+    protocol, so `numpy.asarray(offsets)` gives a (rows, 2 * len(groups)) array
+    without copying, and `memoryview(offsets)` works without NumPy.
+    """
+
+    @property
+    def groups(self) -> list[int]:
+        """0 for the whole match, then the capture groups, one per column pair."""
+    def __len__(self) -> int: ...
+    def __buffer__(self, flags: int, /) -> memoryview: ...
+
+
+class MappedFile:
+    """
+    A memory-mapped file for reading just the matches you inspect: `slice` and
+    `line` copy out only those bytes, and the buffer protocol gives zero-copy
+    access to the whole file. Compressed files are rejected.
+    """
+
+    def __init__(self, file_path: str) -> None: ...
+    def __len__(self) -> int: ...
+    def slice(self, start: int, end: int) -> bytes: ...
+    def line(self, offset: int) -> bytes:
+        """The line containing byte `offset`, without its newline."""
+    def __buffer__(self, flags: int, /) -> memoryview: ...
+
+
+class Query:
+    """
+    A compiled -g, -rp, -F or -s/-e search that can be run against files
+    repeatedly. Build one with `Query.captures`, `Query.regex`, `Query.fixed`
+    or `Query.spans`. `file_path` may be one path or a list of paths, searched
+    in order as one input; counts are totals across all of them.
+    """
+
+    @staticmethod
+    def regex(pattern: str, groups: list[int] | None = None) -> Query: ...
+    @staticmethod
+    def fixed(pattern: str, case_insensitive: bool = False) -> Query: ...
+    @staticmethod
+    def spans(start_delim: str, start_index: int = 1, end_delim: Optional[str] = None, end_index: int = 1,
+              omit_first: Optional[int] = None, omit_last: Optional[int] = None,
+              print_line_on_match: bool = False, case_insensitive: bool = False) -> Query: ...
+    @staticmethod
+    def captures(pattern: str, groups: list[int] | None = None) -> Query: ...
+    @staticmethod
+    def rows(pattern: str, groups: list[int] | None = None, whole_file: bool = False) -> Query:
+        """
+        Every match as a row of its capture groups (all by default), named after
+        the group or numbered, "full" for the whole match. Records are JSON
+        objects ({"path": ...} first with `with_filename`); `arrow` gives Arrow IPC.
+        """
+    @property
+    def columns(self) -> list[str] | None:
+        """Column names of a rows query, without "path"; None for other queries."""
+    @staticmethod
+    def literals(patterns: list[str], case_insensitive: bool = False) -> Query:
+        """Many literals in one Aho-Corasick pass; records look like "2,5:line"."""
+    @staticmethod
+    def regex_set(patterns: list[str]) -> Query:
+        """Many regexes in one pass; records look like "2,5:line"."""
+    def pattern_totals(self, file_path: str | list[str], parallel: bool = False) -> list[int]:
+        """Matching lines per pattern, for literals/regex_set queries."""
+    def count(self, file_path: str | list[str], parallel: bool = False, top_k: int | None = None,
+              descending: bool = True) -> list[tuple[str, int]]: ...
+    def aggregate(self, file_path: str | list[str], value: int | str, by: list[int | str] = [],
+                  percentiles: list[float] = [50.0, 90.0, 99.0],
+                  parallel: bool = False) -> list[tuple[str, int, float, float, float, float, list[float]]]:
+        """
+        (key, count, sum, min, max, mean, percentiles) of the numbers in capture
+        group `value` per distinct `by` groups joined by spaces ("" without `by`),
+        in first-seen order, for regex, captures and rows queries. Percentiles
+        come from a mergeable sketch and are within 1% of the exact value.
+        """
+    def histogram(self, file_path: str | list[str], time: int | str, time_format: str = "syslog",
+                  bucket_seconds: int = 60, by: list[int | str] = [], year: int | None = None,
+                  parallel: bool = False) -> tuple[int, list[tuple[str, list[int]]]]:
+        """
+        Match counts per `bucket_seconds` of the timestamp in capture group `time`
+        ("syslog", in `year` or else the twelve months up to now, "iso" or "epoch"), per
+        distinct `by` groups joined by spaces ("" without `by`) in first-seen
+        order. Returns the first bucket's start in seconds since 1970 and each
+        series' counts for every bucket up to the last timestamp, zeros included.
+        """
+    def count_appended(self, file_path: str, start: int = 0,
+                       parallel: bool = False) -> tuple[list[tuple[str, int]], int]:
+        """`count` of the complete lines from byte `start` on, and the offset to resume from."""
+    def collect(self, file_path: str | list[str], parallel: bool = False,
+                with_filename: bool | list[str] = False) -> list[str]:
+        """
+        Every record, prefixed with its file's path when `with_filename`, or with
+        the file's name when `with_filename` is a list of names, one per file.
+        """
+    def stream(self, file_path: str | list[str], parallel: bool = False, batch_size: int = 4096,
+               with_filename: bool | list[str] = False) -> RecordStream: ...
+    def approx_distinct(self, file_path: str | list[str], error: float = 0.01,
+                        parallel: bool = False) -> int:
+        """Estimated count of distinct records, from a HyperLogLog sketch with relative standard error `error`."""
+    def heavy_hitters(self, file_path: str | list[str], error: float = 0.01,
+                      parallel: bool = False) -> list[tuple[str, int]]:
+        """
+        The records counted at more than `error` of all records, highest first,
+        which include every record really that frequent. Counts are never low,
+        and with 99% confidence at most `error` of all records high.
+        """
+    def unique(self, file_path: str | list[str], parallel: bool = False, batch_size: int = 4096,
+               with_filename: bool | list[str] = False) -> RecordStream:
+        """The distinct records, each at its first occurrence, deduplicated in Rust as the scan goes."""
+    def sorted(self, file_path: str | list[str], key: str = "auto", descending: bool = False,
+               unique: bool = False, parallel: bool = False, with_filename: bool | list[str] = False,
+               memory_limit: int | None = None, batch_size: int = 4096,
+               temp_dir: str | None = None) -> RecordStream:
+        """
+        The records sorted as by `sort_records`, spilling sorted runs to
+        `temp_dir` (default the temporary directory) past `memory_limit` bytes
+        (default 256 MiB).
+        """
+    def arrow(self, file_path: str | list[str], parallel: bool = False,
+              with_filename: bool | list[str] = False, batch_size: int = 65536) -> ArrowStream:
+        """
+        A rows query's matches as Arrow IPC, with a leading "path" column when
+        `with_filename`. Record batches hold at most `batch_size` rows, and are
+        also cut before a column's values pass the 2 GiB a Utf8 column can address.
+        """
+    def offsets(self, file_path: str, parallel: bool = False) -> MatchOffsets:
+        """
+        Offsets of every match (and capture group) in one uncompressed file, for
+        regex, fixed and captures queries, without building a string per match.
+        """
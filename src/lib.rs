@@ -1,14 +1,35 @@
 use pyo3::prelude::*;
-use pyo3::exceptions::{PyIOError, PyValueError, PyUnicodeDecodeError, PyTypeError};
-use pyo3::types::{PyDict, PyModule, PyString, PyTuple, PyIterator, PyList};
+use pyo3::exceptions::{PyIOError, PyValueError, PyUnicodeDecodeError, PyTypeError, PyBufferError, PyIndexError};
+use pyo3::types::{PyBytes, PyDict, PyModule, PyString, PyTuple, PyIterator, PyList};
+use pyo3::ffi;
 use ::regex::Regex as RustRegex;
 use ::regex::bytes::Regex as RustRegexBytes;
+use ::regex::bytes::{RegexBuilder as RustRegexBytesBuilder, RegexSet as RustRegexSetBytes, RegexSetBuilder};
+use aho_corasick::{AhoCorasick, MatchKind};
 use memmap2::Mmap;
 use std::fs::File;
+use std::path::{Path, PathBuf};
 use rayon::prelude::*;
-use std::collections::{HashMap, VecDeque};
+use std::collections::{HashMap, HashSet, VecDeque};
+use std::hash::Hasher;
 use memchr::memmem::Finder;
-use std::io::Error as IOError;
+use std::io::{Error as IOError, Read, Seek, SeekFrom, Write};
+use std::borrow::Cow;
+use std::ffi::CStr;
+use std::os::raw::{c_char, c_int, c_void};
+use std::sync::{Arc, Mutex};
+use std::sync::atomic::{AtomicBool, AtomicUsize, Ordering};
+use std::sync::mpsc::{sync_channel, Receiver, RecvTimeoutError, SyncSender};
+use std::time::{Duration, Instant};
+
+/// Target size of the newline-aligned chunks a `RecordStream` scans at a time.
+const STREAM_CHUNK_BYTES: usize = 4 * 1024 * 1024;
+/// Batches that may wait in a `RecordStream` channel before the scanner blocks.
+const STREAM_QUEUE_DEPTH: usize = 4;
+/// Most rows in one Arrow record batch from `Query.arrow`, unless asked otherwise.
+const ARROW_BATCH_ROWS: usize = 65536;
+/// File path that makes a scan read standard input instead of a file.
+const STDIN_PATH: &str = "-";
 
 #[pyclass]
 pub struct FileRegexGen {
@@ -27,27 +48,8 @@ pub struct FileRegexGen {
 #[pymethods]
 impl FileRegexGen {
     #[new]
-    fn new(pattern: &str, filename: &str) -> PyResult<Self> {
-        let re = RustRegex::new(pattern)
-            .map_err(|e| PyValueError::new_err(e.to_string()))?;
-        let file = File::open(filename)
-            .map_err(|e: IOError| PyIOError::new_err(e.to_string()))?;
-        let mmap = unsafe {
-            Mmap::map(&file)
-                .map_err(|e| PyIOError::new_err(e.to_string()))?
-        };
-        let s: &str = std::str::from_utf8(&mmap)
-            .map_err(|e| PyUnicodeDecodeError::new_err(e.to_string()))?;
-        let static_str: &'static str = unsafe { std::mem::transmute::<&str, &'static str>(s) };
-        let len = static_str.len();
-        Ok(FileRegexGen {
-            inner: re,
-            mmap,
-            haystack: static_str,
-            start: 0,
-            end: len,
-            pos: 0,
-        })
+    fn new(pattern: &str, filename: &str, py: Python<'_>) -> PyResult<Self> {
+        py.detach(|| FileRegexGen::open(pattern, filename, 0, usize::MAX))
     }
 
     fn __iter__(slf: Py<FileRegexGen>) -> Py<FileRegexGen> {
@@ -58,20 +60,26 @@ impl FileRegexGen {
         if slf.pos >= slf.end {
             return Ok(None);
         }
-        let slice = &slf.haystack[slf.pos..slf.end];
-        if let Some(caps) = slf.inner.captures(slice) {
+        let haystack: &'static str = slf.haystack;
+        let slice = &haystack[slf.pos..slf.end];
+        let inner = &slf.inner;
+        let spans: Option<Vec<Option<(usize, usize)>>> = py.detach(|| {
+            inner.captures(slice)
+                .map(|caps| caps.iter().map(|m| m.map(|mat| (mat.start(), mat.end()))).collect())
+        });
+        if let Some(spans) = spans {
             let mut py_items = Vec::new();
-            for m_opt in caps.iter() {
-                if let Some(mat) = m_opt {
-                    py_items.push(PyString::new(py, mat.as_str()).into_any());
+            for span in &spans {
+                if let Some((s, e)) = *span {
+                    py_items.push(PyString::new(py, &slice[s..e]).into_any());
                 } else {
                     py_items.push(py.None().into_bound(py).into_any());
                 }
             }
-            if let Some(m0) = caps.get(0) {
-                slf.pos += m0.end();
-            } else if let Some(m1) = caps.get(1) {
-                slf.pos += m1.end();
+            if let Some((_, e0)) = spans.first().copied().flatten() {
+                slf.pos += e0;
+            } else if let Some((_, e1)) = spans.get(1).copied().flatten() {
+                slf.pos += e1;
             } else {
                 return Ok(None);
             }
@@ -82,37 +90,48 @@ impl FileRegexGen {
     }
 }
 
+impl FileRegexGen {
+    /// Compile, map and UTF-8 check `filename`, clamping `start..end` to its length.
+    /// Pure Rust, so callers run it with the GIL released.
+    fn open(pattern: &str, filename: &str, start: usize, end: usize) -> PyResult<Self> {
+        let re = RustRegex::new(pattern)
+            .map_err(|e| PyValueError::new_err(e.to_string()))?;
+        let file = File::open(filename)
+            .map_err(|e: IOError| PyIOError::new_err(e.to_string()))?;
+        let mmap = unsafe {
+            Mmap::map(&file)
+                .map_err(|e| PyIOError::new_err(e.to_string()))?
+        };
+        let s: &str = std::str::from_utf8(&mmap)
+            .map_err(|e| PyUnicodeDecodeError::new_err(e.to_string()))?;
+        let static_str: &'static str = unsafe { std::mem::transmute::<&str, &'static str>(s) };
+        let haylen = static_str.len();
+        let s_off = start.min(haylen);
+        let e_off = end.min(haylen);
+        Ok(FileRegexGen {
+            inner: re,
+            mmap,
+            haystack: static_str,
+            start: s_off,
+            end: e_off,
+            pos: s_off,
+        })
+    }
+}
+
 #[pyfunction]
 fn from_file_range(
     pattern: &str,
     filename: &str,
     start: usize,
-    end: usize
+    end: usize,
+    py: Python<'_>,
 ) -> PyResult<FileRegexGen> {
-    let re = RustRegex::new(pattern)
-        .map_err(|e| PyValueError::new_err(e.to_string()))?;
-    let file = File::open(filename)
-        .map_err(|e: IOError| PyIOError::new_err(e.to_string()))?;
-    let mmap = unsafe {
-        Mmap::map(&file)
-            .map_err(|e| PyIOError::new_err(e.to_string()))?
-    };
-    let s: &str = std::str::from_utf8(&mmap)
-        .map_err(|e| PyUnicodeDecodeError::new_err(e.to_string()))?;
-    let static_str: &'static str = unsafe { std::mem::transmute::<&str, &'static str>(s) };
-    let haylen = static_str.len();
-    let s_off = start.min(haylen);
-    let e_off = end.min(haylen);
-    Ok(FileRegexGen {
-        inner: re,
-        mmap,
-        haystack: static_str,
-        start: s_off,
-        end: e_off,
-        pos: s_off,
-    })
+    py.detach(|| FileRegexGen::open(pattern, filename, start, end))
 }
 
+/// Regex matches over lines pulled from a Python iterable. Unlike the file scans,
+/// this keeps the GIL: every line has to be fetched from the Python iterator.
 #[pyclass]
 pub struct RustRegexGen {
     inner: RustRegex,
@@ -215,8 +234,8 @@ impl Regex {
         }
     }
 
-    fn search(&self, text: &str) -> Option<Match> {
-        self.inner.find(text).map(|m| Match {
+    fn search(&self, text: &str, py: Python<'_>) -> Option<Match> {
+        py.detach(|| self.inner.find(text)).map(|m| Match {
             start: m.start() as isize,
             end: m.end() as isize,
             group: m.as_str().to_string(),
@@ -240,53 +259,59 @@ fn compile(pattern: &str) -> PyResult<Regex> {
 }
 
 #[pyfunction]
-fn search(pattern: &str, text: &str) -> PyResult<Option<Match>> {
+fn search(pattern: &str, text: &str, py: Python<'_>) -> PyResult<Option<Match>> {
     let regex = Regex::new(pattern)?;
-    Ok(regex.search(text))
+    Ok(regex.search(text, py))
 }
 
 #[pyfunction]
-fn findall_captures_str(pattern: &str, text: &str) -> PyResult<Vec<Vec<Option<String>>>> {
+fn findall_captures_str(pattern: &str, text: &str, py: Python<'_>) -> PyResult<Vec<Vec<Option<String>>>> {
     let regex = RustRegex::new(pattern)
         .map_err(|e| PyValueError::new_err(e.to_string()))?;
-    let results: Vec<Vec<Option<String>>> = regex.captures_iter(text)
-        .map(|caps| {
-            caps.iter().map(|m| m.map(|mat| mat.as_str().to_string())).collect()
-        })
-        .collect();
+    let results: Vec<Vec<Option<String>>> = py.detach(|| {
+        regex.captures_iter(text)
+            .map(|caps| {
+                caps.iter().map(|m| m.map(|mat| mat.as_str().to_string())).collect()
+            })
+            .collect()
+    });
     Ok(results)
 }
 
 #[pyfunction]
-fn findall_captures_list(pattern: &str, texts: Vec<String>) -> PyResult<Vec<Vec<Vec<Option<String>>>>> {
+fn findall_captures_list(pattern: &str, texts: Vec<String>, py: Python<'_>) -> PyResult<Vec<Vec<Vec<Option<String>>>>> {
     let regex = RustRegex::new(pattern)
         .map_err(|e| PyValueError::new_err(e.to_string()))?;
-    let results: Vec<Vec<Vec<Option<String>>>> = texts
-        .into_iter()
-        .map(|text| {
-            regex.captures_iter(&text)
-                .map(|caps| {
-                    caps.iter().map(|m| m.map(|mat| mat.as_str().to_string())).collect()
-                })
-                .collect()
-        })
-        .collect();
+    let results: Vec<Vec<Vec<Option<String>>>> = py.detach(|| {
+        texts
+            .into_iter()
+            .map(|text| {
+                regex.captures_iter(&text)
+                    .map(|caps| {
+                        caps.iter().map(|m| m.map(|mat| mat.as_str().to_string())).collect()
+                    })
+                    .collect()
+            })
+            .collect()
+    });
     Ok(results)
 }
 
 #[pyfunction]
-fn findall_captures_list_parallel(pattern: &str, texts: Vec<String>) -> PyResult<Vec<Vec<Vec<Option<String>>>>> {
+fn findall_captures_list_parallel(pattern: &str, texts: Vec<String>, py: Python<'_>) -> PyResult<Vec<Vec<Vec<Option<String>>>>> {
     let regex = RustRegex::new(pattern)
         .map_err(|e| PyValueError::new_err(e.to_string()))?;
-    let results: Vec<Vec<Vec<Option<String>>>> = texts.into_par_iter()
-        .map(|text| {
-            regex.captures_iter(&text)
-                .map(|caps| {
-                    caps.iter().map(|m| m.map(|mat| mat.as_str().to_string())).collect()
-                })
-                .collect()
-        })
-        .collect();
+    let results: Vec<Vec<Vec<Option<String>>>> = py.detach(|| {
+        texts.into_par_iter()
+            .map(|text| {
+                regex.captures_iter(&text)
+                    .map(|caps| {
+                        caps.iter().map(|m| m.map(|mat| mat.as_str().to_string())).collect()
+                    })
+                    .collect()
+            })
+            .collect()
+    });
     Ok(results)
 }
 
@@ -299,20 +324,22 @@ fn findall_captures_named_str<'py>(pattern: &str, text: &str, py: Python<'py>) -
         .enumerate()
         .filter_map(|(i, name)| name.map(|n| (n.to_string(), i)))
         .collect();
-    for caps in regex.captures_iter(text) {
+    let all_caps: Vec<Vec<Option<&str>>> = py.detach(|| {
+        regex.captures_iter(text)
+            .map(|caps| caps.iter().map(|m| m.map(|mat| mat.as_str())).collect())
+            .collect()
+    });
+    for caps in all_caps {
         let dict = PyDict::new(py);
-        if let Some(m) = caps.get(0) {
-            dict.set_item("full", m.as_str())?;
+        if let Some(m) = caps[0] {
+            dict.set_item("full", m)?;
         }
-        for i in 1..caps.len() {
-            let key = i.to_string();
-            let value = caps.get(i).map(|m| m.as_str());
-            dict.set_item(key, value)?;
+        for (i, value) in caps.iter().enumerate().skip(1) {
+            dict.set_item(i.to_string(), *value)?;
         }
         for (name, idx) in &name_to_index {
             if *idx == 0 { continue; }
-            let value = caps.get(*idx).map(|m| m.as_str());
-            dict.set_item(name, value)?;
+            dict.set_item(name, caps[*idx])?;
         }
         results.append(dict)?;
     }
@@ -328,15 +355,17 @@ fn findall_captures_named_list_parallel<'py>(pattern: &str, texts: Vec<String>,
         .filter_map(|(i, name)| name.map(|n| (n.to_string(), i)))
         .collect();
 
-    let raw_results: Vec<Vec<Vec<Option<String>>>> = texts.into_par_iter()
-        .map(|text| {
-            regex.captures_iter(&text)
-                .map(|caps| {
-                    caps.iter().map(|m| m.map(|mat| mat.as_str().to_string())).collect()
-                })
-                .collect()
-        })
-        .collect();
+    let raw_results: Vec<Vec<Vec<Option<String>>>> = py.detach(|| {
+        texts.into_par_iter()
+            .map(|text| {
+                regex.captures_iter(&text)
+                    .map(|caps| {
+                        caps.iter().map(|m| m.map(|mat| mat.as_str().to_string())).collect()
+                    })
+                    .collect()
+            })
+            .collect()
+    });
 
     let py_results = PyList::empty(py);
     for matches in raw_results {
@@ -367,40 +396,13 @@ fn find_joined_matches_in_file_by_line_bytes_parallel(
     pattern: &str,
     file_path: &str,
     groups: Option<Vec<usize>>,
+    py: Python<'_>,
 ) -> PyResult<Vec<String>> {
-    let file = File::open(file_path)
-        .map_err(|e| PyIOError::new_err(format!("Failed to open file: {}", e)))?;
-    let mmap = unsafe { Mmap::map(&file) }
-        .map_err(|e| PyIOError::new_err(format!("Failed to mmap file: {}", e)))?;
-    let bytes = &mmap[..];
-    let lines: Vec<&[u8]> = bytes.split(|&b| b == b'\n').collect();
-    let regex = RustRegexBytes::new(pattern)
-        .map_err(|e| PyValueError::new_err(format!("Regex compile error: {}", e)))?;
-    let results: Vec<String> = lines.par_iter()
-        .flat_map(|line| {
-            if let Some(ref indices) = groups {
-                regex.captures_iter(line)
-                    .map(|caps| {
-                        let mut parts = Vec::new();
-                        for &idx in indices {
-                            if let Some(mat) = caps.get(idx) {
-                                let s = String::from_utf8_lossy(mat.as_bytes()).into_owned();
-                                parts.push(s);
-                            }
-                        }
-                        parts.join(" ")
-                    })
-                    .collect::<Vec<String>>()
-            } else {
-                if regex.is_match(line) {
-                    vec![String::from_utf8_lossy(line).into_owned()]
-                } else {
-                    Vec::new()
-                }
-            }
-        })
-        .collect();
-    Ok(results)
+    py.detach(|| {
+        let source = Source::open(file_path)?;
+        let engine = Engine::joined(pattern, groups)?;
+        engine.collect_from(&source, true)
+    })
 }
 
 #[pyfunction]
@@ -408,37 +410,13 @@ fn find_joined_matches_in_file_by_line_bytes(
     pattern: &str,
     file_path: &str,
     groups: Option<Vec<usize>>,
+    py: Python<'_>,
 ) -> PyResult<Vec<String>> {
-    let file = File::open(file_path)
-        .map_err(|e| PyIOError::new_err(format!("Failed to open file: {}", e)))?;
-    let mmap = unsafe { Mmap::map(&file) }
-        .map_err(|e| PyIOError::new_err(format!("Failed to mmap file: {}", e)))?;
-    let bytes = &mmap[..];
-    let lines: Vec<&[u8]> = bytes.split(|&b| b == b'\n').collect();
-    let regex = RustRegexBytes::new(pattern)
-        .map_err(|e| PyValueError::new_err(format!("Regex compile error: {}", e)))?;
-    let mut results = Vec::new();
-    for line in lines {
-        if let Some(ref indices) = groups {
-            for caps in regex.captures_iter(line) {
-                let mut parts = Vec::new();
-                for &idx in indices {
-                    if let Some(mat) = caps.get(idx) {
-                        let s = String::from_utf8_lossy(mat.as_bytes()).into_owned();
-                        parts.push(s);
-                    }
-                }
-                if !parts.is_empty() {
-                    results.push(parts.join(" "));
-                }
-            }
-        } else {
-            if regex.is_match(line) {
-                results.push(String::from_utf8_lossy(line).into_owned());
-            }
-        }
-    }
-    Ok(results)
+    py.detach(|| {
+        let source = Source::open(file_path)?;
+        let engine = Engine::joined(pattern, groups)?;
+        engine.collect_from(&source, false)
+    })
 }
 
 #[pyfunction]
@@ -446,37 +424,13 @@ fn find_joined_matches_in_file(
     pattern: &str,
     file_path: &str,
     groups: Option<Vec<usize>>,
+    py: Python<'_>,
 ) -> PyResult<Vec<String>> {
-    let file = File::open(file_path)
-        .map_err(|e| PyIOError::new_err(format!("Failed to open file: {}", e)))?;
-    let mmap = unsafe { Mmap::map(&file) }
-        .map_err(|e| PyIOError::new_err(format!("Failed to mmap file: {}", e)))?;
-    let bytes = &mmap[..];
-    let lines: Vec<&[u8]> = bytes.split(|&b| b == b'\n').collect();
-    let regex = RustRegexBytes::new(pattern)
-        .map_err(|e| PyValueError::new_err(format!("Regex compile error: {}", e)))?;
-    let mut results = Vec::new();
-    for line in lines {
-        if let Some(ref indices) = groups {
-            for caps in regex.captures_iter(line) {
-                let mut parts = Vec::new();
-                for &idx in indices {
-                    if let Some(mat) = caps.get(idx) {
-                        let s = String::from_utf8_lossy(mat.as_bytes()).into_owned();
-                        parts.push(s);
-                    }
-                }
-                if !parts.is_empty() {
-                    results.push(parts.join(" "));
-                }
-            }
-        } else {
-            if regex.is_match(line) {
-                results.push(String::from_utf8_lossy(line).into_owned());
-            }
-        }
-    }
-    Ok(results)
+    py.detach(|| {
+        let source = Source::open(file_path)?;
+        let engine = Engine::joined(pattern, groups)?;
+        engine.collect_from(&source, false)
+    })
 }
 
 fn compute_ranges(data: &[u8], n_threads: usize, target_chunks_per_thread: usize) 
@@ -484,148 +438,4068 @@ fn compute_ranges(data: &[u8], n_threads: usize, target_chunks_per_thread: usize
 {
     let size = data.len();
     let total_chunks = (n_threads * target_chunks_per_thread).max(1);
-    let mut ranges = Vec::with_capacity(total_chunks);
-    let mut start = 0;
     let chunk_bytes = (size + total_chunks - 1) / total_chunks;
+    split_ranges(data, chunk_bytes)
+}
+
+/// Split `data` into consecutive ranges of roughly `chunk_bytes`, each extended to
+/// end just after a newline (or at EOF).
+fn split_ranges(data: &[u8], chunk_bytes: usize) -> Vec<(usize, usize)> {
+    let size = data.len();
+    let chunk_bytes = chunk_bytes.max(1);
+    let mut ranges = Vec::with_capacity(size / chunk_bytes + 1);
+    let mut start = 0;
     while start < size {
-        let mut end = (start + chunk_bytes).min(size);
-        while end < size && data[end] != b'\n' {
-            end += 1;
-        }
-        if end < size { end += 1; }
+        let end = start.saturating_add(chunk_bytes).min(size);
+        let end = match memchr::memchr(b'\n', &data[end..]) {
+            Some(i) => end + i + 1,
+            None => size,
+        };
         ranges.push((start, end));
         start = end;
     }
     ranges
 }
 
-#[pyfunction]
-fn find_joined_matches_in_file_by_line_parallel(
-    pattern: &str,
-    file_path: &str,
-    groups: Option<Vec<usize>>,
-) -> PyResult<Vec<String>> {
+/// Call `f` with every line of `data`, without its trailing newline. A newline at the
+/// very end of `data` does not produce an extra empty line.
+fn for_each_line<'a>(data: &'a [u8], mut f: impl FnMut(&'a [u8])) {
+    let mut start = 0;
+    for nl in memchr::memchr_iter(b'\n', data) {
+        f(&data[start..nl]);
+        start = nl + 1;
+    }
+    if start < data.len() {
+        f(&data[start..]);
+    }
+}
+
+/// Whether `pattern` relies on text boundaries (`\A`, `\z` or a `(?-m)` flag group),
+/// which only coincide with line boundaries when each line is searched on its own.
+fn anchors_to_text(pattern: &str) -> bool {
+    if pattern.contains("\\A") || pattern.contains("\\z") {
+        return true;
+    }
+    pattern.match_indices("(?").any(|(i, _)| {
+        let flags = &pattern[i + 2..];
+        let flags = &flags[..flags.find(|c| c == ')' || c == ':').unwrap_or(flags.len())];
+        flags.split_once('-').is_some_and(|(_, off)| off.contains('m'))
+    })
+}
+
+/// Multi-line build of `pattern` that finds candidate lines across a whole buffer,
+/// or `None` if the pattern has to be run line by line (see `anchors_to_text`).
+fn line_prefilter(pattern: &str, size_limit: usize) -> Result<Option<RustRegexBytes>, ::regex::Error> {
+    if anchors_to_text(pattern) {
+        return Ok(None);
+    }
+    RustRegexBytesBuilder::new(pattern)
+        .multi_line(true)
+        .size_limit(size_limit)
+        .build()
+        .map(Some)
+}
+
+/// Call `f` with the lines of `data` where `prefilter` finds a match, in order.
+/// The prefilter runs over the whole buffer, so regions without a match are skipped
+/// at DFA speed and line boundaries are only looked up around hits. Every line with a
+/// per-line match is visited, but callers must still check each line themselves,
+/// since a prefilter match may cross a newline. Without a prefilter every line is
+/// visited.
+fn for_each_candidate_line<'a>(
+    data: &'a [u8],
+    prefilter: Option<&RustRegexBytes>,
+    mut f: impl FnMut(&'a [u8]),
+) {
+    let Some(prefilter) = prefilter else {
+        return for_each_line(data, f);
+    };
+    let mut pos = 0;
+    while pos < data.len() {
+        let Some(m) = prefilter.find_at(data, pos) else { break };
+        let at = m.start();
+        let start = memchr::memrchr(b'\n', &data[pos..at]).map_or(pos, |i| pos + i + 1);
+        // An empty match after the final newline is not on a line.
+        if start == data.len() {
+            break;
+        }
+        let end = memchr::memchr(b'\n', &data[at..]).map_or(data.len(), |i| at + i);
+        f(&data[start..end]);
+        pos = end + 1;
+    }
+}
+
+/// One chunk scanned while stats are on: the rayon worker that ran it (`None` off
+/// the pool), its size and how long the scan took.
+struct ChunkTiming {
+    worker: Option<usize>,
+    bytes: usize,
+    nanos: u64,
+}
+
+/// What scans did while `set_stats(True)` is in effect, for `rygex --stats`. The
+/// counters are process-wide, so scans running on several Python threads at once
+/// are added together.
+struct ScanStats {
+    maps: usize,
+    map_nanos: u64,
+    bytes: u64,
+    lines: u64,
+    convert_nanos: u64,
+    chunks: Vec<ChunkTiming>,
+}
+
+impl ScanStats {
+    const fn new() -> Self {
+        ScanStats { maps: 0, map_nanos: 0, bytes: 0, lines: 0, convert_nanos: 0, chunks: Vec::new() }
+    }
+}
+
+static STATS_ON: AtomicBool = AtomicBool::new(false);
+static STATS: Mutex<ScanStats> = Mutex::new(ScanStats::new());
+
+fn stats_on() -> bool {
+    STATS_ON.load(Ordering::Relaxed)
+}
+
+fn with_stats(f: impl FnOnce(&mut ScanStats)) {
+    f(&mut STATS.lock().unwrap_or_else(|e| e.into_inner()));
+}
+
+/// Time `scan` over the chunk `data` when stats are on. Lines are counted after
+/// the clock stops, so the timing is the scan's alone.
+fn timed<T>(data: &[u8], scan: impl FnOnce() -> T) -> T {
+    if !stats_on() {
+        return scan();
+    }
+    let start = Instant::now();
+    let out = scan();
+    let nanos = start.elapsed().as_nanos() as u64;
+    let lines = memchr::memchr_iter(b'\n', data).count() + usize::from(data.last().is_some_and(|&b| b != b'\n'));
+    with_stats(|stats| {
+        stats.bytes += data.len() as u64;
+        stats.lines += lines as u64;
+        stats.chunks.push(ChunkTiming { worker: rayon::current_thread_index(), bytes: data.len(), nanos });
+    });
+    out
+}
+
+fn open_mmap(file_path: &str) -> PyResult<Mmap> {
+    let start = stats_on().then(Instant::now);
     let file = File::open(file_path)
         .map_err(|e| PyIOError::new_err(format!("Failed to open file: {}", e)))?;
     let mmap = unsafe { Mmap::map(&file) }
         .map_err(|e| PyIOError::new_err(format!("Failed to mmap file: {}", e)))?;
-    let regex = RustRegexBytes::new(pattern)
-        .map_err(|e| PyValueError::new_err(format!("Regex compile error: {}", e)))?;
-    let data: &[u8] = &mmap;
-    let ranges = compute_ranges(data, rayon::current_num_threads(), 4);
-    let results: Vec<String> = ranges.par_iter()
-        .flat_map(|&(s,e)| {
-            let slice = &data[s..e];
-            if let Some(ref indices) = groups {
-                regex.captures_iter(slice)
-                    .map(|caps| {
-                        indices.iter()
-                            .filter_map(|&idx| caps.get(idx))
-                            .map(|m| String::from_utf8_lossy(m.as_bytes()))
-                            .collect::<Vec<_>>()
-                            .join(" ")
-                    })
-                    .collect::<Vec<_>>()
-            } else {
-                slice.split(|&b| b == b'\n')
-                    .filter_map(|slice| {
-                        if regex.is_match(slice) {
-                            Some(String::from_utf8_lossy(slice).into_owned())
-                        } else {
-                            None
-                        }
-                    })
-                    .collect::<Vec<String>>()
-            }
-        })
-        .collect();
-    Ok(results)
+    if let Some(start) = start {
+        let nanos = start.elapsed().as_nanos() as u64;
+        with_stats(|stats| {
+            stats.maps += 1;
+            stats.map_nanos += nanos;
+        });
+    }
+    Ok(mmap)
 }
 
-fn nth_index(haystack: &str, needle: &str, n: usize) -> Option<usize> {
-    let mut pos = 0;
-    for _ in 0..n {
-        match haystack[pos..].find(needle) {
-            Some(i) => pos += i + needle.len(),
-            None    => return None,
+/// `items` as a Python list, timed as conversion when stats are on.
+fn to_py_list<'py, T: IntoPyObject<'py>>(py: Python<'py>, items: Vec<T>) -> PyResult<Bound<'py, PyList>> {
+    let start = stats_on().then(Instant::now);
+    let list = PyList::new(py, items)?;
+    if let Some(start) = start {
+        let nanos = start.elapsed().as_nanos() as u64;
+        with_stats(|stats| stats.convert_nanos += nanos);
+    }
+    Ok(list)
+}
+
+/// Splits a byte stream into chunks of at least `chunk_bytes` that end just after a
+/// newline. The partial line at the end of each read is carried into the next chunk,
+/// so no line is ever split; only the last chunk may end without a newline.
+struct LineChunks<R> {
+    reader: R,
+    chunk_bytes: usize,
+    carry: Vec<u8>,
+    done: bool,
+}
+
+impl<R: Read> LineChunks<R> {
+    fn new(reader: R, chunk_bytes: usize) -> Self {
+        LineChunks { reader, chunk_bytes: chunk_bytes.max(1), carry: Vec::new(), done: false }
+    }
+}
+
+impl<R: Read> Iterator for LineChunks<R> {
+    type Item = std::io::Result<Vec<u8>>;
+
+    fn next(&mut self) -> Option<Self::Item> {
+        if self.done {
+            return None;
+        }
+        let mut buf = std::mem::take(&mut self.carry);
+        // The carried-over tail never contains a newline.
+        let mut scanned = buf.len();
+        loop {
+            let want = self.chunk_bytes.saturating_sub(buf.len()).max(64 * 1024);
+            match (&mut self.reader).take(want as u64).read_to_end(&mut buf) {
+                Ok(0) => {
+                    self.done = true;
+                    return if buf.is_empty() { None } else { Some(Ok(buf)) };
+                }
+                Ok(_) => {}
+                Err(e) => {
+                    self.done = true;
+                    return Some(Err(e));
+                }
+            }
+            if buf.len() >= self.chunk_bytes {
+                if let Some(nl) = memchr::memrchr(b'\n', &buf[scanned..]) {
+                    self.carry = buf.split_off(scanned + nl + 1);
+                    return Some(Ok(buf));
+                }
+                scanned = buf.len();
+            }
         }
     }
-    Some(pos - needle.len())
 }
 
-#[pyfunction]
-#[pyo3(signature = (
-    file_path,
-    start_delim,
-    start_index      = 1,
-    end_delim        = None,
-    end_index        = 1,
-    omit_first       = None,
-    omit_last        = None,
-    print_line_on_match = false,
-    case_insensitive = false
-))]
-fn extract_fixed_spans(
-    file_path: &str,
-    start_delim: &str,
-    start_index: usize,
-    end_delim: Option<&str>,
-    end_index: usize,
-    omit_first: Option<usize>,
-    omit_last: Option<usize>,
-    print_line_on_match: bool,
-    case_insensitive: bool,
-) -> PyResult<Vec<String>> {
-    let file = File::open(file_path).map_err(|e| PyIOError::new_err(e.to_string()))?;
-    let mmap = unsafe { Mmap::map(&file).map_err(|e| PyIOError::new_err(e.to_string()))? };
-    let s_key = if case_insensitive {
-        start_delim.to_ascii_lowercase()
-    } else {
-        start_delim.to_string()
-    };
-    let e_key = end_delim.map(|ed| {
-        if case_insensitive { ed.to_ascii_lowercase() } else { ed.to_string() }
+/// Read `reader` into `LineChunks` on a background thread, keeping at most `depth`
+/// chunks queued ahead of the consumer. Reading stops after the first error, or
+/// once the receiver is dropped.
+fn read_ahead<R: Read + Send + 'static>(
+    reader: R,
+    chunk_bytes: usize,
+    depth: usize,
+) -> Receiver<std::io::Result<Vec<u8>>> {
+    let (tx, rx) = sync_channel(depth);
+    std::thread::spawn(move || {
+        for chunk in LineChunks::new(reader, chunk_bytes) {
+            let failed = chunk.is_err();
+            if tx.send(chunk).is_err() || failed {
+                return;
+            }
+        }
     });
-    let omit_f = omit_first.unwrap_or(0);
-    let omit_l = omit_last.unwrap_or(0);
-    let mut out = Vec::new();
-    for chunk in mmap.split(|&b| b == b'\n') {
-        let line = std::str::from_utf8(chunk).unwrap_or("");
-        let hay  = if case_insensitive {
-            line.to_ascii_lowercase()
+    rx
+}
+
+/// Apply `scan` to `window` chunks at a time (on the rayon pool when `parallel`) and
+/// pass the results to `sink` in input order. `scan` also gets each chunk's index.
+/// Returns false if `sink` asked to stop early.
+fn scan_windows<C, T>(
+    chunks: impl Iterator<Item = C>,
+    window: usize,
+    parallel: bool,
+    scan: impl Fn(usize, &C) -> T + Sync,
+    mut sink: impl FnMut(T) -> bool,
+) -> bool
+where
+    C: Sync,
+    T: Send,
+{
+    let mut chunks = chunks;
+    let mut index = 0;
+    loop {
+        let group: Vec<C> = chunks.by_ref().take(window.max(1)).collect();
+        if group.is_empty() {
+            return true;
+        }
+        let results: Vec<T> = if parallel {
+            group.par_iter().enumerate().map(|(i, c)| scan(index + i, c)).collect()
+        } else {
+            group.iter().enumerate().map(|(i, c)| scan(index + i, c)).collect()
+        };
+        index += group.len();
+        for result in results {
+            if !sink(result) {
+                return false;
+            }
+        }
+    }
+}
+
+/// Compressed input formats, recognised by their magic bytes.
+#[derive(Clone, Copy, PartialEq, Debug)]
+enum Compression {
+    Gzip,
+    Zstd,
+    Xz,
+}
+
+/// Enough leading bytes to tell every `Compression` apart.
+const MAGIC_LEN: usize = 6;
+/// Compressed bytes a rayon worker decodes in one go when a file splits into
+/// independent frames.
+const DECODE_SPAN_BYTES: usize = 1024 * 1024;
+
+impl Compression {
+    fn detect(head: &[u8]) -> Option<Self> {
+        if head.starts_with(&[0x1f, 0x8b]) {
+            Some(Compression::Gzip)
+        } else if head.starts_with(&[0x28, 0xb5, 0x2f, 0xfd]) {
+            Some(Compression::Zstd)
+        } else if head.starts_with(&[0xfd, b'7', b'z', b'X', b'Z', 0x00]) {
+            Some(Compression::Xz)
         } else {
-            line.to_string()
+            None
+        }
+    }
+
+    /// A streaming decoder for the whole of `reader`, including concatenated
+    /// gzip members, zstd frames and xz streams.
+    fn decoder<'a, R: Read + Send + 'a>(self, reader: R) -> std::io::Result<Box<dyn Read + Send + 'a>> {
+        Ok(match self {
+            Compression::Gzip => Box::new(flate2::read::MultiGzDecoder::new(reader)),
+            Compression::Zstd => Box::new(zstd::stream::read::Decoder::new(reader)?),
+            Compression::Xz => Box::new(xz2::read::XzDecoder::new_multi_decoder(reader)),
+        })
+    }
+
+    /// Byte offsets of the frames in `data` that decode independently of each other:
+    /// zstd frames, or BGZF blocks (gzip members that record their own size). `None`
+    /// when the format has no such framing, or the file does not follow it.
+    fn frames(self, data: &[u8]) -> Option<Vec<(usize, usize)>> {
+        let frame_len: fn(&[u8]) -> Option<usize> = match self {
+            Compression::Zstd => |rest| zstd::zstd_safe::find_frame_compressed_size(rest).ok(),
+            Compression::Gzip => bgzf_block_len,
+            Compression::Xz => return None,
+        };
+        let mut frames = Vec::new();
+        let mut pos = 0;
+        while pos < data.len() {
+            let len = frame_len(&data[pos..]).filter(|&n| n > 0 && pos + n <= data.len())?;
+            frames.push((pos, pos + len));
+            pos += len;
+        }
+        Some(frames)
+    }
+
+    /// Decode `mmap` into newline-aligned chunks on a background thread, keeping at
+    /// most `depth` queued. Independent frames are grouped into spans of about
+    /// `DECODE_SPAN_BYTES` and, with `parallel`, decoded a window at a time on the
+    /// rayon pool; anything else is decoded as one stream, which still overlaps
+    /// with the scanning.
+    fn decode_ahead(
+        self,
+        mmap: Arc<Mmap>,
+        chunk_bytes: usize,
+        parallel: bool,
+        depth: usize,
+    ) -> std::io::Result<Receiver<std::io::Result<Vec<u8>>>> {
+        let spans = match self.frames(&mmap) {
+            Some(frames) if parallel && frames.len() > 1 => coalesce(&frames, DECODE_SPAN_BYTES),
+            _ => return Ok(read_ahead(self.decoder(MappedReader::new(mmap))?, chunk_bytes, depth)),
         };
-        if let Some(s_pos) = nth_index(&hay, &s_key, start_index) {
-            if let Some(ref ed) = e_key {
-                if let Some(e_start) = nth_index(&hay, ed, end_index) {
-                    let e_pos = e_start + ed.len();
-                    if e_pos > s_pos {
-                        let mut slice = &line[s_pos .. e_pos];
-                        if omit_f < slice.len() { slice = &slice[omit_f ..]; }
-                        if omit_l < slice.len() {
-                            slice = &slice[.. slice.len() - omit_l];
+        let (tx, rx) = sync_channel(depth);
+        std::thread::spawn(move || {
+            let decode = |&(s, e): &(usize, usize)| -> std::io::Result<Vec<u8>> {
+                let mut out = Vec::new();
+                self.decoder(&mmap[s..e])?.read_to_end(&mut out)?;
+                Ok(out)
+            };
+            let mut lines = Realign::new(chunk_bytes);
+            for window in spans.chunks(depth.max(1)) {
+                let decoded: Vec<_> = window.par_iter().map(decode).collect();
+                for block in decoded {
+                    let ready = match block {
+                        Ok(block) => lines.push(&block),
+                        Err(e) => {
+                            let _ = tx.send(Err(e));
+                            return;
+                        }
+                    };
+                    if let Some(chunk) = ready {
+                        if tx.send(Ok(chunk)).is_err() {
+                            return;
                         }
-                        out.push(slice.to_string());
-                        continue;
                     }
                 }
-            } else if print_line_on_match {
-                out.push(line.to_string());
-                continue;
             }
+            if let Some(chunk) = lines.finish() {
+                let _ = tx.send(Ok(chunk));
+            }
+        });
+        Ok(rx)
+    }
+}
+
+/// Total size of the BGZF block at the start of `data`, from the `BC` subfield of
+/// its gzip header, or `None` if it is not a BGZF block.
+fn bgzf_block_len(data: &[u8]) -> Option<usize> {
+    const FEXTRA: u8 = 0x04;
+    if data.len() < 12 || data[..3] != [0x1f, 0x8b, 0x08] || data[3] & FEXTRA == 0 {
+        return None;
+    }
+    let xlen = u16::from_le_bytes([data[10], data[11]]) as usize;
+    let mut extra = data.get(12..12 + xlen)?;
+    while extra.len() >= 4 {
+        let slen = u16::from_le_bytes([extra[2], extra[3]]) as usize;
+        if extra[..2] == *b"BC" && slen == 2 {
+            let bsize = u16::from_le_bytes([*extra.get(4)?, *extra.get(5)?]) as usize;
+            return Some(bsize + 1);
         }
+        extra = extra.get(4 + slen..)?;
     }
-    Ok(out)
+    None
 }
 
-#[pyfunction]
-#[pyo3(signature = (
-    file_path,
-    start_delim,
-    start_index      = 1,
-    end_delim        = None,
-    end_index        = 1,
+/// Merge consecutive `frames` into spans of at least `min_bytes`.
+fn coalesce(frames: &[(usize, usize)], min_bytes: usize) -> Vec<(usize, usize)> {
+    let mut spans: Vec<(usize, usize)> = Vec::new();
+    for &(s, e) in frames {
+        match spans.last_mut() {
+            Some(last) if last.1 - last.0 < min_bytes => last.1 = e,
+            _ => spans.push((s, e)),
+        }
+    }
+    spans
+}
+
+/// Regroups decoded blocks, which can end mid-line, into chunks of at least
+/// `chunk_bytes` that end just after a newline.
+struct Realign {
+    chunk_bytes: usize,
+    buf: Vec<u8>,
+}
+
+impl Realign {
+    fn new(chunk_bytes: usize) -> Self {
+        Realign { chunk_bytes, buf: Vec::new() }
+    }
+
+    fn push(&mut self, block: &[u8]) -> Option<Vec<u8>> {
+        let scanned = self.buf.len();
+        self.buf.extend_from_slice(block);
+        if self.buf.len() < self.chunk_bytes {
+            return None;
+        }
+        let nl = scanned + memchr::memrchr(b'\n', &self.buf[scanned..])?;
+        let tail = self.buf[nl + 1..].to_vec();
+        self.buf.truncate(nl + 1);
+        Some(std::mem::replace(&mut self.buf, tail))
+    }
+
+    fn finish(self) -> Option<Vec<u8>> {
+        if self.buf.is_empty() { None } else { Some(self.buf) }
+    }
+}
+
+/// `Read` over a shared memory map, so a decoder can own it on another thread.
+struct MappedReader {
+    mmap: Arc<Mmap>,
+    pos: usize,
+}
+
+impl MappedReader {
+    fn new(mmap: Arc<Mmap>) -> Self {
+        MappedReader { mmap, pos: 0 }
+    }
+}
+
+impl Read for MappedReader {
+    fn read(&mut self, buf: &mut [u8]) -> std::io::Result<usize> {
+        let n = (&self.mmap[self.pos..]).read(buf)?;
+        self.pos += n;
+        Ok(n)
+    }
+}
+
+/// Stdin as a stream of newline-aligned chunks read ahead on a background thread,
+/// decompressed first if it starts with a known magic number.
+fn stdin_ahead(chunk_bytes: usize, depth: usize) -> std::io::Result<Receiver<std::io::Result<Vec<u8>>>> {
+    let mut stdin = std::io::stdin();
+    let mut head = Vec::with_capacity(MAGIC_LEN);
+    (&mut stdin).take(MAGIC_LEN as u64).read_to_end(&mut head)?;
+    let format = Compression::detect(&head);
+    let input = std::io::Cursor::new(head).chain(stdin);
+    Ok(match format {
+        Some(format) => read_ahead(format.decoder(input)?, chunk_bytes, depth),
+        None => read_ahead(input, chunk_bytes, depth),
+    })
+}
+
+/// Where a scan reads its input: a memory-mapped file, a compressed file decoded
+/// on the fly, or standard input when the path is `STDIN_PATH`.
+enum Source {
+    Mapped(Arc<Mmap>),
+    Compressed(Arc<Mmap>, Compression),
+    Stdin,
+}
+
+/// How many maps `cached_mmap` keeps open; 0 (the default) keeps none.
+static MAP_CACHE_SIZE: AtomicUsize = AtomicUsize::new(0);
+/// Maps kept open by a resident process, least recently used first, with the
+/// size, mtime and inode each was made at.
+static MAP_CACHE: Mutex<Vec<(String, [u64; 3], Arc<Mmap>)>> = Mutex::new(Vec::new());
+
+/// `open_mmap`, reusing a map from an earlier call while the file's size, mtime
+/// and inode are unchanged, once `set_map_cache` has enabled the cache.
+fn cached_mmap(file_path: &str) -> PyResult<Arc<Mmap>> {
+    let size = MAP_CACHE_SIZE.load(Ordering::Relaxed);
+    if size == 0 {
+        return open_mmap(file_path).map(Arc::new);
+    }
+    let meta = std::fs::metadata(file_path)
+        .map_err(|e| PyIOError::new_err(format!("Failed to open file: {}", e)))?;
+    let stamp = file_stamp(&meta);
+    let mut cache = MAP_CACHE.lock().unwrap_or_else(|e| e.into_inner());
+    if let Some(i) = cache.iter().position(|(path, at, _)| path == file_path && *at == stamp) {
+        let entry = cache.remove(i);
+        let mmap = Arc::clone(&entry.2);
+        cache.push(entry);
+        return Ok(mmap);
+    }
+    cache.retain(|(path, _, _)| path != file_path);
+    let mmap = Arc::new(open_mmap(file_path)?);
+    cache.push((file_path.to_string(), stamp, Arc::clone(&mmap)));
+    if cache.len() > size {
+        cache.remove(0);
+    }
+    Ok(mmap)
+}
+
+impl Source {
+    fn open(file_path: &str) -> PyResult<Self> {
+        if file_path == STDIN_PATH {
+            return Ok(Source::Stdin);
+        }
+        let mmap = cached_mmap(file_path)?;
+        Ok(match Compression::detect(&mmap[..mmap.len().min(MAGIC_LEN)]) {
+            Some(format) => Source::Compressed(mmap, format),
+            None => Source::Mapped(mmap),
+        })
+    }
+
+    /// Run `scan` over newline-aligned chunks of about `chunk_bytes` and pass the
+    /// results to `sink` in input order, stopping early once `sink` returns false.
+    /// With `parallel`, `2 * threads` chunks are scanned at a time on the rayon pool.
+    /// Stdin and compressed files are read ahead on their own thread, so reading and
+    /// decoding overlap with the scanning.
+    fn scan_in_order<T: Send>(
+        &self,
+        chunk_bytes: usize,
+        parallel: bool,
+        scan: impl Fn(usize, &[u8]) -> T + Sync,
+        sink: impl FnMut(T) -> bool,
+    ) -> PyResult<()> {
+        let window = if parallel { rayon::current_num_threads() * 2 } else { 1 };
+        let (chunks, action) = match self {
+            Source::Mapped(mmap) => {
+                let data: &[u8] = mmap;
+                let chunks = split_ranges(data, chunk_bytes).into_iter().map(|(s, e)| &data[s..e]);
+                scan_windows(chunks, window, parallel, |i, chunk| timed(chunk, || scan(i, chunk)), sink);
+                return Ok(());
+            }
+            Source::Compressed(mmap, format) => (
+                format.decode_ahead(Arc::clone(mmap), chunk_bytes, parallel, window),
+                "decompress file",
+            ),
+            Source::Stdin => (stdin_ahead(chunk_bytes, window), "read stdin"),
+        };
+        let fail = |e: IOError| PyIOError::new_err(format!("Failed to {}: {}", action, e));
+        let rx = chunks.map_err(fail)?;
+        let mut failed = None;
+        let chunks = rx.iter().map_while(|chunk| chunk.map_err(|e| failed = Some(e)).ok());
+        scan_windows(chunks, window, parallel, |i, chunk: &Vec<u8>| timed(chunk, || scan(i, chunk)), sink);
+        failed.map_or(Ok(()), |e| Err(fail(e)))
+    }
+}
+
+/// A `file_path` argument: one path, or a list of paths searched as one input.
+#[derive(FromPyObject)]
+enum Paths {
+    One(String),
+    Many(Vec<String>),
+}
+
+impl Paths {
+    fn into_vec(self) -> Vec<String> {
+        match self {
+            Paths::One(path) => vec![path],
+            Paths::Many(paths) => paths,
+        }
+    }
+}
+
+/// A `with_filename` argument: whether records get their file's path as a prefix,
+/// or the name to show for each file instead, as a server does for a client's
+/// relative paths after opening them by absolute path.
+#[derive(FromPyObject)]
+enum FileNames {
+    Shown(bool),
+    Named(Vec<String>),
+}
+
+impl FileNames {
+    /// The prefix for each file in `paths`, or `None` when records get none.
+    fn labels(self, paths: &[String]) -> PyResult<Option<Vec<String>>> {
+        match self {
+            FileNames::Shown(false) => Ok(None),
+            FileNames::Shown(true) => Ok(Some(paths.to_vec())),
+            FileNames::Named(names) if names.len() == paths.len() => Ok(Some(names)),
+            FileNames::Named(_) => Err(PyValueError::new_err("with_filename needs one name per file")),
+        }
+    }
+}
+
+/// Scan every file in `paths` as one ordered input. Mapped files are cut into chunks
+/// of about `chunk_bytes`, so small files stay whole and large ones are split, and
+/// chunks from consecutive files share a window: many small files keep the rayon pool
+/// as busy as one large file. Compressed files and stdin are streamed one at a time,
+/// in chunks of at most `STREAM_CHUNK_BYTES`, and empty files are skipped. `scan` gets the file's index in `paths` and a chunk
+/// number that keeps increasing across files. Given the search's `trigrams`, mapped
+/// files with a trigram index only have their candidate blocks scanned.
+fn scan_paths<T: Send>(
+    paths: &[String],
+    chunk_bytes: usize,
+    parallel: bool,
+    trigrams: Option<&Trigrams>,
+    scan: impl Fn(usize, usize, &[u8]) -> T + Sync,
+    mut sink: impl FnMut(T) -> bool,
+) -> PyResult<()> {
+    let window = if parallel { rayon::current_num_threads() * 2 } else { 1 };
+    let mut next = 0;
+    let mut chunks = 0;
+    let mut open = true;
+    while open && next < paths.len() {
+        // Map files until there is a window's worth of chunks, or a streamed input.
+        let mut mapped = Vec::new();
+        let mut streamed = None;
+        let mut pending = 0;
+        while next < paths.len() && pending < window {
+            let file = next;
+            next += 1;
+            let path = &paths[file];
+            if path != STDIN_PATH && std::fs::metadata(path).is_ok_and(|m| m.len() == 0) {
+                continue;
+            }
+            match Source::open(path)? {
+                Source::Mapped(mmap) => {
+                    let ranges = mapped_ranges(path, &mmap, chunk_bytes, trigrams);
+                    pending += ranges.len();
+                    mapped.push((file, mmap, ranges));
+                }
+                source => {
+                    streamed = Some((file, source));
+                    break;
+                }
+            }
+        }
+        let units = mapped.iter().flat_map(|(file, mmap, ranges)| {
+            let data: &[u8] = mmap;
+            ranges.iter().map(move |&(s, e)| (*file, &data[s..e]))
+        });
+        let base = chunks;
+        open = scan_windows(
+            units,
+            window,
+            parallel,
+            |i, &(file, data)| timed(data, || scan(file, base + i, data)),
+            |result| {
+                chunks += 1;
+                sink(result)
+            },
+        );
+        if let (true, Some((file, source))) = (open, streamed) {
+            let base = chunks;
+            source.scan_in_order(
+                chunk_bytes.min(STREAM_CHUNK_BYTES),
+                parallel,
+                |i, data| scan(file, base + i, data),
+                |result| {
+                    chunks += 1;
+                    open = sink(result);
+                    open
+                },
+            )?;
+        }
+    }
+    Ok(())
+}
+
+/// Sidecar file that `build_index` writes next to a log: `ufw.log.rygex-index`.
+const INDEX_SUFFIX: &str = ".rygex-index";
+const INDEX_MAGIC: &[u8; 8] = b"RYGXIDX1";
+/// Magic, then the file's size, mtime and inode, then the block and trigram counts.
+const INDEX_HEADER_BYTES: usize = 8 + 5 * 8;
+/// One trigram table entry: the trigram, its postings length and their offset.
+const INDEX_ENTRY_BYTES: usize = 16;
+const INDEX_BLOCK_BYTES: usize = 1 << 20;
+/// Blocks whose trigrams are collected at once while building an index.
+const INDEX_BUILD_BATCH: usize = 256;
+
+/// Trigram requirements of a search: a line can only match if it contains all the
+/// trigrams of at least one alternative. Trigrams are ASCII lowercased, so the same
+/// requirements serve case-sensitive and `-i` searches.
+type Trigrams = Vec<Vec<u32>>;
+
+fn index_path(file_path: &str) -> String {
+    format!("{}{}", file_path, INDEX_SUFFIX)
+}
+
+/// Size, mtime in nanoseconds and inode: an index is only used while these match.
+fn file_stamp(meta: &std::fs::Metadata) -> [u64; 3] {
+    #[cfg(unix)]
+    {
+        use std::os::unix::fs::MetadataExt;
+        let mtime = (meta.mtime() as u64).wrapping_mul(1_000_000_000).wrapping_add(meta.mtime_nsec() as u64);
+        [meta.len(), mtime, meta.ino()]
+    }
+    #[cfg(not(unix))]
+    {
+        let mtime = meta.modified().ok()
+            .and_then(|t| t.duration_since(std::time::UNIX_EPOCH).ok())
+            .map_or(0, |d| d.as_nanos() as u64);
+        [meta.len(), mtime, 0]
+    }
+}
+
+/// Call `f` with every trigram of `bytes`, ASCII lowercased.
+fn for_each_trigram(bytes: &[u8], mut f: impl FnMut(u32)) {
+    for w in bytes.windows(3) {
+        let [a, b, c] = [w[0], w[1], w[2]].map(|x| x.to_ascii_lowercase() as u32);
+        f(a << 16 | b << 8 | c);
+    }
+}
+
+/// The distinct trigrams of one literal. A literal that is too short or spans lines
+/// gives none, which means it can't narrow a search.
+fn literal_trigrams(literal: &[u8]) -> Vec<u32> {
+    let mut grams = Vec::new();
+    if !literal.contains(&b'\n') {
+        for_each_trigram(literal, |g| grams.push(g));
+    }
+    grams.sort_unstable();
+    grams.dedup();
+    grams
+}
+
+/// Alternatives that all have at least one trigram, otherwise `None`.
+fn trigram_alternatives<'a>(literals: impl IntoIterator<Item = &'a [u8]>) -> Option<Trigrams> {
+    literals
+        .into_iter()
+        .map(|l| Some(literal_trigrams(l)).filter(|g| !g.is_empty()))
+        .collect()
+}
+
+/// Every match of `pattern` starts with one of a finite set of literals, or failing
+/// that ends with one; their trigrams are the requirements.
+fn regex_trigrams(pattern: &str) -> Option<Trigrams> {
+    use regex_syntax::hir::literal::{ExtractKind, Extractor};
+    let hir = regex_syntax::Parser::new().parse(pattern).ok()?;
+    [ExtractKind::Prefix, ExtractKind::Suffix].into_iter().find_map(|kind| {
+        let seq = Extractor::new().kind(kind).extract(&hir);
+        trigram_alternatives(seq.literals()?.iter().map(|l| l.as_bytes()))
+    })
+}
+
+/// Whether searching `pattern` across a whole buffer can find other matches than
+/// searching it one line-aligned piece at a time: when a match can hold a newline,
+/// can be empty, or is anchored to where the buffer starts or ends (`^`, `$`, `\A`,
+/// `\z` outside multi-line mode). A pattern that doesn't parse counts as spanning.
+fn spans_lines(pattern: &str) -> bool {
+    use regex_syntax::hir::{Class, Hir, HirKind, Look};
+    fn walk(hir: &Hir) -> bool {
+        match hir.kind() {
+            HirKind::Empty => false,
+            HirKind::Literal(literal) => literal.0.contains(&b'\n'),
+            HirKind::Class(Class::Unicode(class)) => class.ranges().iter().any(|r| r.start() <= '\n' && '\n' <= r.end()),
+            HirKind::Class(Class::Bytes(class)) => class.ranges().iter().any(|r| r.start() <= b'\n' && b'\n' <= r.end()),
+            HirKind::Look(look) => matches!(look, Look::Start | Look::End),
+            HirKind::Repetition(repetition) => walk(&repetition.sub),
+            HirKind::Capture(capture) => walk(&capture.sub),
+            HirKind::Concat(subs) | HirKind::Alternation(subs) => subs.iter().any(walk),
+        }
+    }
+    match regex_syntax::Parser::new().parse(pattern) {
+        Ok(hir) => hir.properties().minimum_len().is_none_or(|n| n == 0) || walk(&hir),
+        Err(_) => true,
+    }
+}
+
+fn push_varint(out: &mut Vec<u8>, mut n: u32) {
+    while n >= 0x80 {
+        out.push(n as u8 | 0x80);
+        n >>= 7;
+    }
+    out.push(n as u8);
+}
+
+/// The distinct trigrams of one block. `seen` is a 2^24-bit scratch set, left clear.
+fn block_trigrams(block: &[u8], seen: &mut [u64]) -> Vec<u32> {
+    let mut grams = Vec::new();
+    for_each_trigram(block, |g| {
+        let (word, bit) = ((g >> 6) as usize, 1u64 << (g & 63));
+        if seen[word] & bit == 0 {
+            seen[word] |= bit;
+            grams.push(g);
+        }
+    });
+    for &g in &grams {
+        seen[(g >> 6) as usize] = 0;
+    }
+    grams
+}
+
+/// Write the trigram index of `file_path` to its sidecar and return how many blocks
+/// it has. The file is cut into newline-aligned blocks of about `block_bytes`, and
+/// each trigram maps to the delta-encoded list of blocks containing it.
+fn build_trigram_index(file_path: &str, block_bytes: usize) -> PyResult<usize> {
+    let fail = |e: IOError| PyIOError::new_err(format!("Failed to write index: {}", e));
+    let stamp = file_stamp(&std::fs::metadata(file_path).map_err(fail)?);
+    let mmap = if stamp[0] == 0 { None } else { Some(open_mmap(file_path)?) };
+    let data: &[u8] = mmap.as_deref().unwrap_or(&[]);
+    if Compression::detect(&data[..data.len().min(MAGIC_LEN)]).is_some() {
+        return Err(PyValueError::new_err("Compressed files can't be indexed"));
+    }
+    let blocks = split_ranges(data, block_bytes);
+    let mut postings: HashMap<u32, (u32, Vec<u8>)> = HashMap::new();
+    for (batch_no, batch) in blocks.chunks(INDEX_BUILD_BATCH).enumerate() {
+        let grams: Vec<Vec<u32>> = batch
+            .par_iter()
+            .map_init(|| vec![0u64; 1 << 18], |seen, &(s, e)| block_trigrams(&data[s..e], seen))
+            .collect();
+        for (i, grams) in grams.into_iter().enumerate() {
+            let block = (batch_no * INDEX_BUILD_BATCH + i) as u32;
+            for g in grams {
+                let (last, list) = postings.entry(g).or_default();
+                push_varint(list, block - *last);
+                *last = block;
+            }
+        }
+    }
+    let mut grams: Vec<_> = postings.into_iter().collect();
+    grams.sort_unstable_by_key(|(g, _)| *g);
+
+    let mut out = Vec::with_capacity(INDEX_HEADER_BYTES + 8 * blocks.len() + INDEX_ENTRY_BYTES * grams.len());
+    out.extend_from_slice(INDEX_MAGIC);
+    for field in stamp.into_iter().chain([blocks.len() as u64, grams.len() as u64]) {
+        out.extend_from_slice(&field.to_le_bytes());
+    }
+    for &(start, _) in &blocks {
+        out.extend_from_slice(&(start as u64).to_le_bytes());
+    }
+    let mut offset = 0u64;
+    for (g, (_, list)) in &grams {
+        out.extend_from_slice(&g.to_le_bytes());
+        out.extend_from_slice(&(list.len() as u32).to_le_bytes());
+        out.extend_from_slice(&offset.to_le_bytes());
+        offset += list.len() as u64;
+    }
+    for (_, (_, list)) in &grams {
+        out.extend_from_slice(list);
+    }
+    // Written to a temporary file and renamed, so a search never sees half an index.
+    let target = index_path(file_path);
+    let partial = format!("{}.tmp", target);
+    std::fs::write(&partial, &out).and_then(|_| std::fs::rename(&partial, &target)).map_err(fail)?;
+    Ok(blocks.len())
+}
+
+/// A mapped trigram index, only opened while it still describes its file.
+struct TrigramIndex {
+    map: Mmap,
+    blocks: usize,
+    grams: usize,
+}
+
+impl TrigramIndex {
+    fn open(file_path: &str, data_len: usize) -> Option<Self> {
+        let stamp = file_stamp(&std::fs::metadata(file_path).ok()?);
+        let map = open_mmap(&index_path(file_path)).ok()?;
+        if map.len() < INDEX_HEADER_BYTES || &map[..8] != INDEX_MAGIC {
+            return None;
+        }
+        let field = |i: usize| u64::from_le_bytes(map[8 + 8 * i..16 + 8 * i].try_into().unwrap());
+        if [field(0), field(1), field(2)] != stamp || stamp[0] != data_len as u64 {
+            return None;
+        }
+        let (blocks, grams) = (field(3) as usize, field(4) as usize);
+        let table_end = blocks.checked_mul(8)?.checked_add(grams.checked_mul(INDEX_ENTRY_BYTES)?)?;
+        if map.len() - INDEX_HEADER_BYTES < table_end {
+            return None;
+        }
+        Some(TrigramIndex { map, blocks, grams })
+    }
+
+    fn block_start(&self, block: usize, data_len: usize) -> usize {
+        if block == self.blocks {
+            return data_len;
+        }
+        let at = INDEX_HEADER_BYTES + 8 * block;
+        u64::from_le_bytes(self.map[at..at + 8].try_into().unwrap()) as usize
+    }
+
+    /// The ascending blocks that contain `gram`.
+    fn postings(&self, gram: u32) -> Vec<u32> {
+        let table = INDEX_HEADER_BYTES + 8 * self.blocks;
+        let postings = table + INDEX_ENTRY_BYTES * self.grams;
+        let entry = |i: usize| &self.map[table + INDEX_ENTRY_BYTES * i..table + INDEX_ENTRY_BYTES * (i + 1)];
+        let (mut lo, mut hi) = (0, self.grams);
+        while lo < hi {
+            let mid = (lo + hi) / 2;
+            let e = entry(mid);
+            match u32::from_le_bytes(e[..4].try_into().unwrap()).cmp(&gram) {
+                std::cmp::Ordering::Less => lo = mid + 1,
+                std::cmp::Ordering::Greater => hi = mid,
+                std::cmp::Ordering::Equal => {
+                    let len = u32::from_le_bytes(e[4..8].try_into().unwrap()) as usize;
+                    let offset = u64::from_le_bytes(e[8..].try_into().unwrap()) as usize;
+                    let bytes = self.map.get(postings + offset..postings + offset + len).unwrap_or(&[]);
+                    let (mut blocks, mut block, mut n, mut shift) = (Vec::new(), 0u32, 0u32, 0);
+                    for &b in bytes {
+                        n |= ((b & 0x7f) as u32) << shift;
+                        shift += 7;
+                        if b & 0x80 == 0 {
+                            block += n;
+                            blocks.push(block);
+                            (n, shift) = (0, 0);
+                        }
+                    }
+                    return blocks;
+                }
+            }
+        }
+        Vec::new()
+    }
+
+    /// Byte ranges of the blocks that may hold a match, with neighbours merged.
+    fn candidates(&self, trigrams: &Trigrams, data_len: usize) -> Vec<(usize, usize)> {
+        let mut hit = vec![false; self.blocks];
+        for grams in trigrams {
+            let mut lists: Vec<Vec<u32>> = grams.iter().map(|&g| self.postings(g)).collect();
+            lists.sort_unstable_by_key(|l| l.len());
+            let Some((first, rest)) = lists.split_first() else { continue };
+            for &block in first {
+                if rest.iter().all(|l| l.binary_search(&block).is_ok()) {
+                    if let Some(h) = hit.get_mut(block as usize) {
+                        *h = true;
+                    }
+                }
+            }
+        }
+        let mut ranges: Vec<(usize, usize)> = Vec::new();
+        for block in (0..self.blocks).filter(|&b| hit[b]) {
+            let (start, end) = (self.block_start(block, data_len), self.block_start(block + 1, data_len));
+            match ranges.last_mut() {
+                Some(last) if last.1 == start => last.1 = end,
+                _ => ranges.push((start, end)),
+            }
+        }
+        ranges
+    }
+}
+
+/// Ranges of about `chunk_bytes` to scan in a mapped file: all of it, or with
+/// `trigrams` and an up to date index, only the blocks that may hold a match.
+fn mapped_ranges(file_path: &str, data: &[u8], chunk_bytes: usize, trigrams: Option<&Trigrams>) -> Vec<(usize, usize)> {
+    let Some((trigrams, index)) = trigrams.and_then(|t| Some((t, TrigramIndex::open(file_path, data.len())?))) else {
+        return split_ranges(data, chunk_bytes);
+    };
+    index
+        .candidates(trigrams, data.len())
+        .into_iter()
+        .flat_map(|(start, end)| {
+            split_ranges(&data[start..end], chunk_bytes).into_iter().map(move |(s, e)| (start + s, start + e))
+        })
+        .collect()
+}
+
+/// Whether a search with `trigrams` could use an index of `file_path`.
+fn has_index(trigrams: Option<&Trigrams>, file_path: &str) -> bool {
+    trigrams.is_some() && Path::new(&index_path(file_path)).is_file()
+}
+
+/// The complete lines of an uncompressed file from byte `start` on, for
+/// checkpointed runs: the file's map and the offset just past its last newline. A
+/// partial last line is left for the next run, since it may still be being written.
+fn appended_lines(file_path: &str, start: usize) -> PyResult<(Option<Mmap>, usize)> {
+    let mmap = map_plain(file_path, "Compressed files can't be scanned incrementally")?;
+    let data: &[u8] = mmap.as_deref().unwrap_or(&[]);
+    if start > data.len() {
+        return Err(PyValueError::new_err("start is past the end of the file"));
+    }
+    let end = memchr::memrchr(b'\n', &data[start..]).map_or(start, |i| start + i + 1);
+    Ok((mmap, end))
+}
+
+/// Map `file_path` for reading at byte offsets, as `None` when it is empty (which
+/// can't be mapped). Compressed files have no such offsets and fail with `compressed`.
+fn map_plain(file_path: &str, compressed: &str) -> PyResult<Option<Mmap>> {
+    let len = std::fs::metadata(file_path)
+        .map_err(|e| PyIOError::new_err(format!("Failed to open file: {}", e)))?
+        .len();
+    let mmap = if len == 0 { None } else { Some(open_mmap(file_path)?) };
+    let data: &[u8] = mmap.as_deref().unwrap_or(&[]);
+    if Compression::detect(&data[..data.len().min(MAGIC_LEN)]).is_some() {
+        return Err(PyValueError::new_err(compressed.to_string()));
+    }
+    Ok(mmap)
+}
+
+/// A literal searched for in place. With `-i` the case folding happens inside the
+/// automaton, so haystacks are never lowercased into a copy.
+enum Literal {
+    Exact(Finder<'static>),
+    Folded { automaton: AhoCorasick, needle: Vec<u8> },
+}
+
+impl Literal {
+    fn new(pattern: &str, case_insensitive: bool) -> Self {
+        if case_insensitive {
+            let automaton = AhoCorasick::builder()
+                .ascii_case_insensitive(true)
+                .match_kind(MatchKind::LeftmostFirst)
+                .build([pattern])
+                .expect("a single literal always builds");
+            Literal::Folded { automaton, needle: pattern.as_bytes().to_vec() }
+        } else {
+            Literal::Exact(Finder::new(pattern.as_bytes()).into_owned())
+        }
+    }
+
+    fn find(&self, hay: &[u8]) -> Option<usize> {
+        match self {
+            Literal::Exact(finder) => finder.find(hay),
+            Literal::Folded { automaton, .. } => automaton.find(hay).map(|m| m.start()),
+        }
+    }
+
+    /// Non-overlapping occurrences in `hay`.
+    fn count(&self, hay: &[u8]) -> usize {
+        match self {
+            Literal::Exact(finder) => finder.find_iter(hay).count(),
+            Literal::Folded { automaton, .. } => automaton.find_iter(hay).count(),
+        }
+    }
+
+    /// Start of the `n`th (1-based) non-overlapping occurrence in `hay`.
+    fn nth(&self, hay: &[u8], n: usize) -> Option<usize> {
+        let n = n.checked_sub(1)?;
+        match self {
+            Literal::Exact(finder) => finder.find_iter(hay).nth(n),
+            Literal::Folded { automaton, .. } => automaton.find_iter(hay).nth(n).map(|m| m.start()),
+        }
+    }
+
+    fn needle(&self) -> &[u8] {
+        match self {
+            Literal::Exact(finder) => finder.needle(),
+            Literal::Folded { needle, .. } => needle,
+        }
+    }
+
+    fn len(&self) -> usize {
+        self.needle().len()
+    }
+}
+
+struct SpanSpec {
+    start: Literal,
+    start_index: usize,
+    end: Option<Literal>,
+    end_index: usize,
+    omit_first: usize,
+    omit_last: usize,
+    print_line_on_match: bool,
+}
+
+/// A compiled line-oriented search. Engines are immutable once built, so one can be
+/// shared between rayon workers and the background thread behind a `RecordStream`.
+enum Engine {
+    /// `-rp`: whole matching lines, or the requested capture groups joined by spaces.
+    /// `lines` finds the candidate lines for `regex` (see `for_each_candidate_line`).
+    Joined { regex: RustRegexBytes, lines: Option<RustRegexBytes>, groups: Option<Vec<usize>> },
+    /// `-F`: whole lines containing a literal.
+    Fixed(Literal),
+    /// `-s/-e`: the text between the nth start and nth end delimiter of each line.
+    Spans(SpanSpec),
+    /// `-g`: capture `groups` joined by spaces, matching across the whole buffer
+    /// rather than line by line (the `FileRegexGen` semantics).
+    Captures { regex: RustRegexBytes, groups: Vec<usize> },
+    /// Several `-F` or `-rp` patterns in one pass: matching lines, prefixed with the
+    /// 1-based numbers of the patterns they matched, e.g. `2,5:line`.
+    Multi(PatternSet),
+    /// `--format`: each match's capture groups as a JSON object, or as a row of
+    /// Arrow record batches through `Query.arrow`.
+    Rows(RowSpec),
+}
+
+/// Compiled size limit for a `PatternSet` regex, large enough for blocklists with
+/// tens of thousands of entries.
+const PATTERN_SET_SIZE_LIMIT: usize = 1 << 30;
+
+/// Several patterns searched together, reporting which of them match each line.
+enum PatternSet {
+    /// Literals, all matched by one Aho-Corasick automaton over the whole buffer.
+    Literals { automaton: AhoCorasick, patterns: Vec<String> },
+    /// Regexes: `any`, the alternation of all of them, finds candidate lines across
+    /// the whole buffer, then `set` tells which patterns match each candidate.
+    /// `any` is `None` when a pattern has to be run line by line.
+    Regexes { any: Option<RustRegexBytes>, set: RustRegexSetBytes },
+}
+
+impl PatternSet {
+    fn literals(patterns: &[String], case_insensitive: bool) -> PyResult<Self> {
+        if patterns.iter().any(|p| p.contains('\n')) {
+            return Err(PyValueError::new_err("Fixed string patterns cannot contain a newline"));
+        }
+        let automaton = AhoCorasick::builder()
+            .match_kind(MatchKind::Standard)
+            .ascii_case_insensitive(case_insensitive)
+            .build(patterns)
+            .map_err(|e| PyValueError::new_err(format!("Pattern compile error: {}", e)))?;
+        Ok(PatternSet::Literals { automaton, patterns: patterns.to_vec() })
+    }
+
+    fn regexes(patterns: &[String]) -> PyResult<Self> {
+        let compile_error = |e: ::regex::Error| PyValueError::new_err(format!("Regex compile error: {}", e));
+        let set = RegexSetBuilder::new(patterns)
+            .size_limit(PATTERN_SET_SIZE_LIMIT)
+            .build()
+            .map_err(compile_error)?;
+        let alternation: Vec<String> = patterns.iter().map(|p| format!("(?:{})", p)).collect();
+        let any = line_prefilter(&alternation.join("|"), PATTERN_SET_SIZE_LIMIT).map_err(compile_error)?;
+        Ok(PatternSet::Regexes { any, set })
+    }
+
+    fn len(&self) -> usize {
+        match self {
+            PatternSet::Literals { automaton, .. } => automaton.patterns_len(),
+            PatternSet::Regexes { set, .. } => set.len(),
+        }
+    }
+
+    /// A line matches if it matches any pattern, so the requirements are the union
+    /// of every pattern's.
+    fn trigrams(&self) -> Option<Trigrams> {
+        match self {
+            PatternSet::Literals { patterns, .. } => trigram_alternatives(patterns.iter().map(|p| p.as_bytes())),
+            PatternSet::Regexes { set, .. } => set.patterns().iter().map(|p| regex_trigrams(p))
+                .collect::<Option<Vec<_>>>()
+                .map(|alternatives| alternatives.concat()),
+        }
+    }
+
+    /// Call `f` with every line of `data` that matches at least one pattern, and the
+    /// ascending ids of the patterns it matches.
+    fn for_each_line<'a>(&self, data: &'a [u8], mut f: impl FnMut(&'a [u8], &[usize])) {
+        let line_at = |pos: usize| {
+            let start = memchr::memrchr(b'\n', &data[..pos]).map_or(0, |i| i + 1);
+            let end = memchr::memchr(b'\n', &data[pos..]).map_or(data.len(), |i| pos + i);
+            (start, end)
+        };
+        match self {
+            PatternSet::Literals { automaton, .. } => {
+                // Overlapping matches come in order of their end, and no literal spans
+                // a newline, so all matches on one line arrive together.
+                let mut line: Option<(usize, usize)> = None;
+                let mut ids = Vec::new();
+                for m in automaton.find_overlapping_iter(data) {
+                    match line {
+                        Some((start, end)) if start <= m.start() && m.start() <= end => {}
+                        _ => {
+                            if let Some((start, end)) = line {
+                                ids.sort_unstable();
+                                ids.dedup();
+                                f(&data[start..end], &ids);
+                                ids.clear();
+                            }
+                            line = Some(line_at(m.start()));
+                        }
+                    }
+                    ids.push(m.pattern().as_usize());
+                }
+                if let Some((start, end)) = line {
+                    ids.sort_unstable();
+                    ids.dedup();
+                    f(&data[start..end], &ids);
+                }
+            }
+            PatternSet::Regexes { any, set } => for_each_candidate_line(data, any.as_ref(), |line| {
+                let ids: Vec<usize> = set.matches(line).into_iter().collect();
+                if !ids.is_empty() {
+                    f(line, &ids);
+                }
+            }),
+        }
+    }
+
+    /// How many lines of `data` each pattern matches.
+    fn line_totals(&self, data: &[u8]) -> Vec<usize> {
+        let mut totals = vec![0; self.len()];
+        self.for_each_line(data, |_, ids| {
+            for &id in ids {
+                totals[id] += 1;
+            }
+        });
+        totals
+    }
+}
+
+/// Per-key counts plus the position of each key's first occurrence, so a merged
+/// table can still be listed in first-seen order like `collections.Counter`.
+type CountTable = HashMap<String, (usize, u64)>;
+type CountRow = (String, (usize, u64));
+
+fn merge_counts(mut a: CountTable, mut b: CountTable) -> CountTable {
+    if a.len() < b.len() {
+        std::mem::swap(&mut a, &mut b);
+    }
+    for (key, (n, first)) in b {
+        let entry = a.entry(key).or_insert((0, first));
+        entry.0 += n;
+        entry.1 = entry.1.min(first);
+    }
+    a
+}
+
+/// The requested capture groups of one match joined by spaces, borrowing from the
+/// haystack when a single group is requested. `None` if no group participated.
+fn join_groups<'a>(caps: &::regex::bytes::Captures<'a>, indices: &[usize]) -> Option<Cow<'a, str>> {
+    let mut parts = indices.iter().filter_map(|&idx| caps.get(idx));
+    let mut record = String::from_utf8_lossy(parts.next()?.as_bytes());
+    for mat in parts {
+        let joined = record.to_mut();
+        joined.push(' ');
+        joined.push_str(&String::from_utf8_lossy(mat.as_bytes()));
+    }
+    Some(record)
+}
+
+impl Engine {
+    fn joined(pattern: &str, groups: Option<Vec<usize>>) -> PyResult<Self> {
+        let compile_error = |e: ::regex::Error| PyValueError::new_err(format!("Regex compile error: {}", e));
+        let regex = RustRegexBytes::new(pattern).map_err(compile_error)?;
+        let lines = line_prefilter(pattern, PATTERN_SET_SIZE_LIMIT).map_err(compile_error)?;
+        Ok(Engine::Joined { regex, lines, groups })
+    }
+
+    fn fixed(pattern: &str, case_insensitive: bool) -> Self {
+        Engine::Fixed(Literal::new(pattern, case_insensitive))
+    }
+
+    #[allow(clippy::too_many_arguments)]
+    fn spans(
+        start_delim: &str,
+        start_index: usize,
+        end_delim: Option<&str>,
+        end_index: usize,
+        omit_first: Option<usize>,
+        omit_last: Option<usize>,
+        print_line_on_match: bool,
+        case_insensitive: bool,
+    ) -> Self {
+        Engine::Spans(SpanSpec {
+            start: Literal::new(start_delim, case_insensitive),
+            start_index,
+            end: end_delim.map(|d| Literal::new(d, case_insensitive)),
+            end_index,
+            omit_first: omit_first.unwrap_or(0),
+            omit_last: omit_last.unwrap_or(0),
+            print_line_on_match,
+        })
+    }
+
+    /// What a line needs to contain for this search to find anything in it, to
+    /// narrow scans with a trigram index. `-g` matches aren't bound to lines, so it
+    /// always scans everything.
+    fn trigrams(&self) -> Option<Trigrams> {
+        match self {
+            Engine::Joined { regex, .. } => regex_trigrams(regex.as_str()),
+            Engine::Fixed(literal) => trigram_alternatives([literal.needle()]),
+            Engine::Spans(spec) => {
+                let mut grams = literal_trigrams(spec.start.needle());
+                if let Some(end) = &spec.end {
+                    grams.extend(literal_trigrams(end.needle()));
+                }
+                (!grams.is_empty()).then(|| vec![grams])
+            }
+            Engine::Captures { .. } => None,
+            Engine::Multi(patterns) => patterns.trigrams(),
+            Engine::Rows(spec) if spec.whole => None,
+            Engine::Rows(spec) => regex_trigrams(spec.regex.as_str()),
+        }
+    }
+
+    /// How much of a mapped file `scan_paths` scans at once: all of it when a `-g`
+    /// or whole-file rows pattern `spans_lines`, so no match is lost at a chunk
+    /// boundary and only separate files are scanned in parallel.
+    fn chunk_bytes(&self) -> usize {
+        match self {
+            Engine::Captures { regex, .. } | Engine::Rows(RowSpec { regex, whole: true, .. })
+                if spans_lines(regex.as_str()) => usize::MAX,
+            _ => STREAM_CHUNK_BYTES,
+        }
+    }
+
+    /// The capture groups whose offsets `offsets` reports after each match's own:
+    /// the query's groups, or every group of a regex queried without any. `None`
+    /// for searches whose records aren't matches (`-s/-e` and multi-pattern).
+    fn offset_groups(&self) -> Option<Vec<usize>> {
+        match self {
+            Engine::Joined { regex, groups: None, .. } => Some((1..regex.captures_len()).collect()),
+            Engine::Joined { groups: Some(groups), .. }
+            | Engine::Captures { groups, .. }
+            | Engine::Rows(RowSpec { groups, .. }) => Some(groups.iter().copied().filter(|&g| g != 0).collect()),
+            Engine::Fixed(_) => Some(Vec::new()),
+            Engine::Spans(_) | Engine::Multi(_) => None,
+        }
+    }
+
+    /// The regex of a `-rp`, `-g` or `--format` search, the prefilter that finds its
+    /// candidate lines, and whether it matches across the whole buffer instead.
+    fn capture_regex(&self) -> Option<(&RustRegexBytes, Option<&RustRegexBytes>, bool)> {
+        match self {
+            Engine::Joined { regex, lines, .. } => Some((regex, lines.as_ref(), false)),
+            Engine::Captures { regex, .. } => Some((regex, None, true)),
+            Engine::Rows(spec) => Some((&spec.regex, spec.lines.as_ref(), spec.whole)),
+            Engine::Fixed(_) | Engine::Spans(_) | Engine::Multi(_) => None,
+        }
+    }
+
+    /// `--agg` over `data`: a `Summary` of the numbers in group `value` per key, the
+    /// `by` groups joined by spaces. Like `count_range`, `chunk` orders first
+    /// occurrences across chunks.
+    fn summarize_range(&self, data: &[u8], chunk: usize, value: usize, by: &[usize]) -> SummaryTable {
+        let mut table = SummaryTable::new();
+        let Some((regex, lines, whole)) = self.capture_regex() else { return table };
+        let mut seq = (chunk as u64) << 40;
+        for_each_captures(regex, lines, whole, data, |caps| {
+            let Some(number) = capture_number(caps, value) else { return };
+            let key = match by {
+                [] => Cow::Borrowed(""),
+                _ => match join_groups(caps, by) {
+                    Some(key) => key,
+                    None => return,
+                },
+            };
+            match table.get_mut(key.as_ref()) {
+                Some(entry) => entry.0.add(number),
+                None => {
+                    let mut summary = Summary::new();
+                    summary.add(number);
+                    table.insert(key.into_owned(), (summary, seq));
+                }
+            }
+            seq += 1;
+        });
+        table
+    }
+
+    /// `summarize_range` over one `Source`. A mapped file is read whole, or split
+    /// across the rayon pool like `count_table` when `parallel` and the search
+    /// keeps to lines; stdin and compressed files a window of chunks at a time.
+    fn summarize_from(&self, source: &Source, parallel: bool, value: usize, by: &[usize]) -> PyResult<SummaryTable> {
+        match source {
+            Source::Mapped(mmap) if parallel && self.chunk_bytes() == STREAM_CHUNK_BYTES => {
+                let data: &[u8] = mmap;
+                let ranges = compute_ranges(data, rayon::current_num_threads(), 4);
+                Ok(ranges.par_iter()
+                    .enumerate()
+                    .map(|(i, &(s, e))| timed(&data[s..e], || self.summarize_range(&data[s..e], i, value, by)))
+                    .reduce(SummaryTable::new, merge_summaries))
+            }
+            Source::Mapped(mmap) => Ok(timed(mmap, || self.summarize_range(mmap, 0, value, by))),
+            _ => {
+                let mut table = SummaryTable::new();
+                source.scan_in_order(
+                    STREAM_CHUNK_BYTES,
+                    parallel,
+                    |i, chunk| self.summarize_range(chunk, i, value, by),
+                    |part| {
+                        table = merge_summaries(std::mem::take(&mut table), part);
+                        true
+                    },
+                )?;
+                Ok(table)
+            }
+        }
+    }
+
+    /// `summarize_range` over every file in `paths`, merged into one table in
+    /// first-seen order. A single unindexed file goes through `summarize_from`;
+    /// several are read a chunk at a time, across the rayon pool when `parallel`.
+    fn summarize_paths(&self, paths: &[String], parallel: bool, value: usize, by: &[usize]) -> PyResult<Vec<(String, Summary)>> {
+        let trigrams = self.trigrams();
+        let table = match paths {
+            [path] if !has_index(trigrams.as_ref(), path) => self.summarize_from(&Source::open(path)?, parallel, value, by)?,
+            _ => {
+                let mut table = SummaryTable::new();
+                scan_paths(
+                    paths,
+                    self.chunk_bytes(),
+                    parallel,
+                    trigrams.as_ref(),
+                    |_, chunk, data| self.summarize_range(data, chunk, value, by),
+                    |part| {
+                        table = merge_summaries(std::mem::take(&mut table), part);
+                        true
+                    },
+                )?;
+                table
+            }
+        };
+        let mut rows: Vec<_> = table.into_iter().collect();
+        rows.sort_unstable_by_key(|(_, (_, first))| *first);
+        Ok(rows.into_iter().map(|(key, (summary, _))| (key, summary)).collect())
+    }
+
+    /// `--histogram` over `data`: per series (the `by` groups joined by spaces), the
+    /// count of matches per `bucket` seconds of the time in group `time`, read as
+    /// `format`. Matches whose time doesn't parse are skipped.
+    fn histogram_range(&self, data: &[u8], chunk: usize, time: usize, by: &[usize], format: TimeFormat, bucket: i64) -> HistogramTable {
+        let mut table = HistogramTable::new();
+        let Some((regex, lines, whole)) = self.capture_regex() else { return table };
+        let mut seq = (chunk as u64) << 40;
+        for_each_captures(regex, lines, whole, data, |caps| {
+            let Some(seconds) = caps.get(time).and_then(|m| format.parse(m.as_bytes())) else { return };
+            let key = match by {
+                [] => Cow::Borrowed(""),
+                _ => match join_groups(caps, by) {
+                    Some(key) => key,
+                    None => return,
+                },
+            };
+            let bucket = seconds.div_euclid(bucket);
+            match table.get_mut(key.as_ref()) {
+                Some(entry) => *entry.0.entry(bucket).or_default() += 1,
+                None => {
+                    table.insert(key.into_owned(), (HashMap::from([(bucket, 1)]), seq));
+                }
+            }
+            seq += 1;
+        });
+        table
+    }
+
+    /// `histogram_range` over one `Source`, read like `summarize_from`.
+    fn histogram_from(
+        &self,
+        source: &Source,
+        parallel: bool,
+        time: usize,
+        by: &[usize],
+        format: TimeFormat,
+        bucket: i64,
+    ) -> PyResult<HistogramTable> {
+        match source {
+            Source::Mapped(mmap) if parallel && self.chunk_bytes() == STREAM_CHUNK_BYTES => {
+                let data: &[u8] = mmap;
+                let ranges = compute_ranges(data, rayon::current_num_threads(), 4);
+                Ok(ranges.par_iter()
+                    .enumerate()
+                    .map(|(i, &(s, e))| timed(&data[s..e], || self.histogram_range(&data[s..e], i, time, by, format, bucket)))
+                    .reduce(HistogramTable::new, merge_histograms))
+            }
+            Source::Mapped(mmap) => Ok(timed(mmap, || self.histogram_range(mmap, 0, time, by, format, bucket))),
+            _ => {
+                let mut table = HistogramTable::new();
+                source.scan_in_order(
+                    STREAM_CHUNK_BYTES,
+                    parallel,
+                    |i, chunk| self.histogram_range(chunk, i, time, by, format, bucket),
+                    |part| {
+                        table = merge_histograms(std::mem::take(&mut table), part);
+                        true
+                    },
+                )?;
+                Ok(table)
+            }
+        }
+    }
+
+    /// `histogram_range` over every file in `paths`, merged into one table in
+    /// first-seen order. A single unindexed file goes through `histogram_from`;
+    /// several are read a chunk at a time, across the rayon pool when `parallel`.
+    fn histogram_paths(
+        &self,
+        paths: &[String],
+        parallel: bool,
+        time: usize,
+        by: &[usize],
+        format: TimeFormat,
+        bucket: i64,
+    ) -> PyResult<Vec<(String, HashMap<i64, u64>)>> {
+        let trigrams = self.trigrams();
+        let table = match paths {
+            [path] if !has_index(trigrams.as_ref(), path) => {
+                self.histogram_from(&Source::open(path)?, parallel, time, by, format, bucket)?
+            }
+            _ => {
+                let mut table = HistogramTable::new();
+                scan_paths(
+                    paths,
+                    self.chunk_bytes(),
+                    parallel,
+                    trigrams.as_ref(),
+                    |_, chunk, data| self.histogram_range(data, chunk, time, by, format, bucket),
+                    |part| {
+                        table = merge_histograms(std::mem::take(&mut table), part);
+                        true
+                    },
+                )?;
+                table
+            }
+        };
+        let mut rows: Vec<_> = table.into_iter().collect();
+        rows.sort_unstable_by_key(|(_, (_, first))| *first);
+        Ok(rows.into_iter().map(|(key, (buckets, _))| (key, buckets)).collect())
+    }
+
+    /// Append the offsets of every match in `data` to `out`, one row per match:
+    /// start and end of the match, then of each of `groups` (-1 for a group that
+    /// did not take part). `base` is where `data` starts in the file. Regex and
+    /// literal matches are found within lines, as for the records, and `-g`
+    /// matches across the whole of `data`.
+    fn offsets(&self, data: &[u8], base: usize, groups: &[usize], out: &mut Vec<i64>) {
+        match self {
+            Engine::Joined { regex, lines, .. } | Engine::Rows(RowSpec { regex, lines, whole: false, .. }) => {
+                for_each_candidate_line(data, lines.as_ref(), |line| {
+                    let at = base + (line.as_ptr() as usize - data.as_ptr() as usize);
+                    regex_offsets(regex, line, at, groups, out);
+                });
+            }
+            Engine::Captures { regex, .. } | Engine::Rows(RowSpec { regex, whole: true, .. }) => {
+                regex_offsets(regex, data, base, groups, out)
+            }
+            Engine::Fixed(literal) => {
+                let mut pos = 0;
+                while pos < data.len() {
+                    let Some(i) = literal.find(&data[pos..]) else { break };
+                    let at = pos + i;
+                    push_span(out, base, Some((at, at + literal.len())));
+                    pos = at + literal.len().max(1);
+                }
+            }
+            Engine::Spans(_) | Engine::Multi(_) => {}
+        }
+    }
+
+    /// `offsets` for the whole of `data`, split across the rayon pool when
+    /// `parallel`. Chunks end at newlines, so only `-g` matches spanning a chunk
+    /// boundary are lost, as for its records.
+    fn offsets_table(&self, data: &[u8], groups: &[usize], parallel: bool) -> Vec<i64> {
+        let chunk = |&(s, e): &(usize, usize)| {
+            let mut out = Vec::new();
+            timed(&data[s..e], || self.offsets(&data[s..e], s, groups, &mut out));
+            out
+        };
+        if parallel {
+            split_ranges(data, STREAM_CHUNK_BYTES).par_iter().map(chunk).collect::<Vec<_>>().concat()
+        } else {
+            chunk(&(0, data.len()))
+        }
+    }
+
+    /// Call `emit` with every record found in `data`, in input order. Records borrow
+    /// from `data` whenever they are valid UTF-8 and need no joining.
+    fn scan<'a>(&self, data: &'a [u8], emit: &mut dyn FnMut(Cow<'a, str>)) {
+        match self {
+            Engine::Joined { regex, lines, groups: Some(indices) } => {
+                for_each_candidate_line(data, lines.as_ref(), |line| {
+                    for caps in regex.captures_iter(line) {
+                        if let Some(record) = join_groups(&caps, indices) {
+                            emit(record);
+                        }
+                    }
+                })
+            }
+            Engine::Joined { regex, lines, groups: None } => {
+                for_each_candidate_line(data, lines.as_ref(), |line| {
+                    if regex.is_match(line) {
+                        emit(String::from_utf8_lossy(line));
+                    }
+                })
+            }
+            // Search the whole buffer rather than each line, so long runs of lines
+            // without a match cost one SIMD scan. `pos` is always a line start.
+            Engine::Fixed(literal) => {
+                let mut pos = 0;
+                while pos < data.len() {
+                    let Some(i) = literal.find(&data[pos..]) else { break };
+                    let at = pos + i;
+                    let start = memchr::memrchr(b'\n', &data[pos..at]).map_or(pos, |j| pos + j + 1);
+                    let end = memchr::memchr(b'\n', &data[at..]).map_or(data.len(), |j| at + j);
+                    // A literal containing a newline can never match within a line.
+                    if at + literal.len() > end {
+                        break;
+                    }
+                    emit(String::from_utf8_lossy(&data[start..end]));
+                    pos = end + 1;
+                }
+            }
+            Engine::Spans(spec) => for_each_line(data, |chunk| {
+                let line = std::str::from_utf8(chunk).unwrap_or("");
+                if let Some(record) = spec.extract(line) {
+                    emit(Cow::Borrowed(record));
+                }
+            }),
+            Engine::Captures { regex, groups } => {
+                for caps in regex.captures_iter(data) {
+                    if let Some(record) = join_groups(&caps, groups) {
+                        emit(record);
+                    }
+                }
+            }
+            Engine::Multi(patterns) => patterns.for_each_line(data, |line, ids| {
+                let mut record = String::new();
+                for (i, id) in ids.iter().enumerate() {
+                    if i > 0 {
+                        record.push(',');
+                    }
+                    record.push_str(&(id + 1).to_string());
+                }
+                record.push(':');
+                record.push_str(&String::from_utf8_lossy(line));
+                emit(Cow::Owned(record));
+            }),
+            Engine::Rows(spec) => spec.for_each_match(data, |caps| emit(Cow::Owned(spec.json(caps, None)))),
+        }
+    }
+
+    /// Scan `data` on the current thread and return owned records.
+    fn scan_owned(&self, data: &[u8]) -> Vec<String> {
+        let mut out = Vec::new();
+        self.scan(data, &mut |record| out.push(record.into_owned()));
+        out
+    }
+
+    /// Scan the whole of `data`, splitting it across the rayon pool when `parallel`
+    /// and the search keeps to lines (see `chunk_bytes`).
+    fn collect(&self, data: &[u8], parallel: bool) -> Vec<String> {
+        if parallel && self.chunk_bytes() == STREAM_CHUNK_BYTES {
+            let ranges = compute_ranges(data, rayon::current_num_threads(), 4);
+            ranges.par_iter()
+                .flat_map_iter(|&(s, e)| timed(&data[s..e], || self.scan_owned(&data[s..e])))
+                .collect()
+        } else {
+            timed(data, || self.scan_owned(data))
+        }
+    }
+
+    /// Count identical records in `data`. Only the first occurrence of each key in a
+    /// chunk allocates; `chunk` orders first occurrences across chunks.
+    fn count_range(&self, data: &[u8], chunk: usize) -> CountTable {
+        let mut table = CountTable::new();
+        let mut seq = (chunk as u64) << 40;
+        self.scan(data, &mut |record| {
+            match table.get_mut(record.as_ref()) {
+                Some(entry) => entry.0 += 1,
+                None => {
+                    table.insert(record.into_owned(), (1, seq));
+                }
+            }
+            seq += 1;
+        });
+        table
+    }
+
+    /// Count identical records in the whole of `data`. With `parallel`, and a search
+    /// that keeps to lines, each rayon chunk builds its own table and the tables are
+    /// merged pairwise, so only the distinct keys are ever held in memory.
+    fn count_table(&self, data: &[u8], parallel: bool) -> CountTable {
+        if parallel && self.chunk_bytes() == STREAM_CHUNK_BYTES {
+            let ranges = compute_ranges(data, rayon::current_num_threads(), 4);
+            ranges.par_iter()
+                .enumerate()
+                .map(|(i, &(s, e))| timed(&data[s..e], || self.count_range(&data[s..e], i)))
+                .reduce(CountTable::new, merge_counts)
+        } else {
+            timed(data, || self.count_range(data, 0))
+        }
+    }
+
+    /// `collect` for any `Source`. Stdin and compressed files are scanned a window
+    /// of chunks at a time.
+    fn collect_from(&self, source: &Source, parallel: bool) -> PyResult<Vec<String>> {
+        match source {
+            Source::Mapped(mmap) => Ok(self.collect(mmap, parallel)),
+            _ => {
+                let mut out = Vec::new();
+                source.scan_in_order(
+                    STREAM_CHUNK_BYTES,
+                    parallel,
+                    |_, chunk| self.scan_owned(chunk),
+                    |part| {
+                        out.extend(part);
+                        true
+                    },
+                )?;
+                Ok(out)
+            }
+        }
+    }
+
+    /// `count_table` for any `Source`. Tables from streamed input are merged window
+    /// by window.
+    fn count_table_from(&self, source: &Source, parallel: bool) -> PyResult<CountTable> {
+        match source {
+            Source::Mapped(mmap) => Ok(self.count_table(mmap, parallel)),
+            _ => {
+                let mut table = CountTable::new();
+                source.scan_in_order(
+                    STREAM_CHUNK_BYTES,
+                    parallel,
+                    |i, chunk| self.count_range(chunk, i),
+                    |part| {
+                        table = merge_counts(std::mem::take(&mut table), part);
+                        true
+                    },
+                )?;
+                Ok(table)
+            }
+        }
+    }
+
+    /// `scan_owned`, with `prefix` and a colon in front of every record when given,
+    /// or for `--format` rows, `prefix` as their `path`.
+    fn scan_prefixed(&self, data: &[u8], prefix: Option<&str>) -> Vec<String> {
+        match (self, prefix) {
+            (_, None) => self.scan_owned(data),
+            (Engine::Rows(spec), Some(path)) => {
+                let mut out = Vec::new();
+                spec.for_each_match(data, |caps| out.push(spec.json(caps, Some(path))));
+                out
+            }
+            (_, Some(prefix)) => {
+                let mut out = Vec::new();
+                self.scan(data, &mut |record| out.push(format!("{}:{}", prefix, record)));
+                out
+            }
+        }
+    }
+
+    /// Records from every file in `paths` in order, each prefixed with its file's
+    /// label when there are `labels` (like `grep -H`).
+    fn collect_paths(&self, paths: &[String], parallel: bool, labels: Option<&[String]>) -> PyResult<Vec<String>> {
+        let trigrams = self.trigrams();
+        if let ([path], None) = (paths, labels) {
+            if !has_index(trigrams.as_ref(), path) {
+                return self.collect_from(&Source::open(path)?, parallel);
+            }
+        }
+        let mut out = Vec::new();
+        scan_paths(
+            paths,
+            self.chunk_bytes(),
+            parallel,
+            trigrams.as_ref(),
+            |file, _, chunk| self.scan_prefixed(chunk, labels.map(|labels| labels[file].as_str())),
+            |part| {
+                out.extend(part);
+                true
+            },
+        )?;
+        Ok(out)
+    }
+
+    /// One `CountTable` for all the files in `paths`.
+    fn count_table_paths(&self, paths: &[String], parallel: bool) -> PyResult<CountTable> {
+        let trigrams = self.trigrams();
+        if let [path] = paths {
+            if !has_index(trigrams.as_ref(), path) {
+                return self.count_table_from(&Source::open(path)?, parallel);
+            }
+        }
+        let mut table = CountTable::new();
+        scan_paths(
+            paths,
+            self.chunk_bytes(),
+            parallel,
+            trigrams.as_ref(),
+            |_, chunk, data| self.count_range(data, chunk),
+            |part| {
+                table = merge_counts(std::mem::take(&mut table), part);
+                true
+            },
+        )?;
+        Ok(table)
+    }
+
+    /// `count_table_paths` as (key, count) pairs in first-seen order.
+    fn count(&self, paths: &[String], parallel: bool) -> PyResult<Vec<(String, usize)>> {
+        Ok(first_seen(self.count_table_paths(paths, parallel)?))
+    }
+
+    /// `HyperLogLog` of the records of every file in `paths`, a sketch per chunk
+    /// (across the rayon pool when `parallel`) merged as the chunks finish.
+    fn approx_distinct_paths(&self, paths: &[String], parallel: bool, error: f64) -> PyResult<HyperLogLog> {
+        let mut sketch = HyperLogLog::new(error);
+        scan_paths(
+            paths,
+            self.chunk_bytes(),
+            parallel,
+            self.trigrams().as_ref(),
+            |_, _, data| {
+                let mut part = HyperLogLog::new(error);
+                self.scan(data, &mut |record| part.add(sketch_hash(&record)));
+                part
+            },
+            |part| {
+                sketch = std::mem::replace(&mut sketch, HyperLogLog::new(error)).merge(part);
+                true
+            },
+        )?;
+        Ok(sketch)
+    }
+
+    /// `HeavyHitters` of the records of every file in `paths`, built and merged
+    /// like `approx_distinct_paths`.
+    fn heavy_hitters_paths(&self, paths: &[String], parallel: bool, error: f64) -> PyResult<HeavyHitters> {
+        let mut sketch = HeavyHitters::new(error);
+        scan_paths(
+            paths,
+            self.chunk_bytes(),
+            parallel,
+            self.trigrams().as_ref(),
+            |_, _, data| {
+                let mut part = HeavyHitters::new(error);
+                self.scan(data, &mut |record| part.add(&record));
+                part
+            },
+            |part| {
+                sketch = std::mem::replace(&mut sketch, HeavyHitters::new(error)).merge(part);
+                true
+            },
+        )?;
+        Ok(sketch)
+    }
+
+    /// The distinct records of `data` in order of first occurrence, prefixed like
+    /// `scan_prefixed`. As in `count_range`, only a record's first occurrence
+    /// allocates, so memory follows the distinct records, not the matches.
+    fn distinct_range(&self, data: &[u8], prefix: Option<&str>) -> Vec<String> {
+        match (self, prefix) {
+            (Engine::Rows(_), Some(_)) => {
+                let rows = self.scan_prefixed(data, prefix);
+                let mut seen = HashSet::with_capacity(rows.len());
+                let first: Vec<bool> = rows.iter().map(|row| seen.insert(row.as_str())).collect();
+                rows.into_iter().zip(first).filter_map(|(row, first)| first.then_some(row)).collect()
+            }
+            (_, None) => first_seen(self.count_range(data, 0)).into_iter().map(|(record, _)| record).collect(),
+            (_, Some(prefix)) => first_seen(self.count_range(data, 0))
+                .into_iter()
+                .map(|(record, _)| format!("{}:{}", prefix, record))
+                .collect(),
+        }
+    }
+}
+
+/// Append `span`, shifted by `base`, to a table of offsets; a missing span is -1, -1.
+fn push_span(out: &mut Vec<i64>, base: usize, span: Option<(usize, usize)>) {
+    match span {
+        Some((s, e)) => out.extend([(base + s) as i64, (base + e) as i64]),
+        None => out.extend([-1, -1]),
+    }
+}
+
+/// Offsets of each match of `regex` in `hay` and of its `groups`, as in `Engine::offsets`.
+fn regex_offsets(regex: &RustRegexBytes, hay: &[u8], base: usize, groups: &[usize], out: &mut Vec<i64>) {
+    if groups.is_empty() {
+        for m in regex.find_iter(hay) {
+            push_span(out, base, Some((m.start(), m.end())));
+        }
+        return;
+    }
+    for caps in regex.captures_iter(hay) {
+        for g in std::iter::once(0).chain(groups.iter().copied()) {
+            push_span(out, base, caps.get(g).map(|m| (m.start(), m.end())));
+        }
+    }
+}
+
+/// The rows of `table` as (key, count) pairs in first-seen order.
+fn first_seen(table: CountTable) -> Vec<(String, usize)> {
+    let mut rows: Vec<_> = table.into_iter().collect();
+    rows.sort_unstable_by_key(|(_, (_, first))| *first);
+    rows.into_iter().map(|(key, (n, _))| (key, n)).collect()
+}
+
+/// The `k` keys of `table` with the highest counts (lowest unless `descending`),
+/// ordered by count with ties in first-seen order: exactly the head of a stable
+/// sort of the first-seen list. Each rayon split keeps at most `2k` candidates,
+/// pruned with a partial sort, so the work after counting scales with `k` rather
+/// than with the number of distinct keys.
+fn select_top_k(table: CountTable, k: usize, descending: bool, parallel: bool) -> Vec<(String, usize)> {
+    if k == 0 {
+        return Vec::new();
+    }
+    let rank = |a: &CountRow, b: &CountRow| {
+        let by_count = if descending { b.1.0.cmp(&a.1.0) } else { a.1.0.cmp(&b.1.0) };
+        by_count.then(a.1.1.cmp(&b.1.1))
+    };
+    let prune = |mut rows: Vec<CountRow>| {
+        if rows.len() > k {
+            rows.select_nth_unstable_by(k - 1, &rank);
+            rows.truncate(k);
+        }
+        rows
+    };
+    let keep = |mut rows: Vec<CountRow>, row: CountRow| {
+        rows.push(row);
+        if rows.len() >= 2 * k { prune(rows) } else { rows }
+    };
+    let best = if parallel {
+        table.into_par_iter()
+            .fold(Vec::new, keep)
+            .reduce(Vec::new, |mut a, b| {
+                a.extend(b);
+                prune(a)
+            })
+    } else {
+        table.into_iter().fold(Vec::new(), keep)
+    };
+    let mut best = prune(best);
+    best.sort_unstable_by(&rank);
+    best.into_iter().map(|(key, (n, _))| (key, n)).collect()
+}
+
+/// Relative accuracy of `Sketch` percentiles: the value reported for a rank is
+/// within 1% of the value actually at that rank.
+const SKETCH_ACCURACY: f64 = 0.01;
+/// Ratio between the bounds of consecutive `Sketch` buckets.
+const SKETCH_GAMMA: f64 = (1.0 + SKETCH_ACCURACY) / (1.0 - SKETCH_ACCURACY);
+/// Values closer to zero than this are counted as zero.
+const SKETCH_MIN_VALUE: f64 = 1e-9;
+
+/// A mergeable percentile sketch (DDSketch): values are counted in buckets whose
+/// bounds grow by `SKETCH_GAMMA`, so any percentile is read off to within
+/// `SKETCH_ACCURACY` however many values were added, in memory that grows with the
+/// range of the values rather than their number. Sketches merge by adding counts.
+#[derive(Default)]
+struct Sketch {
+    positive: HashMap<i32, u64>,
+    negative: HashMap<i32, u64>,
+    zeros: u64,
+}
+
+impl Sketch {
+    fn bucket(magnitude: f64) -> i32 {
+        (magnitude.ln() / SKETCH_GAMMA.ln()).ceil() as i32
+    }
+
+    /// The value standing in for bucket `index`, whose relative distance to both
+    /// of the bucket's bounds is `SKETCH_ACCURACY`.
+    fn bucket_value(index: i32) -> f64 {
+        2.0 * SKETCH_GAMMA.powi(index) / (SKETCH_GAMMA + 1.0)
+    }
+
+    fn add(&mut self, value: f64) {
+        if value.abs() < SKETCH_MIN_VALUE {
+            self.zeros += 1;
+        } else if value > 0.0 {
+            *self.positive.entry(Self::bucket(value)).or_default() += 1;
+        } else {
+            *self.negative.entry(Self::bucket(-value)).or_default() += 1;
+        }
+    }
+
+    fn merge(&mut self, other: Sketch) {
+        for (index, n) in other.positive {
+            *self.positive.entry(index).or_default() += n;
+        }
+        for (index, n) in other.negative {
+            *self.negative.entry(index).or_default() += n;
+        }
+        self.zeros += other.zeros;
+    }
+
+    /// The value at fraction `q` (0 to 1) of the `count` values added, by the
+    /// nearest-rank method on the sorted values.
+    fn quantile(&self, q: f64, count: u64) -> f64 {
+        let rank = (q * count.saturating_sub(1) as f64).round() as u64;
+        let mut negative: Vec<_> = self.negative.iter().collect();
+        negative.sort_unstable_by(|a, b| b.0.cmp(a.0));
+        let mut positive: Vec<_> = self.positive.iter().collect();
+        positive.sort_unstable_by_key(|(index, _)| **index);
+        let buckets = negative.into_iter()
+            .map(|(&index, &n)| (-Self::bucket_value(index), n))
+            .chain(std::iter::once((0.0, self.zeros)))
+            .chain(positive.into_iter().map(|(&index, &n)| (Self::bucket_value(index), n)));
+        let mut seen = 0;
+        for (value, n) in buckets {
+            seen += n;
+            if seen > rank {
+                return value;
+            }
+        }
+        0.0
+    }
+}
+
+/// Numeric aggregates of the values of one `--agg` group.
+struct Summary {
+    count: u64,
+    sum: f64,
+    min: f64,
+    max: f64,
+    sketch: Sketch,
+}
+
+impl Summary {
+    fn new() -> Self {
+        Summary { count: 0, sum: 0.0, min: f64::INFINITY, max: f64::NEG_INFINITY, sketch: Sketch::default() }
+    }
+
+    fn add(&mut self, value: f64) {
+        self.count += 1;
+        self.sum += value;
+        self.min = self.min.min(value);
+        self.max = self.max.max(value);
+        self.sketch.add(value);
+    }
+
+    fn merge(&mut self, other: Summary) {
+        self.count += other.count;
+        self.sum += other.sum;
+        self.min = self.min.min(other.min);
+        self.max = self.max.max(other.max);
+        self.sketch.merge(other.sketch);
+    }
+
+    /// Percentile `p` (0 to 100), kept within the exact min and max.
+    fn percentile(&self, p: f64) -> f64 {
+        self.sketch.quantile(p / 100.0, self.count).clamp(self.min, self.max)
+    }
+}
+
+/// One `Query.aggregate` row: key, count, sum, min, max, mean and percentiles.
+type AggregateRow = (String, u64, f64, f64, f64, f64, Vec<f64>);
+
+/// A `Summary` per key, with the position of each key's first occurrence, as in
+/// a `CountTable`.
+type SummaryTable = HashMap<String, (Summary, u64)>;
+
+/// Merge two summary tables, folding the smaller into the larger.
+fn merge_summaries(mut a: SummaryTable, mut b: SummaryTable) -> SummaryTable {
+    if a.len() < b.len() {
+        std::mem::swap(&mut a, &mut b);
+    }
+    for (key, (summary, first)) in b {
+        match a.get_mut(&key) {
+            Some(entry) => {
+                entry.0.merge(summary);
+                entry.1 = entry.1.min(first);
+            }
+            None => {
+                a.insert(key, (summary, first));
+            }
+        }
+    }
+    a
+}
+
+/// Group `value` of a match as a number, `None` when it did not take part or isn't
+/// a finite number.
+fn capture_number(caps: &::regex::bytes::Captures<'_>, value: usize) -> Option<f64> {
+    let text = std::str::from_utf8(caps.get(value)?.as_bytes()).ok()?;
+    text.trim().parse::<f64>().ok().filter(|v| v.is_finite())
+}
+
+/// Call `f` with the captures of every match of `regex` in `data`: within each
+/// candidate line that `lines` finds, or across the whole of `data` when `whole`.
+fn for_each_captures<'a>(
+    regex: &RustRegexBytes,
+    lines: Option<&RustRegexBytes>,
+    whole: bool,
+    data: &'a [u8],
+    mut f: impl FnMut(&::regex::bytes::Captures<'a>),
+) {
+    if whole {
+        regex.captures_iter(data).for_each(|caps| f(&caps));
+    } else {
+        for_each_candidate_line(data, lines, |line| regex.captures_iter(line).for_each(|caps| f(&caps)));
+    }
+}
+
+/// A capture group given by number or by name.
+#[derive(FromPyObject)]
+enum GroupRef {
+    Index(usize),
+    Name(String),
+}
+
+impl GroupRef {
+    fn resolve(&self, regex: &RustRegexBytes) -> PyResult<usize> {
+        let found = match self {
+            GroupRef::Index(g) => Some(*g).filter(|&g| g < regex.captures_len()),
+            GroupRef::Name(name) => regex.capture_names().position(|n| n == Some(name.as_str())),
+        };
+        found.ok_or_else(|| match self {
+            GroupRef::Index(g) => PyValueError::new_err(format!("Capture group {} is not in the pattern", g)),
+            GroupRef::Name(name) => PyValueError::new_err(format!("Capture group {:?} is not in the pattern", name)),
+        })
+    }
+}
+
+/// How `--histogram` reads its timestamp capture. Times are seconds since 1970;
+/// those without a zone are taken as written, as if UTC.
+#[derive(Clone, Copy)]
+enum TimeFormat {
+    /// `Feb  1 00:00:00`, which has no year, so `year` is assumed; with `latest`,
+    /// a date that would be later than it is taken to be in the year before.
+    Syslog { year: i64, latest: Option<i64> },
+    /// `2025-02-01T00:00:00` or with a space for the `T`, optional seconds and
+    /// fraction, and an optional `Z` or `+hh:mm` offset.
+    Iso,
+    /// Seconds since 1970, optionally with a fraction.
+    Epoch,
+}
+
+const MONTHS: [&[u8]; 12] = [
+    b"Jan", b"Feb", b"Mar", b"Apr", b"May", b"Jun", b"Jul", b"Aug", b"Sep", b"Oct", b"Nov", b"Dec",
+];
+/// Most time buckets `Query.histogram` fills in per series.
+const MAX_HISTOGRAM_BUCKETS: i64 = 1 << 20;
+
+/// Days from 1970-01-01 to a proleptic Gregorian date (Howard Hinnant's algorithm).
+fn days_from_civil(year: i64, month: i64, day: i64) -> i64 {
+    let year = if month <= 2 { year - 1 } else { year };
+    let era = year.div_euclid(400);
+    let year_of_era = year - era * 400;
+    let day_of_year = (153 * ((month + 9) % 12) + 2) / 5 + day - 1;
+    let day_of_era = year_of_era * 365 + year_of_era / 4 - year_of_era / 100 + day_of_year;
+    era * 146097 + day_of_era - 719468
+}
+
+/// Seconds since 1970 now.
+fn unix_now() -> i64 {
+    std::time::SystemTime::now()
+        .duration_since(std::time::UNIX_EPOCH)
+        .map_or(0, |d| d.as_secs() as i64)
+}
+
+/// The year `seconds` since 1970 falls in.
+fn year_of(seconds: i64) -> i64 {
+    let days = seconds.div_euclid(86400);
+    let mut year = 1970 + days.div_euclid(366);
+    while days_from_civil(year + 1, 1, 1) <= days {
+        year += 1;
+    }
+    year
+}
+
+/// Reads the fields of a timestamp from the front of `text`.
+struct TimeCursor<'a> {
+    text: &'a [u8],
+    at: usize,
+}
+
+impl TimeCursor<'_> {
+    /// A number of `min` to `max` digits.
+    fn number(&mut self, min: usize, max: usize) -> Option<i64> {
+        let len = self.text[self.at..].iter().take(max).take_while(|b| b.is_ascii_digit()).count();
+        if len < min {
+            return None;
+        }
+        let digits = &self.text[self.at..self.at + len];
+        self.at += len;
+        Some(digits.iter().fold(0, |n, d| n * 10 + (d - b'0') as i64))
+    }
+
+    /// Whether the next byte is one of `bytes`, consuming it if so.
+    fn eat(&mut self, bytes: &[u8]) -> bool {
+        let found = self.text.get(self.at).is_some_and(|b| bytes.contains(b));
+        self.at += found as usize;
+        found
+    }
+
+    /// `hh:mm[:ss]` as seconds into the day.
+    fn clock(&mut self) -> Option<i64> {
+        let hour = self.number(2, 2).filter(|&h| h < 24)?;
+        self.eat(b":").then_some(())?;
+        let minute = self.number(2, 2).filter(|&m| m < 60)?;
+        let second = if self.eat(b":") { self.number(2, 2).filter(|&s| s <= 60)? } else { 0 };
+        Some(hour * 3600 + minute * 60 + second)
+    }
+
+    /// A date, checked only as far as days 1 to 31 of months 1 to 12.
+    fn date(year: i64, month: i64, day: i64) -> Option<i64> {
+        ((1..=12).contains(&month) && (1..=31).contains(&day)).then(|| days_from_civil(year, month, day))
+    }
+}
+
+impl TimeFormat {
+    fn new(name: &str, year: Option<i64>) -> PyResult<Self> {
+        match name {
+            "syslog" => Ok(match year {
+                Some(year) => TimeFormat::Syslog { year, latest: None },
+                // the twelve months up to now, with a day's slack for local times
+                // ahead of UTC, so a log running over New Year keeps December
+                // in the year before
+                None => {
+                    let latest = unix_now() + 86400;
+                    TimeFormat::Syslog { year: year_of(latest), latest: Some(latest) }
+                }
+            }),
+            "iso" => Ok(TimeFormat::Iso),
+            "epoch" => Ok(TimeFormat::Epoch),
+            _ => Err(PyValueError::new_err(format!("Unknown time format {:?}: use syslog, iso or epoch", name))),
+        }
+    }
+
+    /// Seconds since 1970 of the timestamp in `text`, `None` if it doesn't parse.
+    fn parse(self, text: &[u8]) -> Option<i64> {
+        let mut cur = TimeCursor { text: text.trim_ascii(), at: 0 };
+        match self {
+            TimeFormat::Epoch => {
+                let seconds: f64 = std::str::from_utf8(cur.text).ok()?.parse().ok()?;
+                seconds.is_finite().then(|| seconds.floor() as i64)
+            }
+            TimeFormat::Syslog { year, latest } => {
+                let month = MONTHS.iter().position(|m| cur.text.starts_with(m))? as i64 + 1;
+                cur.at = 3;
+                while cur.eat(b" ") {}
+                let day = cur.number(1, 2)?;
+                cur.eat(b" ").then_some(())?;
+                let clock = cur.clock()?;
+                let seconds = TimeCursor::date(year, month, day)? * 86400 + clock;
+                match latest {
+                    Some(latest) if seconds > latest => Some(TimeCursor::date(year - 1, month, day)? * 86400 + clock),
+                    _ => Some(seconds),
+                }
+            }
+            TimeFormat::Iso => {
+                let year = cur.number(4, 4)?;
+                cur.eat(b"-").then_some(())?;
+                let month = cur.number(2, 2)?;
+                cur.eat(b"-").then_some(())?;
+                let day = cur.number(2, 2)?;
+                cur.eat(b"Tt ").then_some(())?;
+                let mut seconds = TimeCursor::date(year, month, day)? * 86400 + cur.clock()?;
+                if cur.eat(b".,") {
+                    cur.number(1, usize::MAX)?;
+                }
+                if cur.eat(b"+-") {
+                    let sign = if cur.text[cur.at - 1] == b'-' { -1 } else { 1 };
+                    let hours = cur.number(2, 2)?;
+                    cur.eat(b":");
+                    let minutes = cur.number(2, 2).unwrap_or(0);
+                    seconds -= sign * (hours * 3600 + minutes * 60);
+                }
+                Some(seconds)
+            }
+        }
+    }
+}
+
+/// `--histogram` counts per series (a key like a `CountTable`'s): the count per
+/// time bucket, and the position of the series' first occurrence.
+type HistogramTable = HashMap<String, (HashMap<i64, u64>, u64)>;
+
+/// Merge two histogram tables, folding the smaller into the larger.
+fn merge_histograms(mut a: HistogramTable, mut b: HistogramTable) -> HistogramTable {
+    if a.len() < b.len() {
+        std::mem::swap(&mut a, &mut b);
+    }
+    for (key, (buckets, first)) in b {
+        let entry = a.entry(key).or_insert_with(|| (HashMap::new(), first));
+        for (bucket, n) in buckets {
+            *entry.0.entry(bucket).or_default() += n;
+        }
+        entry.1 = entry.1.min(first);
+    }
+    a
+}
+
+impl SpanSpec {
+    fn extract<'a>(&self, line: &'a str) -> Option<&'a str> {
+        let s_pos = self.start.nth(line.as_bytes(), self.start_index)?;
+        match self.end {
+            Some(ref ed) => {
+                let e_pos = ed.nth(line.as_bytes(), self.end_index)? + ed.len();
+                if e_pos <= s_pos {
+                    return None;
+                }
+                let mut matched = &line[s_pos..e_pos];
+                if self.omit_first < matched.len() {
+                    matched = &matched[self.omit_first..];
+                }
+                if self.omit_last < matched.len() {
+                    matched = &matched[..matched.len() - self.omit_last];
+                }
+                Some(matched)
+            }
+            None if self.print_line_on_match => Some(line),
+            None => None,
+        }
+    }
+}
+
+/// `-rp`/`-g` with `--format`: the capture groups of every match as named columns,
+/// written as JSON Lines records or as Arrow IPC record batches.
+struct RowSpec {
+    regex: RustRegexBytes,
+    /// Finds the candidate lines of a line-by-line search, as for `Engine::Joined`.
+    lines: Option<RustRegexBytes>,
+    /// Match across the whole buffer, as `-g` does, rather than within lines.
+    whole: bool,
+    groups: Vec<usize>,
+    /// Column name of each of `groups`: the group's name, else its number, and
+    /// `full` for the whole match (the keys `findall_captures_named_str` uses).
+    names: Vec<String>,
+}
+
+impl RowSpec {
+    /// `groups` defaults to every group of `pattern`, or the whole match when it
+    /// has none.
+    fn new(pattern: &str, groups: Option<Vec<usize>>, whole: bool) -> PyResult<Self> {
+        let compile_error = |e: ::regex::Error| PyValueError::new_err(format!("Regex compile error: {}", e));
+        let regex = RustRegexBytes::new(pattern).map_err(compile_error)?;
+        let lines = if whole { None } else { line_prefilter(pattern, PATTERN_SET_SIZE_LIMIT).map_err(compile_error)? };
+        let n = regex.captures_len();
+        let groups = match groups.filter(|g| !g.is_empty()) {
+            Some(groups) => groups,
+            None if n > 1 => (1..n).collect(),
+            None => vec![0],
+        };
+        if let Some(g) = groups.iter().find(|&&g| g >= n) {
+            return Err(PyValueError::new_err(format!("Capture group {} is not in the pattern", g)));
+        }
+        let group_names: Vec<Option<&str>> = regex.capture_names().collect();
+        let names = groups.iter()
+            .map(|&g| match group_names[g] {
+                _ if g == 0 => "full".to_string(),
+                Some(name) => name.to_string(),
+                None => g.to_string(),
+            })
+            .collect();
+        Ok(RowSpec { regex, lines, whole, groups, names })
+    }
+
+    /// Call `row` with the captures of every match in `data`, in input order.
+    fn for_each_match<'a>(&self, data: &'a [u8], row: impl FnMut(&::regex::bytes::Captures<'a>)) {
+        for_each_captures(&self.regex, self.lines.as_ref(), self.whole, data, row);
+    }
+
+    /// One match as a JSON object, `path` first when given, and `null` for groups
+    /// that did not take part.
+    fn json(&self, caps: &::regex::bytes::Captures<'_>, path: Option<&str>) -> String {
+        let mut out = String::from("{");
+        if let Some(path) = path {
+            push_json_str(&mut out, "path");
+            out.push(':');
+            push_json_str(&mut out, path);
+        }
+        for (i, (&g, name)) in self.groups.iter().zip(&self.names).enumerate() {
+            if i > 0 || path.is_some() {
+                out.push(',');
+            }
+            push_json_str(&mut out, name);
+            out.push(':');
+            match caps.get(g) {
+                Some(m) => push_json_str(&mut out, &String::from_utf8_lossy(m.as_bytes())),
+                None => out.push_str("null"),
+            }
+        }
+        out.push('}');
+        out
+    }
+
+    /// The Arrow IPC schema message: a nullable Utf8 column per group, after a
+    /// `path` column when `with_path`.
+    fn ipc_schema(&self, with_path: bool) -> Vec<u8> {
+        let path = with_path.then(|| "path".to_string());
+        let names: Vec<&String> = path.iter().chain(&self.names).collect();
+        ipc_schema(&names)
+    }
+
+    /// The matches in `data` as Arrow IPC record batch messages of at most
+    /// `batch_rows` rows, built a column at a time, with every row's `path` when
+    /// given. A batch is also cut before any column's values would pass the int32
+    /// offsets of a Utf8 column, so whole-file `-g` scans of huge logs stay readable.
+    fn ipc_batches(&self, data: &[u8], path: Option<&str>, batch_rows: usize) -> PyResult<Vec<Vec<u8>>> {
+        let new_columns = || -> Vec<StrColumn> {
+            (0..self.groups.len() + path.is_some() as usize).map(|_| StrColumn::new()).collect()
+        };
+        let mut batches = Vec::new();
+        let mut columns = new_columns();
+        let mut rows = 0;
+        let mut too_long = None;
+        self.for_each_match(data, |caps| {
+            if too_long.is_some() {
+                return;
+            }
+            let values: Vec<Option<Cow<'_, str>>> = path.map(|path| Some(Cow::Borrowed(path)))
+                .into_iter()
+                .chain(self.groups.iter().map(|&g| caps.get(g).map(|m| String::from_utf8_lossy(m.as_bytes()))))
+                .collect();
+            let fits = |columns: &[StrColumn]| {
+                columns.iter().zip(&values).all(|(column, value)| column.fits(value.as_deref()))
+            };
+            if rows > 0 && (rows >= batch_rows || !fits(&columns)) {
+                batches.push(ipc_batch(&std::mem::replace(&mut columns, new_columns()), rows));
+                rows = 0;
+            }
+            if !fits(&columns) {
+                too_long = values.iter().flatten().map(|value| value.len()).max();
+                return;
+            }
+            for (column, value) in columns.iter_mut().zip(&values) {
+                column.push(value.as_deref(), rows);
+            }
+            rows += 1;
+        });
+        if let Some(len) = too_long {
+            return Err(PyValueError::new_err(format!("A {} byte capture is too long for an Arrow Utf8 column", len)));
+        }
+        if rows > 0 {
+            batches.push(ipc_batch(&columns, rows));
+        }
+        Ok(batches)
+    }
+}
+
+/// Append `s` to `out` as a quoted JSON string.
+fn push_json_str(out: &mut String, s: &str) {
+    out.push('"');
+    for c in s.chars() {
+        match c {
+            '"' => out.push_str("\\\""),
+            '\\' => out.push_str("\\\\"),
+            '\n' => out.push_str("\\n"),
+            '\r' => out.push_str("\\r"),
+            '\t' => out.push_str("\\t"),
+            c if (c as u32) < 0x20 => out.push_str(&format!("\\u{:04x}", c as u32)),
+            c => out.push(c),
+        }
+    }
+    out.push('"');
+}
+
+/// One Arrow Utf8 column: a validity bitmap, `rows + 1` int32 offsets and the
+/// values, invalid UTF-8 replaced as in the text records by the caller.
+struct StrColumn {
+    validity: Vec<u8>,
+    nulls: usize,
+    offsets: Vec<i32>,
+    values: Vec<u8>,
+}
+
+impl StrColumn {
+    fn new() -> Self {
+        StrColumn { validity: Vec::new(), nulls: 0, offsets: vec![0], values: Vec::new() }
+    }
+
+    /// Whether `value` can be appended without its end passing an int32 offset.
+    fn fits(&self, value: Option<&str>) -> bool {
+        self.values.len() + value.map_or(0, str::len) <= i32::MAX as usize
+    }
+
+    /// Append `value` as row number `row`, `None` being a null. Check `fits` first.
+    fn push(&mut self, value: Option<&str>, row: usize) {
+        if row % 8 == 0 {
+            self.validity.push(0);
+        }
+        match value {
+            Some(value) => {
+                self.values.extend_from_slice(value.as_bytes());
+                self.validity[row / 8] |= 1 << (row % 8);
+            }
+            None => self.nulls += 1,
+        }
+        self.offsets.push(self.values.len() as i32);
+    }
+}
+
+/// Arrow IPC stream end-of-stream marker: a continuation and a zero length.
+const IPC_EOS: [u8; 8] = [0xff, 0xff, 0xff, 0xff, 0, 0, 0, 0];
+/// Arrow `MetadataVersion::V5`.
+const IPC_VERSION: i16 = 4;
+/// `MessageHeader` union members and the `Type` union's Utf8.
+const IPC_SCHEMA: u8 = 1;
+const IPC_RECORD_BATCH: u8 = 3;
+const IPC_UTF8: u8 = 5;
+
+/// A table field for `FlatBuffer::table`. `Ref` is a reference to a table, vector
+/// or string that is written after the table and patched in with `FlatBuffer::patch`.
+enum Slot {
+    U8(u8),
+    I16(i16),
+    I64(i64),
+    Ref,
+}
+
+impl Slot {
+    fn size(&self) -> usize {
+        match self {
+            Slot::U8(_) => 1,
+            Slot::I16(_) => 2,
+            Slot::Ref => 4,
+            Slot::I64(_) => 8,
+        }
+    }
+}
+
+/// Just enough of a FlatBuffers writer for the Arrow IPC metadata. Unlike the
+/// FlatBuffers builders it writes front to back: tables first, then the vectors,
+/// strings and tables they refer to, whose offsets are patched in afterwards
+/// (references only ever point forward).
+struct FlatBuffer {
+    buf: Vec<u8>,
+}
+
+impl FlatBuffer {
+    fn new() -> Self {
+        // room for the offset of the root table
+        FlatBuffer { buf: vec![0; 4] }
+    }
+
+    fn pad(&mut self, align: usize) {
+        while self.buf.len() % align != 0 {
+            self.buf.push(0);
+        }
+    }
+
+    /// Write a table whose fields, in id order, are `slots` (`None` if absent)
+    /// preceded by its vtable. Returns where the table starts and where each `Ref`
+    /// slot is, in order.
+    fn table(&mut self, slots: &[Option<Slot>]) -> (usize, Vec<usize>) {
+        let mut at = Vec::with_capacity(slots.len());
+        let mut size: usize = 4; // the table's offset to its vtable
+        for slot in slots {
+            at.push(slot.as_ref().map_or(0, |slot| {
+                size = size.next_multiple_of(slot.size());
+                let field = size;
+                size += slot.size();
+                field
+            }));
+        }
+        self.pad(2);
+        let vtable = self.buf.len();
+        for n in [4 + 2 * slots.len(), size].into_iter().chain(at.iter().copied()) {
+            self.buf.extend_from_slice(&(n as u16).to_le_bytes());
+        }
+        // 8-aligned, so every field is aligned to its size
+        self.pad(8);
+        let table = self.buf.len();
+        self.buf.extend_from_slice(&((table - vtable) as i32).to_le_bytes());
+        let mut refs = Vec::new();
+        for (slot, &field) in slots.iter().zip(&at) {
+            let Some(slot) = slot else { continue };
+            self.buf.resize(table + field, 0);
+            match slot {
+                Slot::U8(v) => self.buf.push(*v),
+                Slot::I16(v) => self.buf.extend_from_slice(&v.to_le_bytes()),
+                Slot::I64(v) => self.buf.extend_from_slice(&v.to_le_bytes()),
+                Slot::Ref => {
+                    refs.push(self.buf.len());
+                    self.buf.extend_from_slice(&[0; 4]);
+                }
+            }
+        }
+        self.buf.resize(table + size, 0);
+        (table, refs)
+    }
+
+    /// Point the reference at `at` to `target`.
+    fn patch(&mut self, at: usize, target: usize) {
+        self.buf[at..at + 4].copy_from_slice(&((target - at) as u32).to_le_bytes());
+    }
+
+    fn string(&mut self, s: &str) -> usize {
+        self.pad(4);
+        let at = self.buf.len();
+        self.buf.extend_from_slice(&(s.len() as u32).to_le_bytes());
+        self.buf.extend_from_slice(s.as_bytes());
+        self.buf.push(0);
+        at
+    }
+
+    /// A vector of structs of two int64 (`FieldNode` and `Buffer`), whose elements
+    /// are 8-aligned.
+    fn pairs(&mut self, pairs: &[(usize, usize)]) -> usize {
+        while (self.buf.len() + 4) % 8 != 0 {
+            self.buf.push(0);
+        }
+        let at = self.buf.len();
+        self.buf.extend_from_slice(&(pairs.len() as u32).to_le_bytes());
+        for &(a, b) in pairs {
+            self.buf.extend_from_slice(&(a as i64).to_le_bytes());
+            self.buf.extend_from_slice(&(b as i64).to_le_bytes());
+        }
+        at
+    }
+
+    /// A vector of `n` table references, returning where it starts and where each
+    /// reference is.
+    fn refs(&mut self, n: usize) -> (usize, Vec<usize>) {
+        self.pad(4);
+        let at = self.buf.len();
+        self.buf.extend_from_slice(&(n as u32).to_le_bytes());
+        let refs = (0..n).map(|i| at + 4 + 4 * i).collect();
+        self.buf.resize(at + 4 + 4 * n, 0);
+        (at, refs)
+    }
+
+    /// The buffer with `root` as its root table, padded to 8 bytes.
+    fn finish(mut self, root: usize) -> Vec<u8> {
+        self.patch(0, root);
+        self.pad(8);
+        self.buf
+    }
+}
+
+/// An encapsulated IPC message: continuation marker, metadata length, a `Message`
+/// whose `header` is written by `header`, then `body`.
+fn ipc_message(header_type: u8, body: &[u8], header: impl FnOnce(&mut FlatBuffer) -> usize) -> Vec<u8> {
+    let mut fb = FlatBuffer::new();
+    let (message, refs) = fb.table(&[
+        Some(Slot::I16(IPC_VERSION)),
+        Some(Slot::U8(header_type)),
+        Some(Slot::Ref),
+        Some(Slot::I64(body.len() as i64)),
+    ]);
+    let at = header(&mut fb);
+    fb.patch(refs[0], at);
+    let meta = fb.finish(message);
+    let mut out = Vec::with_capacity(8 + meta.len() + body.len());
+    out.extend_from_slice(&[0xff; 4]);
+    out.extend_from_slice(&(meta.len() as i32).to_le_bytes());
+    out.extend_from_slice(&meta);
+    out.extend_from_slice(body);
+    out
+}
+
+/// A schema message of nullable Utf8 columns called `names`.
+fn ipc_schema(names: &[&String]) -> Vec<u8> {
+    ipc_message(IPC_SCHEMA, &[], |fb| {
+        // endianness is left at its default, little
+        let (schema, refs) = fb.table(&[None, Some(Slot::Ref)]);
+        let (fields, field_refs) = fb.refs(names.len());
+        fb.patch(refs[0], fields);
+        for (name, at) in names.iter().zip(field_refs) {
+            let (field, refs) = fb.table(&[
+                Some(Slot::Ref),
+                Some(Slot::U8(1)),
+                Some(Slot::U8(IPC_UTF8)),
+                Some(Slot::Ref),
+                None,
+                Some(Slot::Ref),
+            ]);
+            fb.patch(at, field);
+            let name = fb.string(name);
+            fb.patch(refs[0], name);
+            let (utf8, _) = fb.table(&[]);
+            fb.patch(refs[1], utf8);
+            let (children, _) = fb.refs(0);
+            fb.patch(refs[2], children);
+        }
+        schema
+    })
+}
+
+/// A record batch message of `rows` rows in `columns`, each buffer 8-aligned in
+/// the body. The validity bitmap is left out of columns without nulls.
+fn ipc_batch(columns: &[StrColumn], rows: usize) -> Vec<u8> {
+    let mut body = Vec::new();
+    let mut buffers = Vec::with_capacity(3 * columns.len());
+    let mut put = |bytes: &[u8]| {
+        buffers.push((body.len(), bytes.len()));
+        body.extend_from_slice(bytes);
+        body.resize(body.len().next_multiple_of(8), 0);
+    };
+    for column in columns {
+        put(if column.nulls > 0 { &column.validity } else { &[] });
+        let offsets: Vec<u8> = column.offsets.iter().flat_map(|o| o.to_le_bytes()).collect();
+        put(&offsets);
+        put(&column.values);
+    }
+    let nodes: Vec<(usize, usize)> = columns.iter().map(|c| (rows, c.nulls)).collect();
+    ipc_message(IPC_RECORD_BATCH, &body, |fb| {
+        let (batch, refs) = fb.table(&[Some(Slot::I64(rows as i64)), Some(Slot::Ref), Some(Slot::Ref)]);
+        let at = fb.pairs(&nodes);
+        fb.patch(refs[0], at);
+        let at = fb.pairs(&buffers);
+        fb.patch(refs[1], at);
+        batch
+    })
+}
+
+/// Collects records into batches of `batch_size` for a `RecordStream` channel.
+struct BatchSender {
+    tx: SyncSender<PyResult<Vec<String>>>,
+    batch: Vec<String>,
+    batch_size: usize,
+    open: bool,
+}
+
+impl BatchSender {
+    fn new(tx: SyncSender<PyResult<Vec<String>>>, batch_size: usize) -> Self {
+        let batch_size = batch_size.max(1);
+        BatchSender { tx, batch: Vec::with_capacity(batch_size), batch_size, open: true }
+    }
+
+    /// Queue one record; returns false once the Python side has dropped the stream.
+    fn push(&mut self, record: String) -> bool {
+        self.batch.push(record);
+        if self.batch.len() >= self.batch_size {
+            return self.flush();
+        }
+        self.open
+    }
+
+    /// Send whatever is buffered, even if the batch is not full yet.
+    fn flush(&mut self) -> bool {
+        if self.open && !self.batch.is_empty() {
+            let batch = std::mem::replace(&mut self.batch, Vec::with_capacity(self.batch_size));
+            self.open = self.tx.send(Ok(batch)).is_ok();
+        }
+        self.open
+    }
+
+    /// Send the records scanned so far, then `err`, which ends the stream.
+    fn fail(mut self, err: PyErr) {
+        if self.flush() {
+            let _ = self.tx.send(Err(err));
+        }
+    }
+}
+
+/// Chance that a `Query.heavy_hitters` count is off by more than its error bound.
+const HEAVY_HITTER_DELTA: f64 = 0.01;
+
+/// 64-bit hash of a record, shared by the sketches so each record is hashed once.
+/// `DefaultHasher::new` has fixed keys, so every chunk's sketch agrees.
+fn sketch_hash(record: &str) -> u64 {
+    let mut hasher = std::hash::DefaultHasher::new();
+    hasher.write(record.as_bytes());
+    hasher.finish()
+}
+
+/// HyperLogLog distinct count: `2^precision` registers, each the highest rank
+/// (leading zeros plus one) among the hashes routed to it. Sketches merge by
+/// keeping the larger register, and the estimate's relative standard error is
+/// 1.04 / sqrt(registers).
+#[derive(Clone)]
+struct HyperLogLog {
+    precision: u32,
+    registers: Vec<u8>,
+}
+
+impl HyperLogLog {
+    /// Enough registers for a relative standard error of `error`, from 2^4 to 2^18.
+    fn new(error: f64) -> Self {
+        let registers = (1.04 / error).powi(2);
+        let precision = (registers.log2().ceil() as u32).clamp(4, 18);
+        HyperLogLog { precision, registers: vec![0; 1 << precision] }
+    }
+
+    fn add(&mut self, hash: u64) {
+        let register = (hash >> (64 - self.precision)) as usize;
+        // the bit below the register bits caps the rank at 64 - precision + 1
+        let rank = ((hash << self.precision) | (1 << (self.precision - 1))).leading_zeros() as u8 + 1;
+        self.registers[register] = self.registers[register].max(rank);
+    }
+
+    fn merge(mut self, other: HyperLogLog) -> HyperLogLog {
+        for (r, o) in self.registers.iter_mut().zip(other.registers) {
+            *r = (*r).max(o);
+        }
+        self
+    }
+
+    /// The distinct count, by linear counting while registers are still empty.
+    fn estimate(&self) -> f64 {
+        let m = self.registers.len() as f64;
+        let alpha = match self.registers.len() {
+            16 => 0.673,
+            32 => 0.697,
+            64 => 0.709,
+            _ => 0.7213 / (1.0 + 1.079 / m),
+        };
+        let sum: f64 = self.registers.iter().map(|&r| (-(r as f64)).exp2()).sum();
+        let raw = alpha * m * m / sum;
+        let empty = self.registers.iter().filter(|&&r| r == 0).count();
+        if raw <= 2.5 * m && empty > 0 { m * (m / empty as f64).ln() } else { raw }
+    }
+}
+
+/// Count-Min sketch: `depth` rows of `width` counters. A record adds one to a
+/// counter in each row, and its count is the smallest of them: never below the
+/// true count, and with probability 1 - e^-depth above it by at most e / width
+/// of all records. Sketches merge by adding counters.
+struct CountMin {
+    width: usize,
+    depth: usize,
+    counters: Vec<u64>,
+}
+
+impl CountMin {
+    fn new(error: f64, delta: f64) -> Self {
+        let width = (std::f64::consts::E / error).ceil().max(1.0) as usize;
+        let depth = (1.0 / delta).ln().ceil().max(1.0) as usize;
+        CountMin { width, depth, counters: vec![0; width * depth] }
+    }
+
+    /// The counter for `hash` in `row`, from two halves of the one hash.
+    fn counter(&self, hash: u64, row: usize) -> usize {
+        let column = (hash & 0xffff_ffff).wrapping_add((row as u64).wrapping_mul(hash >> 32)) % self.width as u64;
+        row * self.width + column as usize
+    }
+
+    fn add(&mut self, hash: u64) {
+        for row in 0..self.depth {
+            let counter = self.counter(hash, row);
+            self.counters[counter] += 1;
+        }
+    }
+
+    fn estimate(&self, hash: u64) -> u64 {
+        (0..self.depth).map(|row| self.counters[self.counter(hash, row)]).min().unwrap_or(0)
+    }
+
+    fn merge(mut self, other: CountMin) -> CountMin {
+        for (c, o) in self.counters.iter_mut().zip(other.counters) {
+            *c += o;
+        }
+        self
+    }
+}
+
+/// Space-Saving: up to `capacity` keys, each with a count that may be over by at
+/// most its error. A new key with every slot taken replaces the key with the
+/// lowest count, which it inherits as its error, so a key making up more than
+/// 1 / `capacity` of the records is never dropped.
+struct SpaceSaving {
+    capacity: usize,
+    /// key, count and error per slot
+    slots: Vec<(String, u64, u64)>,
+    index: HashMap<String, usize>,
+    /// (count, slot), lowest first
+    order: std::collections::BTreeSet<(u64, usize)>,
+}
+
+impl SpaceSaving {
+    fn new(capacity: usize) -> Self {
+        SpaceSaving {
+            capacity: capacity.max(1),
+            slots: Vec::new(),
+            index: HashMap::new(),
+            order: std::collections::BTreeSet::new(),
+        }
+    }
+
+    fn add(&mut self, key: &str, n: u64, error: u64) {
+        if let Some(&slot) = self.index.get(key) {
+            let entry = &mut self.slots[slot];
+            self.order.remove(&(entry.1, slot));
+            entry.1 += n;
+            entry.2 += error;
+            self.order.insert((entry.1, slot));
+        } else if self.slots.len() < self.capacity {
+            let slot = self.slots.len();
+            self.slots.push((key.to_owned(), n, error));
+            self.index.insert(key.to_owned(), slot);
+            self.order.insert((n, slot));
+        } else if let Some((floor, slot)) = self.order.pop_first() {
+            let evicted = std::mem::replace(&mut self.slots[slot], (key.to_owned(), floor + n, floor + error));
+            self.index.remove(&evicted.0);
+            self.index.insert(key.to_owned(), slot);
+            self.order.insert((floor + n, slot));
+        }
+    }
+
+    /// The most a key that isn't kept can have been counted.
+    fn floor(&self) -> u64 {
+        match self.order.first() {
+            Some(&(count, _)) if self.slots.len() == self.capacity => count,
+            _ => 0,
+        }
+    }
+
+    /// Merge two summaries. A key missing from one may have been counted there
+    /// up to that summary's floor, so it gets that floor as count and error.
+    fn merge(self, other: SpaceSaving) -> SpaceSaving {
+        let (floor, other_floor) = (self.floor(), other.floor());
+        let mut merged: HashMap<String, (u64, u64)> = self.slots.into_iter().map(|(k, n, e)| (k, (n, e))).collect();
+        for (key, n, e) in other.slots {
+            let entry = merged.entry(key).or_insert((floor, floor));
+            entry.0 += n;
+            entry.1 += e;
+        }
+        for (key, entry) in merged.iter_mut() {
+            if !other.index.contains_key(key) {
+                entry.0 += other_floor;
+                entry.1 += other_floor;
+            }
+        }
+        let mut rows: Vec<_> = merged.into_iter().collect();
+        rows.sort_unstable_by(|a, b| b.1.0.cmp(&a.1.0).then_with(|| a.0.cmp(&b.0)));
+        let mut summary = SpaceSaving::new(self.capacity);
+        for (key, (n, e)) in rows.into_iter().take(self.capacity) {
+            summary.add(&key, n, e);
+        }
+        summary
+    }
+}
+
+/// `-c --approx` in fixed memory: candidate heavy hitters from a Space-Saving
+/// summary, with their counts tightened by a Count-Min sketch. Both overcount, so
+/// each key's count is the smaller of the two.
+struct HeavyHitters {
+    error: f64,
+    total: u64,
+    keys: SpaceSaving,
+    counts: CountMin,
+}
+
+impl HeavyHitters {
+    /// Counts within `error` times the number of records, with `1 / error` keys kept.
+    fn new(error: f64) -> Self {
+        HeavyHitters {
+            error,
+            total: 0,
+            keys: SpaceSaving::new((1.0 / error).ceil() as usize),
+            counts: CountMin::new(error, HEAVY_HITTER_DELTA),
+        }
+    }
+
+    fn add(&mut self, record: &str) {
+        self.total += 1;
+        self.keys.add(record, 1, 0);
+        self.counts.add(sketch_hash(record));
+    }
+
+    fn merge(self, other: HeavyHitters) -> HeavyHitters {
+        HeavyHitters {
+            error: self.error,
+            total: self.total + other.total,
+            keys: self.keys.merge(other.keys),
+            counts: self.counts.merge(other.counts),
+        }
+    }
+
+    /// The kept keys counted above `error` times the number of records, highest
+    /// first. Below that a slot may hold any record of the tail, and every key
+    /// really above it is kept, as counts never come out low.
+    fn top(self) -> Vec<(String, u64)> {
+        let counts = &self.counts;
+        let floor = self.error * self.total as f64;
+        let mut rows: Vec<_> = self.keys.slots
+            .into_iter()
+            .map(|(key, n, _)| {
+                let n = n.min(counts.estimate(sketch_hash(&key)));
+                (key, n)
+            })
+            .filter(|&(_, n)| n as f64 > floor)
+            .collect();
+        rows.sort_unstable_by(|a, b| b.1.cmp(&a.1).then_with(|| a.0.cmp(&b.0)));
+        rows
+    }
+}
+
+/// `error` as a sketch's error bound: a fraction between 0 and 1.
+fn check_sketch_error(error: f64) -> PyResult<()> {
+    if error > 0.0 && error < 1.0 {
+        Ok(())
+    } else {
+        Err(PyValueError::new_err(format!("Sketch error {} is not between 0 and 1", error)))
+    }
+}
+
+/// Bytes of records `-S` holds in memory before sorting them into a run on disk.
+const SORT_MEMORY_BYTES: usize = 256 * 1024 * 1024;
+/// What each record held for sorting costs besides its text.
+const SORT_RECORD_OVERHEAD: usize = std::mem::size_of::<(SortKey, String)>();
+
+/// How `-S` orders records.
+#[derive(Clone, Copy, PartialEq)]
+enum SortMode {
+    /// `Ip` when the first record is an IP address, otherwise `Lexical`.
+    Auto,
+    /// By code point, as Python sorts strings.
+    Lexical,
+    /// By the number each record holds.
+    Numeric,
+    /// IPv4 addresses in numeric order, then IPv6 addresses.
+    Ip,
+    /// With runs of digits compared as numbers, so `v2.9` comes before `v2.10`.
+    Natural,
+}
+
+/// A record's sort key, parsed once. Records that aren't a number or address in
+/// a numeric or IP sort are `Text`, and follow those that are.
+#[derive(Clone, Copy)]
+enum SortKey {
+    Number(f64),
+    Ip(u8, u128),
+    Text,
+}
+
+impl SortMode {
+    fn new(name: &str) -> PyResult<Self> {
+        match name {
+            "auto" => Ok(SortMode::Auto),
+            "lexical" => Ok(SortMode::Lexical),
+            "numeric" => Ok(SortMode::Numeric),
+            "ip" => Ok(SortMode::Ip),
+            "natural" => Ok(SortMode::Natural),
+            _ => Err(PyValueError::new_err(format!(
+                "Unknown sort key {:?}: use auto, lexical, numeric, ip or natural",
+                name
+            ))),
+        }
+    }
+
+    /// `Auto` settled by the first record.
+    fn resolve(self, first: &str) -> Self {
+        match self {
+            SortMode::Auto if first.trim().parse::<std::net::IpAddr>().is_ok() => SortMode::Ip,
+            SortMode::Auto => SortMode::Lexical,
+            mode => mode,
+        }
+    }
+
+    fn key(self, record: &str) -> SortKey {
+        match self {
+            SortMode::Numeric => match record.trim().parse::<f64>() {
+                Ok(n) if !n.is_nan() => SortKey::Number(n),
+                _ => SortKey::Text,
+            },
+            SortMode::Ip => match record.trim().parse::<std::net::IpAddr>() {
+                Ok(std::net::IpAddr::V4(ip)) => SortKey::Ip(4, u32::from(ip) as u128),
+                Ok(std::net::IpAddr::V6(ip)) => SortKey::Ip(6, u128::from(ip)),
+                Err(_) => SortKey::Text,
+            },
+            _ => SortKey::Text,
+        }
+    }
+}
+
+/// Compare with runs of ASCII digits taken as numbers: `file9` before `file10`.
+fn natural_cmp(a: &[u8], b: &[u8]) -> std::cmp::Ordering {
+    let digits = |s: &[u8], at: usize| at + s[at..].iter().take_while(|c| c.is_ascii_digit()).count();
+    let number = |run: &[u8]| -> usize { run.iter().take_while(|&&c| c == b'0').count() };
+    let (mut i, mut j) = (0, 0);
+    while i < a.len() && j < b.len() {
+        if a[i].is_ascii_digit() && b[j].is_ascii_digit() {
+            let (end_a, end_b) = (digits(a, i), digits(b, j));
+            let x = &a[i + number(&a[i..end_a])..end_a];
+            let y = &b[j + number(&b[j..end_b])..end_b];
+            let ord = x.len().cmp(&y.len()).then_with(|| x.cmp(y));
+            if ord.is_ne() {
+                return ord;
+            }
+            (i, j) = (end_a, end_b);
+        } else if a[i] != b[j] {
+            return a[i].cmp(&b[j]);
+        } else {
+            (i, j) = (i + 1, j + 1);
+        }
+    }
+    (a.len() - i).cmp(&(b.len() - j))
+}
+
+/// The order `-S` (and `-r`) puts records in. Records equal under a mode's key
+/// fall back to their text, so only identical records ever compare equal.
+#[derive(Clone, Copy)]
+struct RecordOrder {
+    mode: SortMode,
+    descending: bool,
+}
+
+impl RecordOrder {
+    fn cmp(&self, a: &(SortKey, String), b: &(SortKey, String)) -> std::cmp::Ordering {
+        use std::cmp::Ordering::{Equal, Greater, Less};
+        let typed = match (a.0, b.0) {
+            (SortKey::Number(x), SortKey::Number(y)) => x.total_cmp(&y),
+            (SortKey::Ip(fx, x), SortKey::Ip(fy, y)) => (fx, x).cmp(&(fy, y)),
+            (SortKey::Text, SortKey::Text) => Equal,
+            (SortKey::Text, _) => Greater,
+            (_, SortKey::Text) => Less,
+            // a mode never gives both numbers and addresses
+            _ => Equal,
+        };
+        let ord = typed.then_with(|| match self.mode {
+            SortMode::Natural => natural_cmp(a.1.as_bytes(), b.1.as_bytes()).then_with(|| a.1.cmp(&b.1)),
+            _ => a.1.cmp(&b.1),
+        });
+        if self.descending { ord.reverse() } else { ord }
+    }
+}
+
+/// The next record of a run `ExternalSort` spilled to disk, `None` at its end.
+fn read_run_record(run: &mut std::io::BufReader<File>) -> PyResult<Option<String>> {
+    let mut len = [0u8; 8];
+    match run.read_exact(&mut len) {
+        Ok(()) => {}
+        Err(e) if e.kind() == std::io::ErrorKind::UnexpectedEof => return Ok(None),
+        Err(e) => return Err(PyIOError::new_err(format!("Failed to read a sort run: {}", e))),
+    }
+    let mut record = vec![0; u64::from_le_bytes(len) as usize];
+    run.read_exact(&mut record)
+        .map_err(|e| PyIOError::new_err(format!("Failed to read a sort run: {}", e)))?;
+    String::from_utf8(record).map(Some).map_err(|e| PyValueError::new_err(e.to_string()))
+}
+
+/// A file in `dir` for a sorted run, unlinked at once so it goes away with its
+/// handle however the sort ends.
+fn sort_run_file(dir: &Path) -> std::io::Result<File> {
+    static RUNS: AtomicUsize = AtomicUsize::new(0);
+    let name = format!("rygex-sort-{}-{}", std::process::id(), RUNS.fetch_add(1, Ordering::Relaxed));
+    let path = dir.join(name);
+    let file = std::fs::OpenOptions::new().read(true).write(true).create_new(true).open(&path)?;
+    std::fs::remove_file(&path)?;
+    Ok(file)
+}
+
+/// The head of one run in `ExternalSort`'s merge, ordered so that `BinaryHeap`,
+/// a max-heap, pops the record that comes first.
+struct MergeHead {
+    order: RecordOrder,
+    item: (SortKey, String),
+    run: usize,
+}
+
+impl Ord for MergeHead {
+    fn cmp(&self, other: &Self) -> std::cmp::Ordering {
+        self.order.cmp(&other.item, &self.item)
+    }
+}
+
+impl PartialOrd for MergeHead {
+    fn partial_cmp(&self, other: &Self) -> Option<std::cmp::Ordering> {
+        Some(self.cmp(other))
+    }
+}
+
+impl PartialEq for MergeHead {
+    fn eq(&self, other: &Self) -> bool {
+        self.cmp(other).is_eq()
+    }
+}
+
+impl Eq for MergeHead {}
+
+/// `-S` within a memory budget. Records are held with their parsed keys until
+/// they take `budget` bytes, then sorted (across the rayon pool when `parallel`)
+/// and written to a temporary file as a run; `finish` merges the runs. Input that
+/// fits the budget is sorted in memory and never touches the disk.
+struct ExternalSort {
+    order: RecordOrder,
+    unique: bool,
+    parallel: bool,
+    budget: usize,
+    pending: Vec<(SortKey, String)>,
+    pending_bytes: usize,
+    runs: Vec<File>,
+    temp_dir: PathBuf,
+}
+
+impl ExternalSort {
+    fn new(mode: SortMode, descending: bool, unique: bool, parallel: bool, budget: usize) -> Self {
+        ExternalSort {
+            order: RecordOrder { mode, descending },
+            unique,
+            parallel,
+            budget,
+            pending: Vec::new(),
+            pending_bytes: 0,
+            runs: Vec::new(),
+            temp_dir: std::env::temp_dir(),
+        }
+    }
+
+    fn push(&mut self, record: String) -> PyResult<()> {
+        if self.order.mode == SortMode::Auto {
+            self.order.mode = SortMode::Auto.resolve(&record);
+        }
+        self.pending_bytes += record.len() + SORT_RECORD_OVERHEAD;
+        self.pending.push((self.order.mode.key(&record), record));
+        if self.pending_bytes >= self.budget {
+            self.spill()?;
+        }
+        Ok(())
+    }
+
+    fn sort_pending(&mut self) {
+        let order = self.order;
+        if self.parallel {
+            self.pending.par_sort_unstable_by(|a, b| order.cmp(a, b));
+        } else {
+            self.pending.sort_unstable_by(|a, b| order.cmp(a, b));
+        }
+    }
+
+    /// Sort the records held so far into a new run on disk, each record stored
+    /// as its length and its text.
+    fn spill(&mut self) -> PyResult<()> {
+        self.sort_pending();
+        let failed = |e: IOError| PyIOError::new_err(format!("Failed to write a sort run: {}", e));
+        let mut run = std::io::BufWriter::new(sort_run_file(&self.temp_dir).map_err(failed)?);
+        for (_, record) in self.pending.drain(..) {
+            run.write_all(&(record.len() as u64).to_le_bytes()).map_err(failed)?;
+            run.write_all(record.as_bytes()).map_err(failed)?;
+        }
+        let mut file = run.into_inner().map_err(|e| failed(e.into_error()))?;
+        file.seek(SeekFrom::Start(0)).map_err(failed)?;
+        self.runs.push(file);
+        self.pending_bytes = 0;
+        Ok(())
+    }
+
+    /// Call `emit` with every record in order (each distinct record once when
+    /// `unique`) until it returns false.
+    fn finish(mut self, mut emit: impl FnMut(String) -> bool) -> PyResult<()> {
+        let unique = self.unique;
+        // identical records are adjacent, so with `unique` each is held back
+        // until a different one shows it was the last of its kind
+        let mut held: Option<String> = None;
+        let mut deliver = |record: String| -> bool {
+            if !unique {
+                return emit(record);
+            }
+            if held.as_ref() == Some(&record) {
+                return true;
+            }
+            match held.replace(record) {
+                Some(previous) => emit(previous),
+                None => true,
+            }
+        };
+        if self.runs.is_empty() {
+            self.sort_pending();
+            for (_, record) in std::mem::take(&mut self.pending) {
+                if !deliver(record) {
+                    return Ok(());
+                }
+            }
+        } else {
+            if !self.pending.is_empty() {
+                self.spill()?;
+            }
+            let order = self.order;
+            let mut runs: Vec<_> = self.runs.drain(..).map(std::io::BufReader::new).collect();
+            let mut heap = std::collections::BinaryHeap::with_capacity(runs.len());
+            for (run, reader) in runs.iter_mut().enumerate() {
+                if let Some(record) = read_run_record(reader)? {
+                    heap.push(MergeHead { order, item: (order.mode.key(&record), record), run });
+                }
+            }
+            while let Some(head) = heap.pop() {
+                if let Some(record) = read_run_record(&mut runs[head.run])? {
+                    heap.push(MergeHead { order, item: (order.mode.key(&record), record), run: head.run });
+                }
+                if !deliver(head.item.1) {
+                    return Ok(());
+                }
+            }
+        }
+        if let Some(record) = held {
+            emit(record);
+        }
+        Ok(())
+    }
+}
+
+/// Export `len` bytes at `data` through the buffer protocol as a read-only view that
+/// keeps `owner` alive, with items described by `format` and laid out by `shape` and
+/// `strides`, which must live as long as `owner`.
+#[allow(clippy::too_many_arguments)]
+unsafe fn fill_buffer(
+    view: *mut ffi::Py_buffer,
+    flags: c_int,
+    owner: Bound<'_, PyAny>,
+    data: *const u8,
+    len: usize,
+    itemsize: usize,
+    format: &'static CStr,
+    shape: &[isize],
+    strides: &[isize],
+) -> PyResult<()> {
+    if view.is_null() {
+        return Err(PyBufferError::new_err("View is null"));
+    }
+    if flags & ffi::PyBUF_WRITABLE == ffi::PyBUF_WRITABLE {
+        return Err(PyBufferError::new_err("Object is not writable"));
+    }
+    let wants = |flag: c_int| flags & flag == flag;
+    unsafe {
+        (*view).obj = owner.into_ptr();
+        (*view).buf = data as *mut c_void;
+        (*view).len = len as isize;
+        (*view).readonly = 1;
+        (*view).itemsize = itemsize as isize;
+        (*view).format = if wants(ffi::PyBUF_FORMAT) { format.as_ptr() as *mut c_char } else { std::ptr::null_mut() };
+        (*view).ndim = if wants(ffi::PyBUF_ND) { shape.len() as c_int } else { 1 };
+        (*view).shape = if wants(ffi::PyBUF_ND) { shape.as_ptr() as *mut isize } else { std::ptr::null_mut() };
+        (*view).strides = if wants(ffi::PyBUF_STRIDES) { strides.as_ptr() as *mut isize } else { std::ptr::null_mut() };
+        (*view).suboffsets = std::ptr::null_mut();
+        (*view).internal = std::ptr::null_mut();
+    }
+    Ok(())
+}
+
+/// The match offsets from `Query.offsets`: a read-only table of int64 with a row
+/// per match and a (start, end) pair of columns per group in `groups`. It supports
+/// the buffer protocol, so `numpy.asarray(offsets)` and `memoryview(offsets)` use
+/// the table in place.
+#[pyclass(frozen)]
+pub struct MatchOffsets {
+    data: Vec<i64>,
+    groups: Vec<usize>,
+    shape: [isize; 2],
+    strides: [isize; 2],
+}
+
+impl MatchOffsets {
+    fn new(data: Vec<i64>, groups: Vec<usize>) -> Self {
+        let columns = 2 * groups.len();
+        let rows = data.len() / columns;
+        let item = std::mem::size_of::<i64>() as isize;
+        MatchOffsets {
+            data,
+            groups,
+            shape: [rows as isize, columns as isize],
+            strides: [columns as isize * item, item],
+        }
+    }
+}
+
+#[pymethods]
+impl MatchOffsets {
+    fn __len__(&self) -> usize {
+        self.shape[0] as usize
+    }
+
+    /// The group each pair of columns belongs to: 0 for the whole match, then the
+    /// capture groups.
+    #[getter]
+    fn groups(&self) -> Vec<usize> {
+        self.groups.clone()
+    }
+
+    unsafe fn __getbuffer__(slf: Bound<'_, Self>, view: *mut ffi::Py_buffer, flags: c_int) -> PyResult<()> {
+        let this = slf.get();
+        let len = this.data.len() * std::mem::size_of::<i64>();
+        unsafe {
+            fill_buffer(view, flags, slf.clone().into_any(), this.data.as_ptr().cast(), len,
+                        std::mem::size_of::<i64>(), c"q", &this.shape, &this.strides)
+        }
+    }
+}
+
+/// A file mapped into memory, for reading the few matches of a `MatchOffsets` that
+/// are worth looking at: `slice` and `line` copy out only the bytes asked for, and
+/// the buffer protocol exposes the whole file without copying.
+#[pyclass(frozen)]
+pub struct MappedFile {
+    mmap: Option<Mmap>,
+    shape: [isize; 1],
+    strides: [isize; 1],
+}
+
+impl MappedFile {
+    fn data(&self) -> &[u8] {
+        self.mmap.as_deref().unwrap_or(&[])
+    }
+}
+
+#[pymethods]
+impl MappedFile {
+    #[new]
+    fn new(file_path: &str, py: Python<'_>) -> PyResult<Self> {
+        let mmap = py.detach(|| map_plain(file_path, "Compressed files have no byte offsets to read at"))?;
+        let len = mmap.as_deref().map_or(0, |m| m.len());
+        Ok(MappedFile { mmap, shape: [len as isize], strides: [1] })
+    }
+
+    fn __len__(&self) -> usize {
+        self.data().len()
+    }
+
+    /// Bytes `start` to `end` of the file.
+    fn slice<'py>(&self, start: usize, end: usize, py: Python<'py>) -> PyResult<Bound<'py, PyBytes>> {
+        let data = self.data();
+        if start > end || end > data.len() {
+            return Err(PyIndexError::new_err(format!("{}..{} is outside the file's {} bytes", start, end, data.len())));
+        }
+        Ok(PyBytes::new(py, &data[start..end]))
+    }
+
+    /// The line containing byte `offset`, without its newline.
+    fn line<'py>(&self, offset: usize, py: Python<'py>) -> PyResult<Bound<'py, PyBytes>> {
+        let data = self.data();
+        if offset >= data.len() {
+            return Err(PyIndexError::new_err(format!("{} is outside the file's {} bytes", offset, data.len())));
+        }
+        let start = memchr::memrchr(b'\n', &data[..offset]).map_or(0, |i| i + 1);
+        let end = memchr::memchr(b'\n', &data[offset..]).map_or(data.len(), |i| offset + i);
+        Ok(PyBytes::new(py, &data[start..end]))
+    }
+
+    unsafe fn __getbuffer__(slf: Bound<'_, Self>, view: *mut ffi::Py_buffer, flags: c_int) -> PyResult<()> {
+        let this = slf.get();
+        let data = this.data();
+        unsafe {
+            fill_buffer(view, flags, slf.clone().into_any(), data.as_ptr(), data.len(), 1, c"B",
+                        &this.shape, &this.strides)
+        }
+    }
+}
+
+/// Iterator over batches (`list[str]`) of records produced by a background scan.
+///
+/// The scan runs `STREAM_CHUNK_BYTES` at a time and blocks once `STREAM_QUEUE_DEPTH`
+/// batches are waiting, so memory stays bounded however large the input is. Batches
+/// always arrive in input order, also when the chunks are scanned in parallel.
+#[pyclass]
+pub struct RecordStream {
+    rx: Mutex<Receiver<PyResult<Vec<String>>>>,
+}
+
+impl RecordStream {
+    fn spawn(
+        engine: Arc<Engine>,
+        paths: Vec<String>,
+        parallel: bool,
+        batch_size: usize,
+        labels: Option<Vec<String>>,
+    ) -> Self {
+        let (tx, rx) = sync_channel(STREAM_QUEUE_DEPTH);
+        std::thread::spawn(move || {
+            let mut out = BatchSender::new(tx, batch_size);
+            let scanned = scan_paths(
+                &paths,
+                engine.chunk_bytes(),
+                parallel,
+                engine.trigrams().as_ref(),
+                |file, _, chunk| engine.scan_prefixed(chunk, labels.as_ref().map(|labels| labels[file].as_str())),
+                |part| part.into_iter().all(|record| out.push(record)) && out.flush(),
+            );
+            if let Err(e) = scanned {
+                out.fail(e);
+            }
+        });
+        RecordStream { rx: Mutex::new(rx) }
+    }
+
+    /// A stream of the distinct records of `paths`, each at its first occurrence.
+    /// Chunks drop their own repeats across the rayon pool; the records they keep
+    /// are checked against those already sent, in input order, so only a set of
+    /// the distinct records is held.
+    fn distinct(
+        engine: Arc<Engine>,
+        paths: Vec<String>,
+        parallel: bool,
+        batch_size: usize,
+        labels: Option<Vec<String>>,
+    ) -> Self {
+        let (tx, rx) = sync_channel(STREAM_QUEUE_DEPTH);
+        std::thread::spawn(move || {
+            let mut out = BatchSender::new(tx, batch_size);
+            let mut seen = HashSet::new();
+            let scanned = scan_paths(
+                &paths,
+                engine.chunk_bytes(),
+                parallel,
+                engine.trigrams().as_ref(),
+                |file, _, data| engine.distinct_range(data, labels.as_ref().map(|labels| labels[file].as_str())),
+                |part| {
+                    for record in part {
+                        if !seen.contains(&record) {
+                            seen.insert(record.clone());
+                            if !out.push(record) {
+                                return false;
+                            }
+                        }
+                    }
+                    out.flush()
+                },
+            );
+            if let Err(e) = scanned {
+                out.fail(e);
+            }
+        });
+        RecordStream { rx: Mutex::new(rx) }
+    }
+
+    /// A stream of the records of `paths` in `sort`'s order. Nothing arrives until
+    /// the scan is over; what doesn't fit `sort`'s budget waits in runs on disk.
+    fn sorted(
+        engine: Arc<Engine>,
+        paths: Vec<String>,
+        parallel: bool,
+        batch_size: usize,
+        labels: Option<Vec<String>>,
+        mut sort: ExternalSort,
+    ) -> Self {
+        let (tx, rx) = sync_channel(STREAM_QUEUE_DEPTH);
+        std::thread::spawn(move || {
+            let mut out = BatchSender::new(tx, batch_size);
+            let mut failed = None;
+            let scanned = scan_paths(
+                &paths,
+                engine.chunk_bytes(),
+                parallel,
+                engine.trigrams().as_ref(),
+                |file, _, chunk| engine.scan_prefixed(chunk, labels.as_ref().map(|labels| labels[file].as_str())),
+                |part| match part.into_iter().try_for_each(|record| sort.push(record)) {
+                    Ok(()) => true,
+                    Err(e) => {
+                        failed = Some(e);
+                        false
+                    }
+                },
+            );
+            let sorted = scanned
+                .and_then(|()| failed.map_or(Ok(()), Err))
+                .and_then(|()| sort.finish(|record| out.push(record)));
+            match sorted {
+                Ok(()) => {
+                    out.flush();
+                }
+                Err(e) => out.fail(e),
+            }
+        });
+        RecordStream { rx: Mutex::new(rx) }
+    }
+}
+
+#[pymethods]
+impl RecordStream {
+    fn __iter__(slf: PyRef<'_, Self>) -> PyRef<'_, Self> {
+        slf
+    }
+
+    fn __next__(&self, py: Python<'_>) -> PyResult<Option<Vec<String>>> {
+        recv_next(&self.rx, py)
+    }
+}
+
+/// The next item from a background scan, waiting without the GIL but still
+/// answering Ctrl-C. `None` once the scan is over.
+fn recv_next<T: Send>(rx: &Mutex<Receiver<PyResult<T>>>, py: Python<'_>) -> PyResult<Option<T>> {
+    loop {
+        let next = py.detach(|| {
+            rx.lock()
+                .unwrap_or_else(|e| e.into_inner())
+                .recv_timeout(Duration::from_millis(100))
+        });
+        match next {
+            Ok(item) => return item.map(Some),
+            Err(RecvTimeoutError::Timeout) => py.check_signals()?,
+            Err(RecvTimeoutError::Disconnected) => return Ok(None),
+        }
+    }
+}
+
+/// Iterator over the `bytes` of an Arrow IPC stream from a background scan: the
+/// schema, the record batches of each scanned chunk with matches, in input order,
+/// then the end-of-stream marker. Bounded like a `RecordStream`.
+#[pyclass]
+pub struct ArrowStream {
+    rx: Mutex<Receiver<PyResult<Vec<u8>>>>,
+}
+
+impl ArrowStream {
+    fn spawn(engine: Arc<Engine>, paths: Vec<String>, parallel: bool, labels: Option<Vec<String>>,
+             batch_rows: usize) -> Self {
+        let (tx, rx) = sync_channel(STREAM_QUEUE_DEPTH);
+        std::thread::spawn(move || {
+            let Engine::Rows(spec) = &*engine else { return };
+            if tx.send(Ok(spec.ipc_schema(labels.is_some()))).is_err() {
+                return;
+            }
+            let mut failed = false;
+            let scanned = scan_paths(
+                &paths,
+                engine.chunk_bytes(),
+                parallel,
+                engine.trigrams().as_ref(),
+                |file, _, chunk| spec.ipc_batches(chunk, labels.as_ref().map(|labels| labels[file].as_str()), batch_rows),
+                |batches| match batches {
+                    Ok(batches) => batches.into_iter().all(|batch| tx.send(Ok(batch)).is_ok()),
+                    Err(err) => {
+                        failed = true;
+                        let _ = tx.send(Err(err));
+                        false
+                    }
+                },
+            );
+            if !failed {
+                let _ = tx.send(scanned.map(|()| IPC_EOS.to_vec()));
+            }
+        });
+        ArrowStream { rx: Mutex::new(rx) }
+    }
+}
+
+#[pymethods]
+impl ArrowStream {
+    fn __iter__(slf: PyRef<'_, Self>) -> PyRef<'_, Self> {
+        slf
+    }
+
+    fn __next__<'py>(&self, py: Python<'py>) -> PyResult<Option<Bound<'py, PyBytes>>> {
+        Ok(recv_next(&self.rx, py)?.map(|part| PyBytes::new(py, &part)))
+    }
+}
+
+/// A compiled -rp, -F or -s/-e search that can be run against files repeatedly.
+/// Every `file_path` may also be a list of paths, searched in order as one input.
+#[pyclass]
+pub struct Query {
+    engine: Arc<Engine>,
+}
+
+#[pymethods]
+impl Query {
+    /// Lines matching `pattern`, or its capture `groups` joined by spaces.
+    #[staticmethod]
+    #[pyo3(signature = (pattern, groups = None))]
+    fn regex(pattern: &str, groups: Option<Vec<usize>>, py: Python<'_>) -> PyResult<Self> {
+        let engine = py.detach(|| Engine::joined(pattern, groups))?;
+        Ok(Query { engine: Arc::new(engine) })
+    }
+
+    /// Lines containing the literal `pattern`.
+    #[staticmethod]
+    #[pyo3(signature = (pattern, case_insensitive = false))]
+    fn fixed(pattern: &str, case_insensitive: bool) -> Self {
+        Query { engine: Arc::new(Engine::fixed(pattern, case_insensitive)) }
+    }
+
+    /// Start/end delimited spans, with the same arguments as `extract_fixed_spans`.
+    #[staticmethod]
+    #[pyo3(signature = (
+        start_delim,
+        start_index      = 1,
+        end_delim        = None,
+        end_index        = 1,
+        omit_first       = None,
+        omit_last        = None,
+        print_line_on_match = false,
+        case_insensitive = false
+    ))]
+    #[allow(clippy::too_many_arguments)]
+    fn spans(
+        start_delim: &str,
+        start_index: usize,
+        end_delim: Option<&str>,
+        end_index: usize,
+        omit_first: Option<usize>,
+        omit_last: Option<usize>,
+        print_line_on_match: bool,
+        case_insensitive: bool,
+    ) -> Self {
+        let engine = Engine::spans(
+            start_delim, start_index, end_delim, end_index,
+            omit_first, omit_last, print_line_on_match, case_insensitive,
+        );
+        Query { engine: Arc::new(engine) }
+    }
+
+    /// The `-g` search: capture `groups` of `pattern` joined by spaces, matched
+    /// across the whole file. An empty `groups` means the full match.
+    #[staticmethod]
+    #[pyo3(signature = (pattern, groups = None))]
+    fn captures(pattern: &str, groups: Option<Vec<usize>>, py: Python<'_>) -> PyResult<Self> {
+        let regex = py.detach(|| RustRegexBytes::new(pattern))
+            .map_err(|e| PyValueError::new_err(format!("Regex compile error: {}", e)))?;
+        let groups = groups.filter(|g| !g.is_empty()).unwrap_or_else(|| vec![0]);
+        Ok(Query { engine: Arc::new(Engine::Captures { regex, groups }) })
+    }
+
+    /// The `--format` search: every match of `pattern` as a row of its capture
+    /// `groups` (all of them by default, the whole match if it has none), named
+    /// after the group or numbered, with `full` for the whole match. Records are
+    /// JSON objects, with the file as `path` first when `with_filename`; `arrow`
+    /// returns the rows as Arrow IPC instead. Matched within lines like `regex`,
+    /// or across the whole file like `captures` when `whole_file`.
+    #[staticmethod]
+    #[pyo3(signature = (pattern, groups = None, whole_file = false))]
+    fn rows(pattern: &str, groups: Option<Vec<usize>>, whole_file: bool, py: Python<'_>) -> PyResult<Self> {
+        let spec = py.detach(|| RowSpec::new(pattern, groups, whole_file))?;
+        Ok(Query { engine: Arc::new(Engine::Rows(spec)) })
+    }
+
+    /// Column names of a `rows` query in order, without `path`; `None` for others.
+    #[getter]
+    fn columns(&self) -> Option<Vec<String>> {
+        match &*self.engine {
+            Engine::Rows(spec) => Some(spec.names.clone()),
+            _ => None,
+        }
+    }
+
+    /// Several literals searched in one pass. Records are the matching lines,
+    /// prefixed with the 1-based numbers of the patterns each line matched.
+    #[staticmethod]
+    #[pyo3(signature = (patterns, case_insensitive = false))]
+    fn literals(patterns: Vec<String>, case_insensitive: bool, py: Python<'_>) -> PyResult<Self> {
+        let set = py.detach(|| PatternSet::literals(&patterns, case_insensitive))?;
+        Ok(Query { engine: Arc::new(Engine::Multi(set)) })
+    }
+
+    /// Several regexes searched in one pass, with records like `literals`.
+    #[staticmethod]
+    fn regex_set(patterns: Vec<String>, py: Python<'_>) -> PyResult<Self> {
+        let set = py.detach(|| PatternSet::regexes(&patterns))?;
+        Ok(Query { engine: Arc::new(Engine::Multi(set)) })
+    }
+
+    /// For a `literals` or `regex_set` query, how many lines each pattern matched
+    /// across `file_path`, in pattern order.
+    #[pyo3(signature = (file_path, parallel = false))]
+    fn pattern_totals(&self, file_path: Paths, parallel: bool, py: Python<'_>) -> PyResult<Vec<usize>> {
+        let Engine::Multi(set) = &*self.engine else {
+            return Err(PyValueError::new_err("pattern_totals needs a Query.literals or Query.regex_set query"));
+        };
+        let paths = file_path.into_vec();
+        py.detach(|| {
+            let mut totals = vec![0; set.len()];
+            scan_paths(
+                &paths,
+                STREAM_CHUNK_BYTES,
+                parallel,
+                set.trigrams().as_ref(),
+                |_, _, chunk| set.line_totals(chunk),
+                |part| {
+                    for (total, n) in totals.iter_mut().zip(part) {
+                        *total += n;
+                    }
+                    true
+                },
+            )?;
+            Ok(totals)
+        })
+    }
+
+    /// (record, count) pairs for `file_path` in first-seen order, counted across all
+    /// files. Counting happens in Rust, so only the distinct records are converted
+    /// to Python objects.
+    ///
+    /// With `top_k`, only the `top_k` most frequent records are returned (least
+    /// frequent unless `descending`), already sorted by count.
+    #[pyo3(signature = (file_path, parallel = false, top_k = None, descending = true))]
+    fn count<'py>(
+        &self,
+        file_path: Paths,
+        parallel: bool,
+        top_k: Option<usize>,
+        descending: bool,
+        py: Python<'py>,
+    ) -> PyResult<Bound<'py, PyList>> {
+        let paths = file_path.into_vec();
+        let rows = py.detach(|| match top_k {
+            Some(k) => {
+                let table = self.engine.count_table_paths(&paths, parallel)?;
+                Ok(select_top_k(table, k, descending, parallel))
+            }
+            None => self.engine.count(&paths, parallel),
+        })?;
+        to_py_list(py, rows)
+    }
+
+    /// `--agg`: numeric aggregates of capture group `value` for each distinct key,
+    /// the `by` groups joined by spaces (one "" key without `by`), for `regex`,
+    /// `captures` and `rows` queries. Rows are (key, count, sum, min, max, mean,
+    /// [percentiles]) in first-seen order, with `percentiles` (0 to 100) read from a
+    /// sketch to within 1%. Matches whose `value` isn't a number are skipped, and
+    /// groups are given by number or name. Each chunk is summarised on its own and
+    /// the tables merged, so only the aggregate table reaches Python.
+    #[pyo3(signature = (file_path, value, by = Vec::new(), percentiles = vec![50.0, 90.0, 99.0], parallel = false))]
+    fn aggregate(
+        &self,
+        file_path: Paths,
+        value: GroupRef,
+        by: Vec<GroupRef>,
+        percentiles: Vec<f64>,
+        parallel: bool,
+        py: Python<'_>,
+    ) -> PyResult<Vec<AggregateRow>> {
+        let Some((regex, _, _)) = self.engine.capture_regex() else {
+            return Err(PyValueError::new_err("aggregate needs a Query.regex, Query.captures or Query.rows query"));
+        };
+        let value = value.resolve(regex)?;
+        let by = by.iter().map(|group| group.resolve(regex)).collect::<PyResult<Vec<_>>>()?;
+        if let Some(p) = percentiles.iter().find(|p| !(0.0..=100.0).contains(*p)) {
+            return Err(PyValueError::new_err(format!("Percentile {} is not between 0 and 100", p)));
+        }
+        let paths = file_path.into_vec();
+        py.detach(|| {
+            let rows = self.engine.summarize_paths(&paths, parallel, value, &by)?;
+            Ok(rows.into_iter()
+                .map(|(key, summary)| {
+                    let ranks = percentiles.iter().map(|&p| summary.percentile(p)).collect();
+                    let mean = summary.sum / summary.count as f64;
+                    (key, summary.count, summary.sum, summary.min, summary.max, mean, ranks)
+                })
+                .collect())
+        })
+    }
+
+    /// `--histogram`: match counts per `bucket_seconds` of the timestamp in capture
+    /// group `time`, read as `time_format` ("syslog", which assumes `year`, or
+    /// without one the twelve months up to now, "iso" or "epoch"), for `regex`,
+    /// `captures` and `rows` queries.
+    /// With `by` there is one series per distinct key of those groups joined by
+    /// spaces, in first-seen order; without, one "" series. Returns the start of the
+    /// first bucket in seconds since 1970 and each series' counts for every bucket
+    /// from the earliest time to the latest, zeros included. Matches whose time
+    /// doesn't parse are skipped. Chunks are counted on their own and merged, so
+    /// only the bucket counts reach Python.
+    #[pyo3(signature = (file_path, time, time_format = "syslog", bucket_seconds = 60, by = Vec::new(), year = None, parallel = false))]
+    fn histogram(
+        &self,
+        file_path: Paths,
+        time: GroupRef,
+        time_format: &str,
+        bucket_seconds: i64,
+        by: Vec<GroupRef>,
+        year: Option<i64>,
+        parallel: bool,
+        py: Python<'_>,
+    ) -> PyResult<(i64, Vec<(String, Vec<u64>)>)> {
+        let Some((regex, _, _)) = self.engine.capture_regex() else {
+            return Err(PyValueError::new_err("histogram needs a Query.regex, Query.captures or Query.rows query"));
+        };
+        let time = time.resolve(regex)?;
+        let by = by.iter().map(|group| group.resolve(regex)).collect::<PyResult<Vec<_>>>()?;
+        let format = TimeFormat::new(time_format, year)?;
+        if bucket_seconds < 1 {
+            return Err(PyValueError::new_err("bucket_seconds must be at least 1"));
+        }
+        let paths = file_path.into_vec();
+        py.detach(|| {
+            let series = self.engine.histogram_paths(&paths, parallel, time, &by, format, bucket_seconds)?;
+            let buckets = series.iter().flat_map(|(_, counts)| counts.keys().copied());
+            let (Some(first), Some(last)) = (buckets.clone().min(), buckets.max()) else { return Ok((0, Vec::new())) };
+            let span = last - first + 1;
+            if span > MAX_HISTOGRAM_BUCKETS {
+                return Err(PyValueError::new_err(format!(
+                    "The timestamps span {} buckets, more than {}: use a larger bucket",
+                    span, MAX_HISTOGRAM_BUCKETS
+                )));
+            }
+            let dense = series
+                .into_iter()
+                .map(|(key, counts)| {
+                    let mut row = vec![0; span as usize];
+                    for (bucket, n) in counts {
+                        row[(bucket - first) as usize] = n;
+                    }
+                    (key, row)
+                })
+                .collect();
+            Ok((first * bucket_seconds, dense))
+        })
+    }
+
+    /// `count` for the complete lines of one file from byte `start` on, plus the
+    /// offset to pass as `start` next time, so a growing log can be counted a piece
+    /// at a time. `start` must be 0 or an offset returned for the same file.
+    #[pyo3(signature = (file_path, start = 0, parallel = false))]
+    fn count_appended(
+        &self,
+        file_path: &str,
+        start: usize,
+        parallel: bool,
+        py: Python<'_>,
+    ) -> PyResult<(Vec<(String, usize)>, usize)> {
+        py.detach(|| {
+            let (mmap, end) = appended_lines(file_path, start)?;
+            let data: &[u8] = mmap.as_deref().unwrap_or(&[]);
+            Ok((first_seen(self.engine.count_table(&data[start..end], parallel)), end))
+        })
+    }
+
+    /// Every record in `file_path` as one list, prefixed with `path:` when
+    /// `with_filename`, or with the file's name when it is a list of names.
+    #[pyo3(signature = (file_path, parallel = false, with_filename = FileNames::Shown(false)))]
+    fn collect<'py>(
+        &self,
+        file_path: Paths,
+        parallel: bool,
+        with_filename: FileNames,
+        py: Python<'py>,
+    ) -> PyResult<Bound<'py, PyList>> {
+        let paths = file_path.into_vec();
+        let labels = with_filename.labels(&paths)?;
+        let records = py.detach(|| self.engine.collect_paths(&paths, parallel, labels.as_deref()))?;
+        to_py_list(py, records)
+    }
+
+    /// Byte offsets of every match in the uncompressed file `file_path`, as a
+    /// `MatchOffsets` table rather than a string per match. Not available for
+    /// `spans`, `literals` and `regex_set` queries, whose records aren't matches.
+    #[pyo3(signature = (file_path, parallel = false))]
+    fn offsets(&self, file_path: &str, parallel: bool, py: Python<'_>) -> PyResult<MatchOffsets> {
+        let Some(groups) = self.engine.offset_groups() else {
+            return Err(PyValueError::new_err("offsets needs a Query.regex, Query.fixed or Query.captures query"));
+        };
+        py.detach(|| {
+            let mmap = map_plain(file_path, "Compressed files have no byte offsets to report")?;
+            let table = self.engine.offsets_table(mmap.as_deref().unwrap_or(&[]), &groups, parallel);
+            Ok(MatchOffsets::new(table, std::iter::once(0).chain(groups).collect()))
+        })
+    }
+
+    /// The rows of a `rows` query in `file_path` as an `ArrowStream`, with a `path`
+    /// column first when `with_filename`. Written out in order, its parts make an
+    /// Arrow IPC stream for `pyarrow.ipc.open_stream` or DuckDB. Record batches hold
+    /// at most `batch_size` rows.
+    #[pyo3(signature = (file_path, parallel = false, with_filename = FileNames::Shown(false),
+                        batch_size = ARROW_BATCH_ROWS))]
+    fn arrow(&self, file_path: Paths, parallel: bool, with_filename: FileNames, batch_size: usize) -> PyResult<ArrowStream> {
+        if !matches!(*self.engine, Engine::Rows(_)) {
+            return Err(PyValueError::new_err("arrow needs a Query.rows query"));
+        }
+        let paths = file_path.into_vec();
+        let labels = with_filename.labels(&paths)?;
+        Ok(ArrowStream::spawn(Arc::clone(&self.engine), paths, parallel, labels, batch_size.max(1)))
+    }
+
+    /// Records in `file_path` as a `RecordStream` of `batch_size` batches, prefixed
+    /// with `path:` when `with_filename`. Files are opened as the scan reaches them,
+    /// so a missing file is raised by the stream.
+    #[pyo3(signature = (file_path, parallel = false, batch_size = 4096, with_filename = FileNames::Shown(false)))]
+    fn stream(
+        &self,
+        file_path: Paths,
+        parallel: bool,
+        batch_size: usize,
+        with_filename: FileNames,
+    ) -> PyResult<RecordStream> {
+        let paths = file_path.into_vec();
+        let labels = with_filename.labels(&paths)?;
+        Ok(RecordStream::spawn(Arc::clone(&self.engine), paths, parallel, batch_size, labels))
+    }
+
+    /// `-u -t --approx`: about how many distinct records `file_path` holds, from a
+    /// HyperLogLog sketch with a relative standard error of `error`. Each chunk
+    /// builds its own sketch, of a fixed size however many records there are.
+    #[pyo3(signature = (file_path, error = 0.01, parallel = false))]
+    fn approx_distinct(&self, file_path: Paths, error: f64, parallel: bool, py: Python<'_>) -> PyResult<u64> {
+        check_sketch_error(error)?;
+        let paths = file_path.into_vec();
+        py.detach(|| Ok(self.engine.approx_distinct_paths(&paths, parallel, error)?.estimate().round() as u64))
+    }
+
+    /// `-c --approx`: the records in `file_path` counted at more than `error` of
+    /// all records, highest first, in fixed memory. A Space-Saving summary keeps
+    /// `1 / error` candidates, so any record making up more than `error` of all
+    /// records is among them, and a Count-Min sketch bounds the counts: none is
+    /// below the true count, and with 99% confidence none is above it by more than
+    /// `error` times the number of records.
+    #[pyo3(signature = (file_path, error = 0.01, parallel = false))]
+    fn heavy_hitters(&self, file_path: Paths, error: f64, parallel: bool, py: Python<'_>) -> PyResult<Vec<(String, u64)>> {
+        check_sketch_error(error)?;
+        let paths = file_path.into_vec();
+        py.detach(|| Ok(self.engine.heavy_hitters_paths(&paths, parallel, error)?.top()))
+    }
+
+    /// The distinct records in `file_path`, each once at its first occurrence in
+    /// input order, as a `RecordStream` of `batch_size` batches, prefixed with
+    /// `path:` when `with_filename`. Repeats are dropped in Rust as the scan goes,
+    /// so memory follows the distinct records rather than the matches.
+    #[pyo3(signature = (file_path, parallel = false, batch_size = 4096, with_filename = FileNames::Shown(false)))]
+    fn unique(
+        &self,
+        file_path: Paths,
+        parallel: bool,
+        batch_size: usize,
+        with_filename: FileNames,
+    ) -> PyResult<RecordStream> {
+        let paths = file_path.into_vec();
+        let labels = with_filename.labels(&paths)?;
+        Ok(RecordStream::distinct(Arc::clone(&self.engine), paths, parallel, batch_size, labels))
+    }
+
+    /// Records in `file_path` sorted by `key` ("auto", "lexical", "numeric", "ip"
+    /// or "natural"; see `sort_records`), as a `RecordStream` of `batch_size`
+    /// batches, each distinct record once when `unique`. Records are held in memory
+    /// up to `memory_limit` bytes (256 MiB by default); beyond that they are sorted into runs in
+    /// `temp_dir` (the system's temporary directory by default) and merged as the stream is read.
+    #[pyo3(signature = (
+        file_path,
+        key = "auto",
+        descending = false,
+        unique = false,
+        parallel = false,
+        with_filename = FileNames::Shown(false),
+        memory_limit = None,
+        batch_size = 4096,
+        temp_dir = None
+    ))]
+    fn sorted(
+        &self,
+        file_path: Paths,
+        key: &str,
+        descending: bool,
+        unique: bool,
+        parallel: bool,
+        with_filename: FileNames,
+        memory_limit: Option<usize>,
+        batch_size: usize,
+        temp_dir: Option<PathBuf>,
+    ) -> PyResult<RecordStream> {
+        let mut sort = ExternalSort::new(SortMode::new(key)?, descending, unique, parallel, memory_limit.unwrap_or(SORT_MEMORY_BYTES).max(1));
+        if let Some(dir) = temp_dir {
+            sort.temp_dir = dir;
+        }
+        let paths = file_path.into_vec();
+        let labels = with_filename.labels(&paths)?;
+        Ok(RecordStream::sorted(Arc::clone(&self.engine), paths, parallel, batch_size, labels, sort))
+    }
+}
+
+#[pyfunction]
+fn find_joined_matches_in_file_by_line_parallel(
+    pattern: &str,
+    file_path: &str,
+    groups: Option<Vec<usize>>,
+    py: Python<'_>,
+) -> PyResult<Vec<String>> {
+    py.detach(|| {
+        let source = Source::open(file_path)?;
+        let engine = Engine::joined(pattern, groups)?;
+        engine.collect_from(&source, true)
+    })
+}
+
+#[pyfunction]
+#[pyo3(signature = (
+    file_path,
+    start_delim,
+    start_index      = 1,
+    end_delim        = None,
+    end_index        = 1,
+    omit_first       = None,
+    omit_last        = None,
+    print_line_on_match = false,
+    case_insensitive = false
+))]
+fn extract_fixed_spans(
+    file_path: &str,
+    start_delim: &str,
+    start_index: usize,
+    end_delim: Option<&str>,
+    end_index: usize,
+    omit_first: Option<usize>,
+    omit_last: Option<usize>,
+    print_line_on_match: bool,
+    case_insensitive: bool,
+    py: Python<'_>,
+) -> PyResult<Vec<String>> {
+    py.detach(|| {
+        let source = Source::open(file_path)?;
+        let engine = Engine::spans(
+            start_delim, start_index, end_delim, end_index,
+            omit_first, omit_last, print_line_on_match, case_insensitive,
+        );
+        engine.collect_from(&source, false)
+    })
+}
+
+#[pyfunction]
+#[pyo3(signature = (
+    file_path,
+    start_delim,
+    start_index      = 1,
+    end_delim        = None,
+    end_index        = 1,
     omit_first       = None,
     omit_last        = None,
     print_line_on_match = false,
@@ -641,78 +4515,29 @@ fn extract_fixed_spans_parallel(
     omit_last: Option<usize>,
     print_line_on_match: bool,
     case_insensitive: bool,
+    py: Python<'_>,
 ) -> PyResult<Vec<String>> {
-    let file = File::open(file_path)
-        .map_err(|e| PyIOError::new_err(e.to_string()))?;
-    let mmap = unsafe {
-        Mmap::map(&file)
-            .map_err(|e| PyIOError::new_err(e.to_string()))?
-    };
-    let data = &mmap[..];
-    let s_key = if case_insensitive {
-        start_delim.to_ascii_lowercase()
-    } else {
-        start_delim.to_string()
-    };
-    let e_key = end_delim.map(|ed| {
-        if case_insensitive { ed.to_ascii_lowercase() } else { ed.to_string() }
-    });
-    let omit_f = omit_first.unwrap_or(0);
-    let omit_l = omit_last.unwrap_or(0);
-    let threads = rayon::current_num_threads();
-    let ranges = compute_ranges(data, threads, 1);
-    let results: Vec<String> = ranges
-        .into_par_iter()
-        .flat_map(|(start, end)| {
-            let slice = &data[start..end];
-            slice
-                .split(|&b| b == b'\n')
-                .filter_map(|chunk| {
-                    let line = std::str::from_utf8(chunk).unwrap_or("");
-                    let hay = if case_insensitive {
-                        line.to_ascii_lowercase()
-                    } else {
-                        line.to_string()
-                    };
-                    nth_index(&hay, &s_key, start_index).and_then(|s_pos| {
-                        if let Some(ref ed) = e_key {
-                            nth_index(&hay, ed, end_index).and_then(|e_start| {
-                                let e_pos = e_start + ed.len();
-                                if e_pos > s_pos {
-                                    let mut matched = &line[s_pos..e_pos];
-                                    if omit_f < matched.len() {
-                                        matched = &matched[omit_f..];
-                                    }
-                                    if omit_l < matched.len() {
-                                        matched = &matched[..matched.len() - omit_l];
-                                    }
-                                    Some(matched.to_string())
-                                } else {
-                                    None
-                                }
-                            })
-                        } else if print_line_on_match {
-                            Some(line.to_string())
-                        } else {
-                            None
-                        }
-                    })
-                })
-                .collect::<Vec<_>>()
-        })
-        .collect();
-    Ok(results)
+    py.detach(|| {
+        let source = Source::open(file_path)?;
+        let engine = Engine::spans(
+            start_delim, start_index, end_delim, end_index,
+            omit_first, omit_last, print_line_on_match, case_insensitive,
+        );
+        engine.collect_from(&source, true)
+    })
 }
 
 #[pyfunction]
-fn count_string_occurrences(items: Vec<String>) -> PyResult<Vec<(String, usize)>> {
-    let mut map = HashMap::new();
-    for s in items {
-        *map.entry(s).or_insert(0) += 1;
-    }
-    let mut sorted: Vec<_> = map.into_iter().collect();
-    sorted.sort_unstable_by(|a, b| b.1.cmp(&a.1));
-    Ok(sorted)
+fn count_string_occurrences(items: Vec<String>, py: Python<'_>) -> PyResult<Vec<(String, usize)>> {
+    Ok(py.detach(|| {
+        let mut map = HashMap::new();
+        for s in items {
+            *map.entry(s).or_insert(0) += 1;
+        }
+        let mut sorted: Vec<_> = map.into_iter().collect();
+        sorted.sort_unstable_by(|a, b| b.1.cmp(&a.1));
+        sorted
+    }))
 }
 
 #[pyfunction]
@@ -725,30 +4550,13 @@ fn extract_fixed_lines(
     file_path: &str,
     pattern: &str,
     case_insensitive: bool,
+    py: Python<'_>,
 ) -> PyResult<Vec<String>> {
-    let file = File::open(file_path)
-        .map_err(|e| PyIOError::new_err(e.to_string()))?;
-    let mmap = unsafe { Mmap::map(&file).map_err(|e| PyIOError::new_err(e.to_string()))? };
-    let pat_bytes = if case_insensitive {
-        pattern.to_ascii_lowercase().into_bytes()
-    } else {
-        pattern.as_bytes().to_vec()
-    };
-    let finder = Finder::new(&pat_bytes);
-    let mut out = Vec::new();
-    for chunk in mmap.split(|&b| b == b'\n') {
-        if case_insensitive {
-            let hay = String::from_utf8_lossy(chunk).to_ascii_lowercase();
-            if finder.find(hay.as_bytes()).is_some() {
-                out.push(String::from_utf8_lossy(chunk).into_owned());
-            }
-        } else {
-            if finder.find(chunk).is_some() {
-                out.push(std::str::from_utf8(chunk).unwrap_or("").to_string());
-            }
-        }
-    }
-    Ok(out)
+    py.detach(|| {
+        let source = Source::open(file_path)?;
+        let engine = Engine::fixed(pattern, case_insensitive);
+        engine.collect_from(&source, false)
+    })
 }
 
 #[pyfunction]
@@ -761,138 +4569,182 @@ fn extract_fixed_lines_parallel(
     file_path: &str,
     pattern: &str,
     case_insensitive: bool,
+    py: Python<'_>,
 ) -> PyResult<Vec<String>> {
-    let file = File::open(file_path)
-        .map_err(|e| PyIOError::new_err(format!("Failed to open file: {}", e)))?;
-    let mmap = unsafe {
-        Mmap::map(&file)
-            .map_err(|e| PyIOError::new_err(format!("Failed to mmap file: {}", e)))?
-    };
-    let data: &[u8] = &mmap;
-    let pat_bytes = if case_insensitive {
-        pattern.to_ascii_lowercase().into_bytes()
-    } else {
-        pattern.as_bytes().to_vec()
-    };
-    let finder = Finder::new(&pat_bytes);
-    let n_threads = rayon::current_num_threads();
-    let ranges = compute_ranges(data, n_threads, 4);
-    let results: Vec<String> = ranges.par_iter()
-        .flat_map(|&(start, end)| {
-            let slice = &data[start..end];
-            slice.split(|&b| b == b'\n')
-                 .filter_map(|line| {
-                     if line.is_empty() {
-                         return None;
-                     }
-                     let hay = if case_insensitive {
-                         String::from_utf8_lossy(line)
-                             .to_ascii_lowercase()
-                             .into_bytes()
-                     } else {
-                         line.to_vec()
-                     };
-                     if finder.find(&hay).is_some() {
-                         Some(String::from_utf8_lossy(line).into_owned())
-                     } else {
-                         None
-                     }
-                 })
-                 .collect::<Vec<String>>()
-        })
-        .collect();
-    Ok(results)
+    py.detach(|| {
+        let source = Source::open(file_path)?;
+        let engine = Engine::fixed(pattern, case_insensitive);
+        engine.collect_from(&source, true)
+    })
 }
 
 #[pyfunction]
 fn total_count(
     pattern: &str,
-    file_path: &str,
+    file_path: Paths,
     parallel: bool,
+    py: Python<'_>,
 ) -> PyResult<Vec<String>> {
-    let file = File::open(file_path)
-        .map_err(|e| PyIOError::new_err(format!("open error: {}", e)))?;
-    let mmap = unsafe {
-        Mmap::map(&file)
-            .map_err(|e| PyIOError::new_err(format!("mmap error: {}", e)))?
-    };
-    let data: &[u8] = &mmap;
-    let regex = RustRegex::new(pattern)
-        .map_err(|e| PyValueError::new_err(format!("regex error: {}", e)))?;
-    let n_threads = rayon::current_num_threads();
-    let ranges = compute_ranges(data, n_threads, 4);
-    let total: usize = if parallel {
-        ranges.par_iter()
-            .map(|&(s, e)| {
-                let slice = &data[s..e];
-                let text = std::str::from_utf8(slice).unwrap_or("");
+    let paths = file_path.into_vec();
+    py.detach(|| {
+        let regex = RustRegex::new(pattern)
+            .map_err(|e| PyValueError::new_err(format!("regex error: {}", e)))?;
+        let mut total = 0usize;
+        scan_paths(
+            &paths,
+            STREAM_CHUNK_BYTES,
+            parallel,
+            regex_trigrams(pattern).as_ref(),
+            |_, _, chunk| {
+                let text = std::str::from_utf8(chunk).unwrap_or("");
                 regex.find_iter(text).count()
-            })
-            .sum()
-    } else {
-        ranges.iter()
-            .map(|&(s, e)| {
-                let slice = &data[s..e];
-                let text = std::str::from_utf8(slice).unwrap_or("");
-                regex.find_iter(text).count()
-            })
-            .sum()
-    };
-    Ok(vec![ total.to_string() ])
+            },
+            |n| {
+                total += n;
+                true
+            },
+        )?;
+        Ok(vec![ total.to_string() ])
+    })
 }
 
 #[pyfunction]
 fn total_count_fixed_str(
     pattern: &str,
-    file_path: &str,
+    file_path: Paths,
     parallel: bool,
     case_insensitive: bool,
+    py: Python<'_>,
 ) -> PyResult<Vec<String>> {
-    let file = File::open(file_path)
-        .map_err(|e| PyIOError::new_err(format!("Failed to open file: {}", e)))?;
-    let mmap = unsafe {
-        Mmap::map(&file)
-            .map_err(|e| PyIOError::new_err(format!("Failed to mmap file: {}", e)))?
-    };
-    let data: &[u8] = &mmap;
-    let pat_bytes = if case_insensitive {
-        pattern.to_ascii_lowercase().into_bytes()
-    } else {
-        pattern.as_bytes().to_vec()
-    };
-    let finder = Finder::new(&pat_bytes);
-    let n_threads = rayon::current_num_threads();
-    let ranges = compute_ranges(data, n_threads, 4);
-    let total: usize = if parallel {
-        ranges.par_iter()
-            .map(|&(s, e)| {
-                let slice = &data[s..e];
-                if case_insensitive {
-                    let lower = slice.iter()
-                        .map(|&b| (b as char).to_ascii_lowercase() as u8)
-                        .collect::<Vec<u8>>();
-                    finder.find_iter(&lower).count()
-                } else {
-                    finder.find_iter(slice).count()
-                }
-            })
-            .sum()
-    } else {
-        ranges.iter()
-            .map(|&(s, e)| {
-                let slice = &data[s..e];
-                if case_insensitive {
-                    let lower = slice.iter()
-                        .map(|&b| (b as char).to_ascii_lowercase() as u8)
-                        .collect::<Vec<u8>>();
-                    finder.find_iter(&lower).count()
-                } else {
-                    finder.find_iter(slice).count()
-                }
-            })
-            .sum()
-    };
-    Ok(vec![ total.to_string() ])
+    let paths = file_path.into_vec();
+    py.detach(|| {
+        let literal = Literal::new(pattern, case_insensitive);
+        let mut total = 0usize;
+        scan_paths(
+            &paths,
+            STREAM_CHUNK_BYTES,
+            parallel,
+            trigram_alternatives([literal.needle()]).as_ref(),
+            |_, _, chunk| literal.count(chunk),
+            |n| {
+                total += n;
+                true
+            },
+        )?;
+        Ok(vec![ total.to_string() ])
+    })
+}
+
+/// `total_count` (or with `fixed_string`, `total_count_fixed_str`) for the complete
+/// lines of one file from byte `start` on, plus the offset to start from next time,
+/// as in `Query.count_appended`.
+#[pyfunction]
+#[pyo3(signature = (pattern, file_path, start = 0, parallel = false, fixed_string = false, case_insensitive = false))]
+fn total_count_appended(
+    pattern: &str,
+    file_path: &str,
+    start: usize,
+    parallel: bool,
+    fixed_string: bool,
+    case_insensitive: bool,
+    py: Python<'_>,
+) -> PyResult<(usize, usize)> {
+    py.detach(|| {
+        let count: Box<dyn Fn(&[u8]) -> usize + Sync> = if fixed_string {
+            let literal = Literal::new(pattern, case_insensitive);
+            Box::new(move |chunk| literal.count(chunk))
+        } else {
+            let regex = RustRegex::new(pattern)
+                .map_err(|e| PyValueError::new_err(format!("regex error: {}", e)))?;
+            Box::new(move |chunk| regex.find_iter(std::str::from_utf8(chunk).unwrap_or("")).count())
+        };
+        let (mmap, end) = appended_lines(file_path, start)?;
+        let data: &[u8] = mmap.as_deref().unwrap_or(&[]);
+        let ranges = split_ranges(&data[start..end], STREAM_CHUNK_BYTES);
+        let chunk = |&(s, e): &(usize, usize)| {
+            let chunk = &data[start + s..start + e];
+            timed(chunk, || count(chunk))
+        };
+        let total: usize = if parallel {
+            ranges.par_iter().map(chunk).sum()
+        } else {
+            ranges.iter().map(chunk).sum()
+        };
+        Ok((total, end))
+    })
+}
+
+/// Write the trigram index of `file_path` to `<file_path>.rygex-index` and return
+/// its number of blocks. Searches of the file use it until the file changes.
+#[pyfunction]
+#[pyo3(signature = (file_path, block_bytes = INDEX_BLOCK_BYTES))]
+fn build_index(file_path: &str, block_bytes: usize, py: Python<'_>) -> PyResult<usize> {
+    py.detach(|| build_trigram_index(file_path, block_bytes))
+}
+
+/// Sort `records` in memory, across the rayon pool when `parallel`. `key` is
+/// "lexical" (by code point), "numeric", "ip" (IPv4 then IPv6, by address),
+/// "natural" (digit runs as numbers) or "auto" (ip when the first record is an
+/// address, lexical otherwise). Each key is parsed once; records that aren't a
+/// number or address follow those that are, and ties go to the text. With
+/// `unique` each distinct record is kept once.
+#[pyfunction]
+#[pyo3(signature = (records, key = "auto", descending = false, unique = false, parallel = false))]
+fn sort_records<'py>(
+    records: Vec<String>,
+    key: &str,
+    descending: bool,
+    unique: bool,
+    parallel: bool,
+    py: Python<'py>,
+) -> PyResult<Bound<'py, PyList>> {
+    let mut sort = ExternalSort::new(SortMode::new(key)?, descending, unique, parallel, usize::MAX);
+    let sorted = py.detach(|| {
+        records.into_iter().try_for_each(|record| sort.push(record))?;
+        let mut sorted = Vec::new();
+        sort.finish(|record| {
+            sorted.push(record);
+            true
+        })?;
+        Ok::<_, PyErr>(sorted)
+    })?;
+    to_py_list(py, sorted)
+}
+
+/// Keep up to `size` file maps open between calls, reused while each file's size,
+/// mtime and inode are unchanged; 0 closes them all and maps afresh every call.
+/// For a resident process searching the same files over and over.
+#[pyfunction]
+fn set_map_cache(size: usize) {
+    MAP_CACHE_SIZE.store(size, Ordering::Relaxed);
+    MAP_CACHE.lock().unwrap_or_else(|e| e.into_inner()).clear();
+}
+
+/// Start (or with `enabled` false, stop) collecting scan stats, clearing any
+/// collected so far. Collecting costs a line count per chunk.
+#[pyfunction]
+#[pyo3(signature = (enabled = true))]
+fn set_stats(enabled: bool) {
+    with_stats(|stats| *stats = ScanStats::new());
+    STATS_ON.store(enabled, Ordering::Relaxed);
+}
+
+/// The scan stats collected since `set_stats` (or the last `take_stats`), which
+/// are then cleared. Chunks are `(worker, bytes, seconds)` tuples in the order
+/// they finished; `worker` is the rayon thread index, or `None` off the pool.
+#[pyfunction]
+fn take_stats(py: Python<'_>) -> PyResult<Bound<'_, PyDict>> {
+    let stats = std::mem::replace(&mut *STATS.lock().unwrap_or_else(|e| e.into_inner()), ScanStats::new());
+    let secs = |nanos: u64| nanos as f64 / 1e9;
+    let chunks: Vec<_> = stats.chunks.iter().map(|c| (c.worker, c.bytes, secs(c.nanos))).collect();
+    let dict = PyDict::new(py);
+    dict.set_item("maps", stats.maps)?;
+    dict.set_item("map_seconds", secs(stats.map_nanos))?;
+    dict.set_item("bytes", stats.bytes)?;
+    dict.set_item("lines", stats.lines)?;
+    dict.set_item("convert_seconds", secs(stats.convert_nanos))?;
+    dict.set_item("chunks", chunks)?;
+    Ok(dict)
 }
 
 #[pymodule]
@@ -901,7 +4753,18 @@ fn rygex_ext(m: &Bound<'_, PyModule>) -> PyResult<()> {
     m.add_class::<Match>()?;
     m.add_class::<RustRegexGen>()?;
     m.add_class::<FileRegexGen>()?;
+    m.add_class::<Query>()?;
+    m.add_class::<RecordStream>()?;
+    m.add_class::<ArrowStream>()?;
+    m.add_class::<MatchOffsets>()?;
+    m.add_class::<MappedFile>()?;
     m.add_function(wrap_pyfunction!(compile, m)?)?;
+    m.add_function(wrap_pyfunction!(build_index, m)?)?;
+    m.add_function(wrap_pyfunction!(total_count_appended, m)?)?;
+    m.add_function(wrap_pyfunction!(set_stats, m)?)?;
+    m.add_function(wrap_pyfunction!(set_map_cache, m)?)?;
+    m.add_function(wrap_pyfunction!(sort_records, m)?)?;
+    m.add_function(wrap_pyfunction!(take_stats, m)?)?;
     m.add_function(wrap_pyfunction!(search, m)?)?;
     m.add_function(wrap_pyfunction!(findall_captures_str, m)?)?;
     m.add_function(wrap_pyfunction!(findall_captures_list_parallel, m)?)?;
@@ -0,0 +1,69 @@
+import os, shutil, socket, subprocess, sys, time
+from pathlib import Path
+import pytest
+
+REPO = Path(__file__).resolve().parent.parent
+# small fixtures kept at the top of the repository
+FIXTURES = ('testfile', 'ufw.test')
+
+
+def python_env(**extra: str) -> dict[str, str]:
+    '''The environment for a child Python that imports the same rygex and rygex_ext as the tests.'''
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+    env.update(extra)
+    return env
+
+
+def run_cli(argv: list[str], cwd: Path, stdin: bytes | None = None, **env: str) -> subprocess.CompletedProcess:
+    '''`rygex argv` in a process of its own, never handed to a server.'''
+    return subprocess.run([sys.executable, '-m', 'rygex.client', *argv], cwd=cwd, input=stdin,
+                          capture_output=True, env=python_env(RYGEX_SOCKET='', **env), timeout=60)
+
+
+def run_local(argv: list[str], capsys) -> tuple[str, str, int]:
+    '''stdout, stderr and exit status of `rygex argv` run in this process.'''
+    from rygex.cli import main
+    try:
+        main(argv)
+        status = 0
+    except SystemExit as e:
+        status = e.code or 0
+    out, err = capsys.readouterr()
+    return out, err, status
+
+
+def start_server(path: Path, cwd: Path) -> subprocess.Popen:
+    '''`rygex --serve path`, once it accepts connections.'''
+    server = subprocess.Popen([sys.executable, '-m', 'rygex.client', '--serve', str(path)], cwd=cwd,
+                              env=python_env(), stdin=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'rygex --serve exited: {server.stderr.read().decode()}')
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(str(path))
+                return server
+            except OSError:
+                time.sleep(0.05)
+    server.kill()
+    raise RuntimeError('rygex --serve did not start')
+
+
+@pytest.fixture(autouse=True)
+def cache_home(tmp_path, monkeypatch) -> Path:
+    '''Keep result caches and checkpoints of every test apart.'''
+    home = tmp_path / 'cache'
+    monkeypatch.setenv('XDG_CACHE_HOME', str(home))
+    return home
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch) -> Path:
+    '''A working directory holding copies of the fixtures, made the current one.'''
+    work = tmp_path / 'work'
+    work.mkdir()
+    for name in FIXTURES:
+        shutil.copy(REPO / name, work / name)
+    monkeypatch.chdir(work)
+    return work
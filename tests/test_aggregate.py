@@ -0,0 +1,143 @@
+import json, random, re
+from collections import defaultdict
+import pytest
+
+pytest.importorskip('rygex_ext')
+
+from rygex_ext import Query
+from rygex.args import get_args
+from rygex.formatting import format_aggregates
+from conftest import run_local
+
+# more than one 4 MiB scan chunk, so parallel runs merge summaries
+LINES = 150_000
+PATTERN = r'path=(?P<path>\S+) status=(?P<status>\d+) ms=(?P<ms>\S+)'
+PATHS = ['/', '/login', '/api/items', '/api/orders', '/health']
+PERCENTILES = [0.0, 25.0, 50.0, 90.0, 99.0, 100.0]
+
+
+def request_log(seed: int) -> str:
+    '''Latencies spread over four orders of magnitude, with some lines to skip.'''
+    rng = random.Random(seed)
+    lines = []
+    for n in range(LINES):
+        ms = f'{rng.lognormvariate(3, 1.5):.3f}' if n % 50 else '-'
+        lines.append(f'GET path={rng.choice(PATHS)} status={rng.choice((200, 200, 404, 500))} ms={ms}\n')
+    return ''.join(lines)
+
+
+def exact(text: str, by: list[str]) -> dict[str, list[float]]:
+    '''The ms values of each key, in first-seen order of the keys.'''
+    values = defaultdict(list)
+    for m in re.finditer(PATTERN, text):
+        try:
+            ms = float(m['ms'])
+        except ValueError:
+            continue
+        values[' '.join(m[g] for g in by)].append(ms)
+    return values
+
+
+def nearest_rank(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[round(p / 100 * (len(ordered) - 1))]
+
+
+def check(rows, values: dict[str, list[float]], percentiles: list[float]) -> None:
+    assert [row[0] for row in rows] == list(values)
+    for key, count, total, low, high, mean, ranks in rows:
+        found = values[key]
+        assert (count, low, high) == (len(found), min(found), max(found))
+        assert total == pytest.approx(sum(found), rel=1e-9)
+        assert mean == pytest.approx(sum(found) / len(found), rel=1e-9)
+        for p, rank in zip(percentiles, ranks):
+            truth = nearest_rank(found, p)
+            assert abs(rank - truth) <= 0.01 * truth, (key, p, rank, truth)
+
+
+@pytest.fixture(scope='module')
+def logs(tmp_path_factory):
+    root = tmp_path_factory.mktemp('aggregate')
+    texts = [request_log(seed) for seed in (1, 2, 3)]
+    for n, text in enumerate(texts):
+        (root / f'requests-{n}.log').write_text(text)
+    return root, texts
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+@pytest.mark.parametrize('by', [[], ['path'], ['path', 'status']])
+def test_aggregates_match_the_exact_values(logs, by, parallel):
+    root, texts = logs
+    rows = Query.regex(PATTERN).aggregate(str(root / 'requests-0.log'), 'ms', by=by,
+                                          percentiles=PERCENTILES, parallel=parallel)
+    check(rows, exact(texts[0], by), PERCENTILES)
+
+
+def test_serial_and_parallel_agree(logs):
+    root, _ = logs
+    serial, parallel = (Query.regex(PATTERN).aggregate(str(root / 'requests-0.log'), 3, by=[1], parallel=p)
+                        for p in (False, True))
+    assert [row[:2] + row[3:5] + (row[6],) for row in serial] == [row[:2] + row[3:5] + (row[6],) for row in parallel]
+    assert [row[2] for row in serial] == pytest.approx([row[2] for row in parallel], rel=1e-9)
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_several_files_are_aggregated_together(logs, parallel):
+    root, texts = logs
+    paths = [str(root / f'requests-{n}.log') for n in range(3)]
+    rows = Query.regex(PATTERN).aggregate(paths, 'ms', by=['status'], parallel=parallel)
+    check(rows, exact(''.join(texts), ['status']), [50.0, 90.0, 99.0])
+
+
+def test_captures_are_aggregated(workdir):
+    (workdir / 'spans.log').write_text('begin 10\nend\nbegin 20\nend\nbegin x\nend\n')
+    [row] = Query.captures(r'begin (\S+)\nend').aggregate('spans.log', 1)
+    assert row[:6] == ('', 2, 30.0, 10.0, 20.0, 15.0)
+
+
+@pytest.mark.parametrize('multi', [[], ['-m', '2']])
+def test_cli_prints_a_line_per_key(logs, capsys, multi):
+    root, texts = logs
+    out, err, status = run_local(['-rp', PATTERN, '--agg', 'ms', 'path', *multi,
+                                  '-f', str(root / 'requests-0.log'), str(root / 'requests-1.log')], capsys)
+    assert status == 0, err
+    values = exact(texts[0] + texts[1], ['path'])
+    lines = out.splitlines()
+    assert [line.split()[0] for line in lines] == list(values)
+    for line in lines:
+        key, *fields = line.split()
+        fields = dict(field.split('=') for field in fields)
+        assert list(fields) == ['count', 'sum', 'min', 'max', 'mean', 'p50', 'p90', 'p99']
+        assert int(fields['count']) == len(values[key])
+        assert float(fields['max']) == pytest.approx(max(values[key]), abs=5e-4)
+
+
+@pytest.mark.parametrize('multi', [[], ['-m', '2']])
+def test_cli_jsonl(logs, capsys, multi):
+    root, texts = logs
+    out, err, status = run_local(['-rp', PATTERN, '--agg', 'ms', 'path status', '--percentiles', '50', '99.9',
+                                  '--format', 'jsonl', *multi, '-f', str(root / 'requests-2.log')], capsys)
+    assert status == 0, err
+    rows = [json.loads(line) for line in out.splitlines()]
+    assert all(list(row) == ['key', 'count', 'sum', 'min', 'max', 'mean', 'p50', 'p99.9'] for row in rows)
+    check([(row['key'], row['count'], row['sum'], row['min'], row['max'], row['mean'], [row['p50'], row['p99.9']])
+           for row in rows], exact(texts[2], ['path', 'status']), [50.0, 99.9])
+
+
+ROWS = [('b', 2, 3.0, 1.0, 2.0, 1.5, [1.0, 2.0]), ('aa', 1, 10.25, 10.25, 10.25, 10.25, [10.25, 10.25]),
+        ('c', 3, 6.0, 1.0, 3.0, 2.0, [2.0, 3.0])]
+
+
+@pytest.mark.parametrize('argv, keys', [
+    ([], ['b', 'aa', 'c']),
+    (['-r'], ['c', 'aa', 'b']),
+    (['-S'], ['b', 'c', 'aa']),
+    (['-S', '-r', '-l', ':2'], ['aa', 'c']),
+    (['-l', '1'], ['aa']),
+])
+def test_format_aggregates_orders_and_slices(argv, keys):
+    args = get_args(['-rp', PATTERN, '--agg', 'ms', 'path', '--percentiles', '50', '99', *argv])
+    lines = format_aggregates(list(ROWS), args)
+    assert [line.split()[0] for line in lines] == keys
+    assert format_aggregates(list(ROWS), get_args(['-rp', PATTERN, '--agg', 'ms', '--percentiles', '50', '99']))[1] \
+        == 'aa    count=1 sum=10.250 min=10.250 max=10.250 mean=10.250 p50=10.250 p99=10.250'
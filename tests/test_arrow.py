@@ -0,0 +1,110 @@
+import json, re
+import pytest
+
+pytest.importorskip('rygex_ext')
+pa = pytest.importorskip('pyarrow')
+
+from rygex_ext import Query
+from conftest import run_cli
+
+# the second group is optional, so some rows have a null DPT
+UFW = r'SRC=(?P<src>[\d.]+) DST=[\d.]+ .*?PROTO=(\w+)(?: SPT=\d+ DPT=(?P<dpt>\d+))?'
+LINES = (
+    'SRC=10.0.0.1 DST=10.0.0.9 LEN=40 PROTO=TCP SPT=5000 DPT=22\n'
+    'SRC=10.0.0.2 DST=10.0.0.9 LEN=40 PROTO=ICMP TYPE=8\n'
+    'nothing to see here\n'
+    'SRC=10.0.0.3 DST=10.0.0.9 LEN=40 PROTO=UDP SPT=53 DPT=5353\n'
+)
+
+
+def read(parts) -> pa.Table:
+    return pa.ipc.open_stream(b''.join(parts)).read_all()
+
+
+def expected(text: str, path: str | None = None) -> list[dict]:
+    '''The rows UFW should give for text, worked out with re.'''
+    rows = []
+    for line in text.splitlines():
+        m = re.search(UFW, line)
+        if m:
+            row = {'path': path} if path else {}
+            row.update(src=m['src'], **{'2': m[2]}, dpt=m['dpt'])
+            rows.append(row)
+    return rows
+
+
+@pytest.fixture
+def log(workdir):
+    path = workdir / 'rows.log'
+    path.write_text(LINES)
+    return path
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_columns_nulls_and_values(log, parallel):
+    query = Query.rows(UFW)
+    table = read(query.arrow(str(log), parallel=parallel))
+    assert table.column_names == query.columns == ['src', '2', 'dpt']
+    assert all(field.type == pa.string() and field.nullable for field in table.schema)
+    assert table.to_pylist() == expected(LINES)
+    assert table.column('dpt').null_count == 1
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_matches_the_json_records(workdir, parallel):
+    query = Query.rows(UFW)
+    table = read(query.arrow('ufw.test', parallel=parallel))
+    records = [json.loads(record) for record in query.collect('ufw.test', parallel=parallel)]
+    assert len(records) == 540
+    assert table.to_pylist() == records == expected((workdir / 'ufw.test').read_text())
+
+
+def test_with_filename_adds_a_path_column(log, workdir):
+    ufw = str(workdir / 'ufw.test')
+    table = read(Query.rows(UFW).arrow([str(log), ufw], with_filename=True))
+    assert table.column_names == ['path', 'src', '2', 'dpt']
+    assert table.to_pylist() == expected(LINES, str(log)) + expected((workdir / 'ufw.test').read_text(), ufw)
+
+
+def test_with_filename_labels(log):
+    table = read(Query.rows(UFW).arrow([str(log), str(log)], with_filename=['first', 'second']))
+    assert table.column('path').to_pylist() == ['first'] * 3 + ['second'] * 3
+
+
+def test_whole_match_and_no_rows(log):
+    table = read(Query.rows(r'PROTO=\w+').arrow(str(log)))
+    assert table.column_names == ['full']
+    assert table.column('full').to_pylist() == ['PROTO=TCP', 'PROTO=ICMP', 'PROTO=UDP']
+    empty = read(Query.rows(r'(?P<x>nope)').arrow(str(log)))
+    assert empty.column_names == ['x'] and empty.num_rows == 0
+
+
+def test_whole_file_rows_cross_lines(log):
+    table = read(Query.rows(r'DPT=(\d+)\nnothing', whole_file=True).arrow(str(log)))
+    assert table.to_pylist() == []
+    table = read(Query.rows(r'TYPE=(\d+)\n(\w+)', whole_file=True).arrow(str(log)))
+    assert table.to_pylist() == [{'1': '8', '2': 'nothing'}]
+
+
+def test_arrow_needs_a_rows_query(log):
+    with pytest.raises(ValueError):
+        Query.regex('SRC').arrow(str(log))
+
+
+def test_cli_writes_an_ipc_stream(log, workdir):
+    done = run_cli(['-rp', UFW, '--format', 'arrow', '-H', '-f', 'rows.log'], cwd=workdir)
+    assert done.returncode == 0, done.stderr
+    assert pa.ipc.open_stream(done.stdout).read_all().to_pylist() == expected(LINES, 'rows.log')
+
+
+@pytest.mark.parametrize('whole_file', [False, True])
+@pytest.mark.parametrize('parallel', [False, True])
+def test_batches_are_cut_at_batch_size(workdir, whole_file, parallel):
+    query = Query.rows(UFW, whole_file=whole_file)
+    reader = pa.ipc.open_stream(b''.join(query.arrow('ufw.test', parallel=parallel, batch_size=100,
+                                                     with_filename=True)))
+    batches = list(reader)
+    assert [batch.num_rows for batch in batches] == [100] * 5 + [40]
+    assert pa.Table.from_batches(batches).to_pylist() \
+        == read(query.arrow('ufw.test', with_filename=True)).to_pylist() \
+        == expected((workdir / 'ufw.test').read_text(), 'ufw.test')
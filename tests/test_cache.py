@@ -0,0 +1,123 @@
+import os, shutil, time
+import pytest
+
+pytest.importorskip('rygex_ext')
+
+from rygex import cache
+from rygex.args import get_args
+from conftest import run_local
+
+
+def key(argv: list[str], files: list[str]) -> str:
+    return cache.result_key(get_args(argv), files)
+
+
+def test_key_is_stable(workdir):
+    argv = ['-F', 'line', '-f', 'testfile', '-i']
+    assert key(argv, ['testfile']) == key(list(argv), ['testfile'])
+
+
+@pytest.mark.parametrize('extra', [['-i'], ['-u'], ['-S', '--sort-key', 'natural'], ['-l', '2'], ['-H']])
+def test_options_that_change_the_output_change_the_key(workdir, extra):
+    assert key(['-F', 'line', '-f', 'testfile', *extra], ['testfile']) != key(['-F', 'line', '-f', 'testfile'], ['testfile'])
+
+
+@pytest.mark.parametrize('extra', [['-m', '2'], ['--exclude', '*.gz'], ['--cache'], ['--stats'],
+                                   ['-S', '--sort-memory', '1M']])
+def test_options_in_not_in_key_keep_the_key(workdir, extra):
+    sort = ['-S'] if '-S' in extra else []
+    assert key(['-F', 'line', '-f', 'testfile', *extra], ['testfile']) \
+        == key(['-F', 'line', '-f', 'testfile', *sort], ['testfile'])
+
+
+def test_names_are_in_the_key_with_filenames(workdir, capsys):
+    os.symlink('testfile', 'alias')
+    assert key(['-F', 'line', '-f', 'testfile'], ['testfile']) == key(['-F', 'line', '-f', 'alias'], ['alias'])
+    assert key(['-F', 'line', '-f', 'testfile', '-H'], ['testfile']) \
+        != key(['-F', 'line', '-f', 'alias', '-H'], ['alias'])
+    first = run_local(['-F', 'line', '-f', 'testfile', '-H', '--cache'], capsys)
+    out, _, status = run_local(['-F', 'line', '-f', 'alias', '-H', '--cache'], capsys)
+    assert status == 0 and out == first[0].replace('testfile:', 'alias:')
+
+
+def test_pattern_file_contents_are_in_the_key(workdir):
+    patterns = workdir / 'patterns.txt'
+    patterns.write_text('line\n')
+    before = key(['--fixed-file', 'patterns.txt', '-f', 'testfile'], ['testfile'])
+    patterns.write_text('hello\n')
+    assert key(['--fixed-file', 'patterns.txt', '-f', 'testfile'], ['testfile']) != before
+
+
+def test_changed_files_change_the_key(workdir):
+    argv = ['-F', 'line', '-f', 'testfile']
+    st = os.stat('testfile')
+    before = key(argv, ['testfile'])
+
+    os.utime('testfile', ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    mtime = key(argv, ['testfile'])
+    assert mtime != before
+
+    os.utime('testfile', ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert key(argv, ['testfile']) == before
+    with open('testfile', 'rb+') as f:
+        f.truncate(st.st_size - 1)
+    os.utime('testfile', ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert key(argv, ['testfile']) != before
+
+    # same name, size and mtime, but another file
+    shutil.copy('ufw.test', 'replacement')
+    with open('replacement', 'rb+') as f:
+        f.truncate(st.st_size)
+    os.utime('replacement', ns=(st.st_atime_ns, st.st_mtime_ns))
+    inode = os.stat('testfile').st_ino
+    os.replace('replacement', 'testfile')
+    assert os.stat('testfile').st_ino != inode
+    assert key(argv, ['testfile']) != before
+
+
+def test_cache_is_opt_in(workdir, cache_home, capsys):
+    argv = ['-F', 'line test', '-f', 'testfile']
+    assert run_local(argv, capsys)[2] == 0
+    assert not (cache_home / 'rygex' / 'results').exists()
+
+    first = run_local(argv + ['--cache'], capsys)
+    assert len(list((cache_home / 'rygex' / 'results').glob('*.json'))) == 1
+    assert run_local(argv + ['--cache'], capsys) == first
+
+    with open('testfile', 'a') as f:
+        f.write('11 line test\n')
+    out, _, _ = run_local(argv + ['--cache'], capsys)
+    assert out.splitlines()[-1] == '11 line test'
+
+
+def entry(directory, name: str, size: int, age: float) -> None:
+    path = directory / name
+    path.write_bytes(b'x' * size)
+    when = time.time() - age
+    os.utime(path, (when, when))
+
+
+def test_evict_removes_least_recently_used(tmp_path):
+    for i, age in enumerate([500, 400, 300, 200, 100]):
+        entry(tmp_path, f'{i}.json', 100, age)
+    cache.evict(tmp_path, 250)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['3.json', '4.json']
+
+
+def test_load_result_marks_it_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'result_dir', lambda: tmp_path)
+    (tmp_path / 'old.json').write_text('["kept"]')
+    os.utime(tmp_path / 'old.json', (time.time() - 500,) * 2)
+    entry(tmp_path, 'newer.json', 100, 100)
+    assert cache.load_result('old') == ['kept']
+    cache.evict(tmp_path, 50)
+    assert [p.name for p in tmp_path.iterdir()] == ['old.json']
+
+
+def test_evict_leaves_results_being_written(tmp_path):
+    entry(tmp_path, 'a.json', 100, 300)
+    entry(tmp_path, 'b.json', 100, 200)
+    entry(tmp_path, 'writing.tmp', 1000, 1)
+    entry(tmp_path, 'abandoned.tmp', 1000, cache.PARTIAL_GRACE_SECONDS + 600)
+    cache.evict(tmp_path, 150)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['b.json', 'writing.tmp']
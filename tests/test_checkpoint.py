@@ -0,0 +1,130 @@
+import os
+import pytest
+
+pytest.importorskip('rygex_ext')
+
+from rygex import checkpoint
+from conftest import run_local
+
+LOG = (
+    'error disk full\n'
+    'info started\n'
+    'error disk full\n'
+    'warn slow\n'
+    'error timeout\n'
+)
+
+
+@pytest.fixture
+def log(workdir):
+    path = workdir / 'app.log'
+    path.write_text(LOG)
+    return path
+
+
+@pytest.fixture
+def starts(monkeypatch) -> list[int]:
+    '''The offset each checkpointed file scan starts from.'''
+    seen = []
+    scan = checkpoint.scan_appended
+
+    def spy(args, query, patterns, file_path, start, data, parallel):
+        seen.append(start)
+        return scan(args, query, patterns, file_path, start, data, parallel)
+    monkeypatch.setattr(checkpoint, 'scan_appended', spy)
+    return seen
+
+
+def run(argv: list[str], capsys, *, resume: bool = True) -> list[str]:
+    '''The output lines of rygex argv over app.log, with a checkpoint when resume.'''
+    argv = [*argv, '-f', 'app.log', *(['--checkpoint', 'state'] if resume else [])]
+    out, err, status = run_local(argv, capsys)
+    assert status == 0, err
+    return sorted(out.splitlines())
+
+
+SEARCHES = [['-F', 'error', '-c'], ['-rp', r'^(\w+)', '-c'], ['-F', 'error', '-t'], ['-rp', 'disk|slow', '-t'],
+            ['-F', 'error', '-u'], ['-F', 'error', '-u', '-H'], ['-F', 'error', '-i', '-c']]
+
+
+@pytest.mark.parametrize('argv', SEARCHES)
+def test_append_then_resume(log, capsys, starts, argv):
+    assert run(argv, capsys) == run(argv, capsys, resume=False)
+    with open(log, 'a') as f:
+        f.write('error disk full\nwarn slow\nerror ERROR new\n')
+    assert run(argv, capsys) == run(argv, capsys, resume=False)
+    assert starts == [0, len(LOG)]
+    # nothing new: the next run scans nothing and keeps the totals
+    assert run(argv, capsys) == run(argv, capsys, resume=False)
+    assert starts[-1] == log.stat().st_size
+
+
+def test_truncation_starts_over(log, capsys, starts):
+    argv = ['-F', 'error', '-c']
+    run(argv, capsys)
+    log.write_text('error once\n')
+    assert run(argv, capsys) == run(argv, capsys, resume=False) == ['error once    Line-Counts = 1']
+    assert starts == [0, 0]
+
+
+def test_rotation_starts_over(log, workdir, capsys, starts):
+    argv = ['-F', 'error', '-c']
+    run(argv, capsys)
+    # a new file at the same path, longer than the old offset
+    rotated = workdir / 'app.log.new'
+    rotated.write_text('error rotated\n' * 10)
+    os.replace(rotated, log)
+    assert run(argv, capsys) == run(argv, capsys, resume=False) == ['error rotated    Line-Counts = 10']
+    assert starts == [0, 0]
+
+
+def test_rewritten_head_starts_over(log, capsys, starts):
+    argv = ['-F', 'error', '-c']
+    run(argv, capsys)
+    inode = log.stat().st_ino
+    # same inode and a longer file, but the checkpointed bytes changed
+    with open(log, 'r+') as f:
+        f.write('error DISK')
+    with open(log, 'a') as f:
+        f.write('info more\n')
+    assert log.stat().st_ino == inode
+    assert run(argv, capsys) == run(argv, capsys, resume=False)
+    assert starts == [0, 0]
+
+
+def test_half_written_last_line_waits(log, capsys, starts):
+    argv = ['-F', 'error', '-u']
+    with open(log, 'a') as f:
+        f.write('error half')
+    assert 'error half' not in run(argv, capsys)
+    assert starts == [0]
+    with open(log, 'a') as f:
+        f.write(' written\n')
+    lines = run(argv, capsys)
+    assert 'error half written' in lines and 'error half' not in lines
+    assert starts == [0, len(LOG)]
+
+
+def test_per_pattern_totals(log, workdir, capsys, starts):
+    (workdir / 'patterns').write_text('error\ndisk\nslow\n')
+    argv = ['--fixed-file', 'patterns', '-t']
+    assert run(argv, capsys) == run(argv, capsys, resume=False)
+    with open(log, 'a') as f:
+        f.write('error disk\nslow\nslow disk\n')
+    assert run(argv, capsys) == run(argv, capsys, resume=False)
+    assert starts == [0, len(LOG)]
+
+
+def test_searches_keep_separate_checkpoints(log, capsys):
+    run(['-F', 'error', '-c'], capsys)
+    run(['-F', 'warn', '-c'], capsys)
+    assert len(list((log.parent / 'state').glob('*.json'))) == 2
+
+
+def test_unique_records_name_their_files(log, workdir, capsys):
+    (workdir / 'other.log').write_text('error disk full\nerror elsewhere\n')
+    argv = ['-F', 'error', '-u', '-H', '-f', 'app.log', 'other.log']
+    expected = run_local(argv, capsys)
+    assert expected[0].splitlines()[-1] == 'other.log:error elsewhere'
+    assert run_local([*argv, '--checkpoint', 'state'], capsys) == expected
+    assert run_local([*argv, '--checkpoint', 'state'], capsys) == expected
@@ -0,0 +1,347 @@
+import gzip, ipaddress, lzma, re, shutil
+from collections import Counter
+import pytest
+
+pytest.importorskip('rygex_ext')
+
+import rygex_ext
+from rygex.args import PythonArgs, get_args
+from rygex.converters import rust_args_parser
+from rygex.formatting import format_counts
+from conftest import REPO, run_cli, run_local
+
+IPV4 = re.compile(r'^[\d]{1,3}\.[\d]{1,3}\.[\d]{1,3}\.[\d]{1,3}$')
+
+
+def nth(line: str, needle: str, n: int) -> int | None:
+    '''Start of the nth non-overlapping needle in line.'''
+    pos, at = 0, None
+    for _ in range(n):
+        at = line.find(needle, pos)
+        if at < 0:
+            return None
+        pos = at + len(needle)
+    return at
+
+
+def span(rp: dict, line: str) -> str | None:
+    '''What extract_fixed_spans took from line.'''
+    fold = str.lower if rp['case_insensitive'] else str
+    s_pos = nth(fold(line), fold(rp['start_delim']), rp.get('start_index', 1))
+    if s_pos is None:
+        return None
+    if 'end_delim' not in rp:
+        return line if rp.get('print_line_on_match') else None
+    e_pos = nth(fold(line), fold(rp['end_delim']), rp.get('end_index', 1))
+    if e_pos is None or e_pos + len(rp['end_delim']) <= s_pos:
+        return None
+    found = line[s_pos:e_pos + len(rp['end_delim'])]
+    if rp.get('omit_first', 0) < len(found):
+        found = found[rp.get('omit_first', 0):]
+    if rp.get('omit_last', 0) < len(found):
+        found = found[:len(found) - rp.get('omit_last', 0)]
+    return found
+
+
+def records(args: PythonArgs, text: str) -> list[str]:
+    '''
+    The records the list-returning engines (find_joined_matches_in_file,
+    extract_fixed_lines, extract_fixed_spans) gave for text, split on every newline.
+    '''
+    lines = text.split('\n')
+    if args.rpyreg:
+        pattern, *index = args.rpyreg[0]
+        regex = re.compile(pattern)
+        if not index:
+            return [line for line in lines if regex.search(line)]
+        groups = [int(g) for g in index[0].split()]
+        found = []
+        for line in lines:
+            for m in regex.finditer(line):
+                parts = [m[g] for g in groups if m[g] is not None]
+                if parts:
+                    found.append(' '.join(parts))
+        return found
+    if args.fixed_string:
+        fold = str.lower if args.insensitive else str
+        return [line for line in lines if fold(args.fixed_string[0]) in fold(line)]
+    rp = rust_args_parser(args)
+    return [found for found in map(lambda line: span(rp, line), lines) if found is not None]
+
+
+def previous(argv: list[str], *sources: tuple[str, str]) -> list[str]:
+    '''
+    The output of the Python path before streaming (main_seq building one list
+    and uniquing, sorting, counting and slicing it) for argv over the (name, text)
+    sources, searched in order as one input.
+    '''
+    args = get_args(argv)
+    text = ''.join(part for _, part in sources)
+    if args.gen:
+        groups = [int(g) for g in args.gen[1].split()]
+        keys = [' '.join(m[g] for g in groups) for m in re.finditer(args.gen[0], text)]
+        return format_counts(list(Counter(keys).items()), args)
+    if args.totalcounts and args.rpyreg:
+        return [str(sum(1 for _ in re.finditer(args.rpyreg[0][0], text)))]
+    if args.totalcounts and args.fixed_string:
+        fold = str.lower if args.insensitive else str
+        return [str(fold(text).count(fold(args.fixed_string[0])))]
+
+    found = []
+    for name, part in sources:
+        prefix = f'{name}:' if args.with_filename and not args.counts else ''
+        found += [prefix + record for record in records(args, part)]
+    if not found:
+        return ['No Pattern Found']
+    if args.unique:
+        found = list(dict.fromkeys(found))
+    if not args.counts and args.sort:
+        key = ipaddress.IPv4Address if IPV4.match(found[0]) else None
+        found.sort(key=key, reverse=args.rev)
+    if args.counts:
+        return format_counts(list(Counter(found).items()), args)
+    if args.totalcounts:
+        return [str(len(found))]
+    if args.lines:
+        return [found[args.lines]] if isinstance(args.lines, int) else found[args.lines]
+    return found
+
+
+def output(lines: list[str]) -> str:
+    return ''.join(f'{line}\n' for line in lines)
+
+
+def fixture(workdir, name: str) -> tuple[str, str]:
+    return name, (workdir / name).read_text()
+
+
+SRC = r'SRC=([\d.]+)'
+CASES = [
+    # streamed records, regexes run over the buffer
+    ('ufw.test', ['-rp', r'SPT=443\b']),
+    ('ufw.test', ['-rp', r'SRC=([\d.]+) DST=([\d.]+)', '2 1']),
+    ('ufw.test', ['-rp', r'DPT=(\d+)', '0']),
+    ('ufw.test', ['-rp', r'^Feb 21 15:3[67]']),
+    ('ufw.test', ['-rp', r'SYN URGP=0$']),
+    ('ufw.test', ['-rp', r'^thisisatest$']),
+    ('ufw.test', ['-rp', SRC, '1', '-l', '10:20']),
+    ('ufw.test', ['-rp', SRC, '1', '-l', '::50']),
+    ('ufw.test', ['-rp', SRC, '1', '-l=-5:']),
+    ('ufw.test', ['-F', 'SPT=443']),
+    ('ufw.test', ['-F', 'DST=123.12.123.12', '-l', '7']),
+    ('testfile', ['-F', 'test', '-l=-1']),
+    ('testfile', ['-s', '(', '1', '-e', ')', '1']),
+    ('testfile', ['-s', '(', '2', '-e', ')', '2', '-O']),
+    ('testfile', ['-s', '(', '1', '-e', ')', '2', '-of', '1', '-ol', '1']),
+    ('testfile', ['-s', 'line', '1', '-e', 'test', '1']),
+    ('ufw.test', ['-s', 'SRC=', '1', '-e', ' DST', '1', '-O']),
+    # ASCII case folding
+    ('ufw.test', ['-F', 'feb 21', '-i']),
+    ('testfile', ['-s', 'HELLO', '1', '-e', 'BRACKET', '1', '-i']),
+    ('testfile', ['-s', 'LINE', '1', '-e', 'TEST', '1', '-i', '-t']),
+    ('ufw.test', ['-F', 'proto=tcp', '-i', '-t']),
+    # totals
+    ('ufw.test', ['-rp', 'PROTO=TCP', '-t']),
+    ('ufw.test', ['-F', 'PROTO=TCP', '-t']),
+    # unique and sorted records
+    ('ufw.test', ['-rp', SRC, '1', '-u']),
+    ('ufw.test', ['-F', 'SPT=', '-u', '-l', ':3']),
+    ('ufw.test', ['-rp', SRC, '1', '-S']),
+    ('ufw.test', ['-rp', SRC, '1', '-S', '-r', '-u']),
+    ('testfile', ['-rp', r'^\d+ line', '-S', '-r']),
+    # counts and top-K
+    ('ufw.test', ['-rp', SRC, '1', '-c']),
+    ('ufw.test', ['-rp', r'SPT=(\d+)', '1', '-c', '-S', '-r']),
+    ('ufw.test', ['-rp', r'DPT=(\d+)', '1', '-c', '-S', '-r', '-l', ':5']),
+    ('ufw.test', ['-rp', r'DPT=(\d+)', '1', '-c', '-S', '-l', '1']),
+    ('ufw.test', ['-F', 'Feb 21 15:36', '-c']),
+    ('ufw.test', ['-s', 'SRC=', '1', '-e', ' DST', '1', '-O', '-c', '-S']),
+    ('testfile', ['-s', 'hello', '1', '-e', 'is', '2', '-c']),
+    ('ufw.test', ['-g', r'SRC=([\d.]+).*?DPT=(\d+)', '1 2']),
+    ('ufw.test', ['-g', r'SPT=(\d+)', '1', '-S', '-r', '-l', ':2']),
+]
+
+
+@pytest.mark.parametrize('multi', [[], ['-m', '2']])
+@pytest.mark.parametrize('name, argv', CASES)
+def test_each_mode_prints_what_the_list_path_printed(workdir, capsys, name, argv, multi):
+    assert run_local([*argv, *multi, '-f', name], capsys) \
+        == (output(previous(argv, fixture(workdir, name))), '', 0)
+
+
+# several STREAM_CHUNK_BYTES (4 MiB) scan chunks
+LARGE_COPIES = 100
+
+
+@pytest.fixture(scope='module')
+def large(tmp_path_factory):
+    '''
+    ufw.test over and over, each copy with its own SRC and kernel times, so
+    records differ from chunk to chunk and lines straddle every chunk
+    boundary.
+    '''
+    lines = (REPO / 'ufw.test').read_text().splitlines()
+    text = ''.join(
+        line.replace('[852160.927134]', f'[{copy}.{n}]')
+            .replace('SRC=79.124.59.134', f'SRC=79.124.{copy}.134') + '\n'
+        for copy in range(LARGE_COPIES) for n, line in enumerate(lines)
+    )
+    chunk = 4 * 2**20
+    assert len(text) > 3 * chunk
+    assert all(text[at - 1] != '\n' for at in range(chunk, len(text), chunk))
+    path = tmp_path_factory.mktemp('large') / 'large.log'
+    path.write_text(text)
+    return path, text
+
+
+@pytest.mark.parametrize('multi', [[], ['-m', '2']])
+@pytest.mark.parametrize('argv', [argv for name, argv in CASES if name == 'ufw.test'], ids=' '.join)
+def test_each_mode_over_several_chunks(large, capsys, argv, multi):
+    path, text = large
+    assert run_local([*argv, *multi, '-f', str(path)], capsys) \
+        == (output(previous(argv, ('large.log', text))), '', 0)
+
+
+def test_no_match(workdir, capsys):
+    for argv in (['-rp', 'nothing like this'], ['-F', 'nothing like this'], ['-s', 'nothing', '1', '-e', 'this', '1']):
+        assert run_local([*argv, '-f', 'ufw.test'], capsys) == ('No Pattern Found\n', '', 0)
+
+
+@pytest.mark.parametrize('argv', [['-rp', SRC, '1'], ['-rp', r'SPT=(\d+)', '1', '-c'], ['-F', 'feb 21', '-i'],
+                                  ['-s', 'SRC=', '1', '-e', ' DST', '1', '-O', '-u'],
+                                  ['-rp', 'PROTO=TCP', '-t'], ['-F', 'PROTO=TCP', '-t']])
+def test_piped_input(workdir, argv):
+    '''The Rust engines reading stdin.'''
+    done = run_cli(argv, cwd=workdir, stdin=(workdir / 'ufw.test').read_bytes())
+    assert done.returncode == 0, done.stderr
+    assert done.stdout.decode() == output(previous(argv, fixture(workdir, 'ufw.test')))
+
+
+COMPRESSORS = {'.gz': gzip.compress, '.xz': lzma.compress}
+
+
+@pytest.mark.parametrize('multi', [[], ['-m', '2']])
+@pytest.mark.parametrize('suffix', COMPRESSORS)
+@pytest.mark.parametrize('argv', [['-rp', SRC, '1'], ['-F', 'SPT=443', '-c'], ['-rp', 'PROTO=TCP', '-t'],
+                                  ['-s', 'SRC=', '1', '-e', ' DST', '1', '-O', '-S', '-u']])
+def test_compressed_input(workdir, capsys, argv, suffix, multi):
+    '''Compressed files give what the plain file gives.'''
+    data = (workdir / 'ufw.test').read_bytes()
+    (workdir / f'ufw{suffix}').write_bytes(COMPRESSORS[suffix](data))
+    expected = output(previous(argv, fixture(workdir, 'ufw.test')))
+    assert run_local([*argv, *multi, '-f', f'ufw{suffix}'], capsys) == (expected, '', 0)
+    done = run_cli(argv, cwd=workdir, stdin=COMPRESSORS[suffix](data))
+    assert done.returncode == 0, done.stderr
+    assert done.stdout.decode() == expected
+
+
+@pytest.fixture
+def tree(workdir):
+    '''logs/ holding both fixtures, one of them compressed, and a file to exclude.'''
+    for path in ('logs/a/testfile', 'logs/b/ufw.test', 'logs/b/skip/ufw.test'):
+        (workdir / path).parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy(workdir / path.rsplit('/', 1)[1], workdir / path)
+    (workdir / 'logs/c.gz').write_bytes(gzip.compress((workdir / 'testfile').read_bytes()))
+    return workdir
+
+
+@pytest.mark.parametrize('multi', [[], ['-m', '2']])
+@pytest.mark.parametrize('argv', [['-F', 'line'], ['-F', 'line', '-H'], ['-rp', r'(\d+) line', '1', '-H', '-u'],
+                                  ['-F', 'line', '-c'], ['-F', 'line', '-t'], ['-rp', r'^\d+', '-S'],
+                                  ['-rp', SRC, '1', '-c', '-S', '-r', '-l', ':3'],
+                                  ['-s', 'line', '1', '-e', 'test', '1', '-H']])
+def test_several_files_are_one_input(tree, capsys, argv, multi):
+    '''Files, directories and globs, searched in order with counts across all of them.'''
+    files = [fixture(tree, 'testfile'), fixture(tree, 'ufw.test')]
+    assert run_local([*argv, *multi, '-f', 'testfile', 'ufw.test'], capsys) \
+        == (output(previous(argv, *files)), '', 0)
+    testfile, ufw = files[0][1], files[1][1]
+    # a directory's own files come before its subdirectories
+    walked = [('logs/c.gz', testfile), ('logs/a/testfile', testfile), ('logs/b/ufw.test', ufw)]
+    assert run_local([*argv, *multi, '-f', 'logs', '-x', 'skip/'], capsys) \
+        == (output(previous(argv, *walked)), '', 0)
+    assert run_local([*argv, *multi, '-f', 'logs/*/*.test', 'logs/a/testfile'], capsys) \
+        == (output(previous(argv, walked[2], walked[1])), '', 0)
+
+
+@pytest.mark.parametrize('multi', [[], ['-m', '2']])
+def test_captures_across_lines_in_one_large_file(workdir, capsys, multi):
+    '''-g matches holding a newline are all counted in a file the pool splits, alone or with another.'''
+    text = ''.join(f'BEGIN k{i % 7}\nEND\n' for i in range(700000))
+    (workdir / 'large.log').write_text(text)
+    argv = ['-g', r'BEGIN (\w+)\nEND', '1']
+    assert run_local([*argv, *multi, '-f', 'large.log'], capsys) \
+        == (output(previous(argv, ('large.log', text))), '', 0)
+    assert run_local([*argv, *multi, '-f', 'large.log', 'ufw.test'], capsys) \
+        == (output(previous(argv, ('large.log', text), fixture(workdir, 'ufw.test'))), '', 0)
+    query = rygex_ext.Query.captures(r'BEGIN (\w+)\nEND', [1])
+    rows, end = query.count_appended(str(workdir / 'large.log'), 0, bool(multi))
+    assert (sorted(rows), end) == (sorted(Counter(re.findall(r'BEGIN (\w+)\nEND', text)).items()), len(text))
+
+
+def tagged(argvs: list[list[str]], text: str) -> list[str]:
+    '''Lines matched by any of the searches, prefixed with the numbers of those that matched.'''
+    found = []
+    for line in text.split('\n'):
+        ids = [str(n) for n, argv in enumerate(argvs, 1) if records(get_args(argv), line)]
+        if ids:
+            found.append(f'{",".join(ids)}:{line}')
+    return found
+
+
+MULTI_PATTERN = [
+    (['-F', 'SPT=443', '-F', 'SPT=51914 ', '-F', 'nothing'],
+     [['-F', 'SPT=443'], ['-F', 'SPT=51914 '], ['-F', 'nothing']]),
+    (['-F', 'spt=443', '-F', 'LINE', '-i'], [['-F', 'spt=443', '-i'], ['-F', 'LINE', '-i']]),
+    (['-rp', r'SPT=5\d+', '-rp', r'DPT=4\d{4}\b', '-rp', '^[0-9]'],
+     [['-rp', r'SPT=5\d+'], ['-rp', r'DPT=4\d{4}\b'], ['-rp', '^[0-9]']]),
+]
+
+
+@pytest.mark.parametrize('multi', [[], ['-m', '2']])
+@pytest.mark.parametrize('argv, singles', MULTI_PATTERN)
+def test_many_patterns_in_one_pass(workdir, capsys, argv, singles, multi):
+    '''One pass gives what a run per pattern gives.'''
+    text = (workdir / 'testfile').read_text() + (workdir / 'ufw.test').read_text()
+    argv = [*argv, *multi, '-f', 'testfile', 'ufw.test']
+    assert run_local(argv, capsys) == (output(tagged(singles, text)), '', 0)
+    totals = [(single[1], len(records(get_args(single), text))) for single in singles]
+    assert run_local([*argv, '-t'], capsys) == (output(format_counts(totals, get_args(['-t']))), '', 0)
+
+
+def test_pattern_files_add_to_the_flags(workdir, capsys):
+    (workdir / 'patterns').write_text('SPT=443\n\nSPT=51914 \n')
+    text = (workdir / 'ufw.test').read_text()
+    singles = [['-F', 'Feb 21 09'], ['-F', 'SPT=443'], ['-F', 'SPT=51914 ']]
+    assert run_local(['-F', 'Feb 21 09', '--fixed-file', 'patterns', '-f', 'ufw.test'], capsys) \
+        == (output(tagged(singles, text)), '', 0)
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+@pytest.mark.parametrize('pattern, groups', [(r'DPT=(\d+)', [1]), (r'SRC=([\d.]+)(?: (BOGUS))?', None),
+                                             ('PROTO', None)])
+def test_offsets_match_the_records(workdir, capsys, pattern, groups, parallel):
+    '''Offsets agree with re and slice back to the -rp records.'''
+    data = (workdir / 'ufw.test').read_bytes()
+    regex, expected, at = re.compile(pattern.encode()), [], 0
+    for line in data.split(b'\n'):
+        for m in regex.finditer(line):
+            expected.append([at + p if p >= 0 else -1
+                             for g in [0, *(groups or range(1, regex.groups + 1))] for p in m.span(g)])
+        at += len(line) + 1
+    offsets = rygex_ext.Query.regex(pattern, groups).offsets('ufw.test', parallel=parallel)
+    rows = memoryview(offsets).tolist()
+    assert len(offsets) == len(rows) and rows == expected
+    if groups:
+        mapped = rygex_ext.MappedFile('ufw.test')
+        out, _, _ = run_local(['-rp', pattern, '1', '-f', 'ufw.test'], capsys)
+        assert [mapped.slice(start, end).decode() for *_, start, end in rows] == out.splitlines()
+
+
+def test_fixed_offsets(workdir):
+    data = (workdir / 'ufw.test').read_bytes()
+    expected, at = [], data.find(b'SPT=443')
+    while at >= 0:
+        expected.append([at, at + len('SPT=443')])
+        at = data.find(b'SPT=443', at + len('SPT=443'))
+    assert memoryview(rygex_ext.Query.fixed('SPT=443').offsets('ufw.test')).tolist() == expected
@@ -0,0 +1,94 @@
+import shutil, socket, time
+import pytest
+
+pytest.importorskip('rygex_ext')
+
+from rygex import client
+from conftest import run_local, start_server
+
+SEARCHES = [
+    ['-F', 'SRC=79.124.59.134', '-f', 'ufw.test'],
+    ['-F', 'line test', '-f', 'testfile', '-H'],
+    ['-rp', r'SRC=(\S+)', '1', '-f', 'ufw.test', '-c'],
+    ['-rp', r'DPT=(\d+)', '1', '-f', 'logs', '-H', '-u', '-S'],
+    ['-s', '(', '1', '-e', ')', '1', '-f', 'testfile'],
+    ['-p', r'(\d+) line test', '1', '-f', 'testfile', '-l', '-2'],
+    ['-p', r'SRC=(\S+)', '1', '-f', 'ufw.test', '-m', '2', '-u'],
+    ['-F', 'no such text', '-f', 'testfile'],
+    ['-F', 'line', '-f', 'missing.log'],
+    ['-F', 'line', '--fixed-file', 'missing.txt', '-f', 'testfile'],
+]
+
+
+@pytest.fixture
+def server(tmp_path_factory):
+    '''A server started in a directory of its own, so relative paths only work from the client's.'''
+    root = tmp_path_factory.mktemp('server')
+    path = root / 'rygex.sock'
+    process = start_server(path, cwd=root)
+    yield path
+    process.terminate()
+    assert process.wait(timeout=30) == 0
+    assert not path.exists()
+
+
+def served(path, argv: list[str], capsys) -> tuple[str, str, int | None]:
+    status = client.run_remote(str(path), argv)
+    out, err = capsys.readouterr()
+    return out, err, status
+
+
+@pytest.mark.parametrize('argv', SEARCHES, ids=' '.join)
+def test_served_search_matches_in_process(server, workdir, argv, capsys):
+    (workdir / 'logs' / 'old').mkdir(parents=True)
+    shutil.copy(workdir / 'ufw.test', workdir / 'logs' / 'ufw.log')
+    shutil.copy(workdir / 'ufw.test', workdir / 'logs' / 'old' / 'ufw.log.1')
+    assert served(server, argv, capsys) == run_local(argv, capsys)
+
+
+def test_server_uses_the_clients_environment(server, workdir, tmp_path, monkeypatch, capsys):
+    home = tmp_path / 'client-cache'
+    monkeypatch.setenv('XDG_CACHE_HOME', str(home))
+    out, _, status = served(server, ['-F', 'line test', '-f', 'testfile', '-t', '--cache'], capsys)
+    assert (out, status) == ('7\n', 0)
+    assert list((home / 'rygex' / 'results').glob('*.json'))
+
+
+def test_stalled_client_does_not_hold_up_others(server, workdir, capsys):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stalled:
+        stalled.connect(str(server))  # and never sends its request
+        started = time.monotonic()
+        assert served(server, ['-F', 'line test', '-f', 'testfile', '-t'], capsys) == ('7\n', '', 0)
+        assert time.monotonic() - started < 10
+
+
+@pytest.mark.parametrize('name, value', [('__version__', '0.0.0'), ('PROTOCOL', 0)])
+def test_other_version_falls_back_to_in_process(server, workdir, monkeypatch, name, value, capsys):
+    monkeypatch.setattr(client, name, value)
+    assert served(server, ['-F', 'line', '-f', 'testfile'], capsys) == ('', '', None)
+
+
+def test_stats_runs_in_process():
+    assert client.searches_files(['-F', 'x', '-f', 'log'])
+    assert not client.searches_files(['-F', 'x', '-f', 'log', '--stats'])
+    assert not client.searches_files(['-F', 'x', '-f', 'log', '--stats=json'])
+    assert not client.searches_files(['-F', 'x'])
+
+
+@pytest.mark.parametrize('extra', [['--form', 'arrow'], ['--forma=arrow'], ['--stat'], ['--stat', 'json']])
+def test_abbreviated_options_run_in_process(server, workdir, extra, capsys):
+    assert served(server, ['-F', 'line', '-f', 'testfile', *extra], capsys) == ('', '', None)
+
+
+def test_stale_socket_is_replaced(tmp_path, workdir, capsys):
+    path = tmp_path / 'stale.sock'
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as dead:
+        dead.bind(str(path))  # closed without unlinking, as after a crash
+    assert path.exists()
+    process = start_server(path, cwd=tmp_path)
+    try:
+        assert served(path, ['-F', 'line test', '-f', 'testfile', '-t'], capsys) == ('7\n', '', 0)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    assert not path.exists()
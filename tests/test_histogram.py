@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+
+pytest.importorskip('rygex_ext')
+
+from rygex_ext import Query
+from conftest import run_local
+
+DAY = 86400
+SYSLOG = r'^(\w{3} [ \d]\d \d\d:\d\d:\d\d) (\S+)'
+
+
+def syslog_time(when: datetime) -> str:
+    return f'{when:%b} {when.day:2d} {when:%H:%M:%S}'
+
+
+def write_log(path, times: list[datetime]) -> None:
+    path.write_text(''.join(f'{syslog_time(t)} host{n % 2} message\n' for n, t in enumerate(times)))
+
+
+def test_syslog_times_fall_in_the_last_twelve_months(workdir):
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    # over the last ten months, so the log crosses New Year in any month it runs
+    times = [now - timedelta(days=days) for days in (300, 200, 100, 31, 1)] + [now]
+    write_log(workdir / 'recent.log', times)
+    start, series = Query.regex(SYSLOG).histogram('recent.log', 1, bucket_seconds=DAY)
+    first, last = (int(t.timestamp()) // DAY * DAY for t in (times[0], times[-1]))
+    assert start == first
+    [(key, counts)] = series
+    assert key == '' and len(counts) == (last - first) // DAY + 1 and sum(counts) == len(times)
+    assert [start + i * DAY for i, n in enumerate(counts) if n] == \
+        [int(t.timestamp()) // DAY * DAY for t in times]
+
+
+def test_december_is_the_year_before_january(workdir):
+    now = datetime.now(timezone.utc)
+    (workdir / 'newyear.log').write_text('Dec 31 23:59:00 a\nJan  1 00:01:00 b\n')
+    start, [(_, counts)] = Query.regex(SYSLOG).histogram('newyear.log', 1, bucket_seconds=60)
+    january = now.year if (now.month, now.day) != (12, 31) else now.year + 1
+    if datetime(january, 1, 1, 0, 1, tzinfo=timezone.utc) > now + timedelta(days=1):
+        january -= 1
+    assert start == int(datetime(january - 1, 12, 31, 23, 59, tzinfo=timezone.utc).timestamp())
+    assert counts == [1, 0, 1]
+
+
+def test_year_places_every_time_in_it(workdir):
+    (workdir / 'old.log').write_text('Feb  1 00:00:10 a\nDec 31 23:59:00 b\n')
+    start, [(_, counts)] = Query.regex(SYSLOG).histogram('old.log', 1, bucket_seconds=DAY, year=2021)
+    assert start == int(datetime(2021, 2, 1, tzinfo=timezone.utc).timestamp())
+    assert len(counts) == 334 and counts[0] == counts[-1] == 1
+
+
+def test_cli_year(workdir, capsys):
+    (workdir / 'old.log').write_text('Mar  3 10:00:00 a\nMar  3 10:30:00 b\n')
+    out, err, status = run_local(['-rp', SYSLOG, '--histogram', '1', '--bucket', '1h', '--year', '2020',
+                                  '-f', 'old.log'], capsys)
+    assert status == 0, err
+    [line] = out.splitlines()
+    assert line.startswith('2020-03-03 10:00') and line.split()[-1] == '2'
+
+
+@pytest.mark.parametrize('argv', [['--year', '2020'], ['--histogram', '1', '--time-format', 'iso', '--year', '2020']])
+def test_year_needs_a_syslog_histogram(workdir, capsys, argv):
+    (workdir / 'old.log').write_text('Mar  3 10:00:00 a\n')
+    out, err, status = run_local(['-rp', SYSLOG, *argv, '-f', 'old.log'], capsys)
+    assert status and '--year' in out + err
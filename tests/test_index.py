@@ -0,0 +1,97 @@
+import os
+import pytest
+
+pytest.importorskip('rygex_ext')
+
+import rygex_ext
+from rygex_ext import Query
+from rygex.files import INDEX_SUFFIX
+from conftest import run_local
+
+# small blocks, so an index over the test log has many to skip
+BLOCK_BYTES = 512
+QUERIES = {
+    'fixed': lambda: Query.fixed('Needle'),
+    'fixed -i': lambda: Query.fixed('NEEDLE', case_insensitive=True),
+    'regex': lambda: Query.regex(r'Needle (\d+) at'),
+    'regex, no trigrams': lambda: Query.regex(r'\d+ at \w'),
+    'literals': lambda: Query.literals(['Needle', 'haystack 7']),
+    'literals -i': lambda: Query.literals(['needle', 'HAYSTACK 7'], case_insensitive=True),
+    'regex set': lambda: Query.regex_set([r'Needle \d+', r'haystack 1\d\b']),
+}
+PATTERN_SETS = {'literals', 'literals -i', 'regex set'}
+
+
+def write_log(path, needles: dict[int, str]) -> None:
+    '''Mostly hay, with the given lines replaced.'''
+    path.write_text(''.join(needles.get(i, f'haystack {i} of lines without the word\n') for i in range(2000)))
+
+
+@pytest.fixture
+def log(workdir):
+    path = workdir / 'hay.log'
+    write_log(path, {5: 'Needle 5 at the start\n', 1200: 'needle 1200 at the middle\n', 1999: 'NEEDLE 1999 at the end\n'})
+    return path
+
+
+def results(name: str, paths: list[str], parallel: bool) -> tuple:
+    query = QUERIES[name]()
+    records = query.collect(paths, parallel=parallel)
+    counts = query.count(paths, parallel=parallel)
+    streamed = [record for batch in query.stream(paths, parallel=parallel) for record in batch]
+    totals = query.pattern_totals(paths, parallel=parallel) if name in PATTERN_SETS else None
+    return records, counts, streamed, totals
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+@pytest.mark.parametrize('name', QUERIES)
+def test_indexed_and_unindexed_results_match(log, workdir, name, parallel):
+    other = workdir / 'other.log'
+    write_log(other, {10: 'Needle 10 at a second file\n'})
+    for paths in ([str(log)], [str(log), str(other)]):
+        before = results(name, paths, parallel)
+        assert before[0]
+        for path in paths:
+            assert rygex_ext.build_index(path, BLOCK_BYTES) > 1
+        assert results(name, paths, parallel) == before
+        for path in paths:
+            os.remove(path + INDEX_SUFFIX)
+
+
+@pytest.mark.parametrize('argv', [['-F', 'Needle'], ['-F', 'needle', '-i'], ['-F', 'needle', '-i', '-t'],
+                                  ['-rp', r'Needle (\d+)'], ['-rp', r'(?i)needle (\d+)', '-c'],
+                                  ['-rp', 'Needle', '-t'], ['--fixed-file', 'patterns', '-c']])
+def test_cli_output_is_the_same_with_an_index(log, workdir, capsys, argv):
+    (workdir / 'patterns').write_text('Needle\nhaystack 7\n')
+    argv = [*argv, '-f', 'hay.log']
+    before = run_local(argv, capsys)
+    rygex_ext.build_index(str(log), BLOCK_BYTES)
+    assert run_local(argv, capsys) == before
+
+
+def test_an_index_is_ignored_once_the_file_is_appended_to(log):
+    rygex_ext.build_index(str(log), BLOCK_BYTES)
+    with open(log, 'a') as f:
+        f.write('Needle 2000 appended\n')
+    assert Query.fixed('Needle').collect(str(log))[-1] == 'Needle 2000 appended'
+
+
+def test_an_index_is_ignored_once_the_file_is_rewritten_in_place(log):
+    rygex_ext.build_index(str(log), BLOCK_BYTES)
+    stat = os.stat(log)
+    data = log.read_bytes()
+    # the same size and inode: only the mtime tells the index is stale
+    moved = data.replace(b'haystack 600 of', b'Needle 600 at  ', 1)
+    assert len(moved) == len(data)
+    with open(log, 'r+b') as f:
+        f.write(moved)
+    os.utime(log, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert 'Needle 600 at   lines without the word' in Query.fixed('Needle').collect(str(log))
+
+
+def test_an_index_is_ignored_once_the_file_is_replaced(log, workdir):
+    rygex_ext.build_index(str(log), BLOCK_BYTES)
+    new = workdir / 'new.log'
+    write_log(new, {42: 'Needle 42 at a new place\n'})
+    os.replace(new, log)
+    assert Query.fixed('Needle').collect(str(log)) == ['Needle 42 at a new place']
@@ -0,0 +1,98 @@
+import io, re, time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+
+pytest.importorskip('rygex_ext')
+
+from rygex import python_regex
+from rygex.args import get_args
+from conftest import run_cli, run_local
+
+# many 10,000-line stdin chunks, and many byte ranges of a file
+LINES = 120_000
+SEARCHES = [['-p', r'id=(\d+7) '], ['-p', r'id=(\d+) user=(u\d)', '1 2'], ['-p', r'user=u3\b', '-l', ':5'],
+            ['-p', r'id=(\d+)', '1', '-l=-3']]
+
+
+def request_log() -> str:
+    return ''.join(f'id={n} user=u{n * 7 % 10}\n' for n in range(LINES))
+
+
+def expected(argv: list[str], text: str) -> str:
+    '''What a single Python process finds, line by line in input order.'''
+    args = get_args(argv)
+    regex = re.compile(args.pyreg[0])
+    groups = [int(g) for g in args.pyreg[1].split()] if len(args.pyreg) > 1 else []
+    found = []
+    for line in text.splitlines():
+        m = regex.search(line)
+        if m:
+            found.append(' '.join(m[g] for g in groups) if groups else line)
+    if args.lines is not None:
+        found = found[args.lines] if isinstance(args.lines, slice) else [found[args.lines]]
+    return ''.join(f'{record}\n' for record in found)
+
+
+@pytest.mark.parametrize('argv', SEARCHES, ids=' '.join)
+def test_multi_prints_in_input_order(workdir, capsys, argv):
+    text = request_log()
+    (workdir / 'requests.log').write_text(text)
+    single = run_local([*argv, '-f', 'requests.log'], capsys)
+    assert single == (expected(argv, text), '', 0)
+    assert run_local([*argv, '-m', '2', '-f', 'requests.log'], capsys) == single
+
+
+@pytest.mark.parametrize('multi', [[], ['-m', '2']])
+@pytest.mark.parametrize('argv', SEARCHES, ids=' '.join)
+def test_piped_input(workdir, argv, multi):
+    text = request_log()
+    done = run_cli([*argv, *multi], cwd=workdir, stdin=text.encode())
+    assert done.returncode == 0, done.stderr
+    assert done.stdout.decode() == expected(argv, text)
+
+
+class Pipe(io.StringIO):
+    '''Piped input that notes how many lines have been read from it.'''
+    read = 0
+
+    def isatty(self) -> bool:
+        return False
+
+    def __next__(self) -> str:
+        line = super().__next__()
+        self.read += 1
+        return line
+
+
+def test_stdin_is_read_a_window_of_chunks_at_a_time(monkeypatch):
+    text = request_log()
+    pipe = Pipe(text)
+    monkeypatch.setattr('sys.stdin', pipe)
+    argv = ['-p', r'id=(\d+)', '1']
+    batches = python_regex.multi_cpu(get_args(argv), n_cores=2, chunk_size=1_000, tasks_per_core=2)
+    first = next(batches)
+    # the four chunks in flight, and the one submitted as the first came back
+    assert first == [str(n) for n in range(1_000)] and pipe.read <= 5 * 1_000
+    rest = [record for batch in batches for record in batch]
+    assert pipe.read == LINES
+    assert ''.join(f'{record}\n' for record in first + rest) == expected(argv, text)
+
+
+def test_ordered_window_keeps_task_order():
+    pulled = []
+
+    def tasks():
+        for n in range(40):
+            pulled.append(n)
+            yield n
+
+    def slow_first(n: int) -> int:
+        # earlier tasks finish later, so completion order is the reverse of task order
+        time.sleep(0.002 * (n % 4 == 0) + 0.0005 * (3 - n % 4))
+        return n * n
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = python_regex.ordered_window(executor, slow_first, tasks(), window=4)
+        assert next(results) == 0
+        assert len(pulled) <= 5
+        assert [0, *results] == [n * n for n in range(40)]
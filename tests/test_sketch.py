@@ -0,0 +1,101 @@
+import math, random
+from collections import Counter
+import pytest
+
+pytest.importorskip('rygex_ext')
+
+from rygex_ext import Query
+
+# more than one 4 MiB scan chunk, so parallel runs merge sketches
+LINES = 250_000
+PADDING = ' ' + 'x' * 30
+QUERY = (r'^(\S+)', [1])
+
+
+def write_ids(path, ids: list[str]) -> None:
+    path.write_text(''.join(f'{i}{PADDING}\n' for i in ids))
+
+
+def uniform_ids(seed: int, distinct: int) -> list[str]:
+    rng = random.Random(seed)
+    return [f'id-{rng.randrange(distinct)}' for _ in range(LINES)]
+
+
+def skewed_ids(seed: int) -> list[str]:
+    '''A Zipf-like mix: a few keys make up most records, with a long tail.'''
+    rng = random.Random(seed)
+    keys = [f'user{k}' for k in range(20_000)]
+    weights = [1 / (rank + 1) ** 1.2 for rank in range(len(keys))]
+    return rng.choices(keys, weights=weights, k=LINES)
+
+
+@pytest.fixture(scope='module')
+def data_dir(tmp_path_factory):
+    return tmp_path_factory.mktemp('sketch')
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+@pytest.mark.parametrize('error', [0.01, 0.05])
+@pytest.mark.parametrize('seed, distinct', [(1, 500), (2, 20_000), (3, 1_000_000)])
+def test_distinct_estimate_is_within_its_standard_error(data_dir, seed, distinct, error, parallel):
+    path = data_dir / f'uniform-{seed}.log'
+    ids = uniform_ids(seed, distinct)
+    if not path.exists():
+        write_ids(path, ids)
+    truth = len(set(ids))
+    estimate = Query.regex(*QUERY).approx_distinct(str(path), error=error, parallel=parallel)
+    assert abs(estimate - truth) <= 4 * error * truth, (estimate, truth)
+
+
+def test_distinct_sketches_merge_across_files(data_dir):
+    ids = uniform_ids(4, 50_000)
+    paths = [data_dir / f'part-{n}.log' for n in range(3)]
+    for n, path in enumerate(paths):
+        write_ids(path, ids[n::3])
+    truth = len(set(ids))
+    for parallel in (False, True):
+        estimate = Query.regex(*QUERY).approx_distinct([str(p) for p in paths], error=0.01, parallel=parallel)
+        assert abs(estimate - truth) <= 0.04 * truth, (estimate, truth)
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+@pytest.mark.parametrize('error', [0.001, 0.01, 0.05])
+@pytest.mark.parametrize('seed', [1, 2])
+def test_heavy_hitters_are_reported_and_never_undercounted(data_dir, seed, error, parallel):
+    path = data_dir / f'skewed-{seed}.log'
+    ids = skewed_ids(seed)
+    if not path.exists():
+        write_ids(path, ids)
+    truth = Counter(ids)
+    reported = dict(Query.regex(*QUERY).heavy_hitters(str(path), error=error, parallel=parallel))
+    assert len(reported) <= math.ceil(1 / error)
+    heavy = [key for key, n in truth.items() if n > error * LINES]
+    assert heavy and set(heavy) <= set(reported)
+    for key, n in reported.items():
+        assert truth[key] <= n <= truth[key] + error * LINES, (key, n, truth[key])
+        assert n > error * LINES
+
+
+def test_tail_is_left_out(data_dir):
+    path = data_dir / 'flat.log'
+    write_ids(path, uniform_ids(5, 1_000))
+    assert Query.regex(*QUERY).heavy_hitters(str(path), error=0.01) == []
+    assert len(Query.regex(*QUERY).heavy_hitters(str(path), error=0.0005)) == 1_000
+
+
+def test_heavy_hitters_come_highest_first(data_dir):
+    path = data_dir / 'skewed-1.log'
+    if not path.exists():
+        write_ids(path, skewed_ids(1))
+    counts = [n for _, n in Query.regex(*QUERY).heavy_hitters(str(path), error=0.01, parallel=True)]
+    assert counts == sorted(counts, reverse=True)
+
+
+@pytest.mark.parametrize('error', [0.0, 1.0, -0.5])
+def test_sketch_error_must_be_a_fraction(data_dir, error):
+    path = data_dir / 'tiny.log'
+    write_ids(path, ['a', 'b'])
+    with pytest.raises(ValueError):
+        Query.regex(*QUERY).approx_distinct(str(path), error=error)
+    with pytest.raises(ValueError):
+        Query.regex(*QUERY).heavy_hitters(str(path), error=error)
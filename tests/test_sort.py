@@ -0,0 +1,128 @@
+import functools, ipaddress, math, random, re
+import pytest
+
+pytest.importorskip('rygex_ext')
+
+import rygex_ext
+from rygex_ext import Query
+from conftest import run_local
+
+# small enough that a few hundred records make dozens of sorted runs
+TINY_MEMORY = 1024
+KEYS = ['lexical', 'numeric', 'ip', 'natural']
+
+
+def numeric_key(record: str) -> tuple:
+    try:
+        n = float(record.strip())
+    except ValueError:
+        return (1, 0.0, record)
+    return (1, 0.0, record) if math.isnan(n) else (0, n, record)
+
+
+def ip_key(record: str) -> tuple:
+    try:
+        ip = ipaddress.ip_address(record.strip())
+    except ValueError:
+        return (1, 0, 0, record)
+    return (0, ip.version, int(ip), record)
+
+
+def natural_cmp(a: str, b: str) -> int:
+    '''Runs of digits compare as numbers, anything else by code point, then the text.'''
+    x, y = re.findall(r'\d+|\D', a), re.findall(r'\d+|\D', b)
+    for p, q in zip(x, y):
+        if p.isdigit() and q.isdigit():
+            p, q = p.lstrip('0'), q.lstrip('0')
+            p, q = (len(p), p), (len(q), q)
+        else:
+            p, q = p[0], q[0]
+        if p != q:
+            return -1 if p < q else 1
+    rest = (len(a) - len(''.join(x[:len(y)]))) - (len(b) - len(''.join(y[:len(x)])))
+    if rest:
+        return -1 if rest < 0 else 1
+    return (a > b) - (a < b)
+
+
+REFERENCE = {
+    'lexical': {},
+    'numeric': {'key': numeric_key},
+    'ip': {'key': ip_key},
+    'natural': {'key': functools.cmp_to_key(natural_cmp)},
+}
+
+
+def expected(records: list[str], key: str, descending: bool = False, unique: bool = False) -> list[str]:
+    records = list(dict.fromkeys(records)) if unique else records
+    return sorted(records, **REFERENCE[key], reverse=descending)
+
+
+def mixed_records(seed: int, n: int = 600) -> list[str]:
+    '''Numbers, addresses, versioned names and plain words, with repeats.'''
+    rng = random.Random(seed)
+    makers = [
+        lambda: str(rng.randint(-1000, 1000)),
+        lambda: f'{rng.uniform(-50, 50):.3f}',
+        lambda: f'{rng.randint(1, 9)}e{rng.randint(-3, 3)}',
+        lambda: f' {rng.randint(0, 99)}',
+        lambda: '.'.join(str(rng.randint(0, 255)) for _ in range(4)),
+        lambda: f'2001:db8::{rng.randint(0, 0xffff):x}',
+        lambda: f'file{rng.randint(0, 120)}.log',
+        lambda: f'v{rng.randint(1, 3)}.{rng.randint(0, 12)}.{rng.randint(0, 3)}',
+        lambda: f'host-{rng.randint(0, 20):03d}',
+        lambda: rng.choice(['alpha', 'Beta', 'gamma', 'délta', 'zeta', '_x', 'inf', 'nan', '1.2.3']),
+    ]
+    return [rng.choice(makers)() for _ in range(n)]
+
+
+@pytest.fixture(params=[1, 2, 3])
+def records(request, workdir):
+    records = mixed_records(request.param)
+    (workdir / 'records.txt').write_text(''.join(f'{r}\n' for r in records))
+    return records
+
+
+def external_sort(key: str, **options) -> list[str]:
+    batches = Query.regex('.+').sorted('records.txt', key=key, memory_limit=TINY_MEMORY, **options)
+    return [record for batch in batches for record in batch]
+
+
+@pytest.mark.parametrize('parallel', [False, True])
+@pytest.mark.parametrize('unique', [False, True])
+@pytest.mark.parametrize('descending', [False, True])
+@pytest.mark.parametrize('key', KEYS)
+def test_spilled_runs_merge_like_sorted(records, key, descending, unique, parallel):
+    assert external_sort(key, descending=descending, unique=unique, parallel=parallel) \
+        == expected(records, key, descending, unique)
+
+
+@pytest.mark.parametrize('key', KEYS)
+def test_in_memory_sort_records_agrees(records, key):
+    assert rygex_ext.sort_records(records, key=key) == expected(records, key)
+    assert rygex_ext.sort_records(records, key=key, descending=True, unique=True) \
+        == expected(records, key, descending=True, unique=True)
+
+
+def test_a_tiny_budget_spills_to_temp_dir(records, workdir):
+    missing = str(workdir / 'no-such-dir')
+    batches = Query.regex('.+').sorted('records.txt', memory_limit=TINY_MEMORY, temp_dir=missing)
+    with pytest.raises(OSError):
+        list(batches)
+    # within the budget nothing is written
+    batches = Query.regex('.+').sorted('records.txt', key='lexical', temp_dir=missing)
+    assert [r for batch in batches for r in batch] == expected(records, 'lexical')
+
+
+def test_auto_picks_ip_from_the_first_record(workdir):
+    (workdir / 'records.txt').write_text('10.0.0.10\n10.0.0.9\n::1\n192.168.0.1\nhost\n')
+    assert external_sort('auto') == ['10.0.0.9', '10.0.0.10', '192.168.0.1', '::1', 'host']
+    (workdir / 'records.txt').write_text('host\n10.0.0.10\n10.0.0.9\n')
+    assert external_sort('auto') == ['10.0.0.10', '10.0.0.9', 'host']
+
+
+@pytest.mark.parametrize('argv', [['-S'], ['-S', '-r'], ['-S', '-u'], ['-S', '--sort-key', 'natural', '-r', '-u'],
+                                  ['-S', '--sort-key', 'numeric', '-l', '5-20']])
+def test_sort_memory_does_not_change_cli_output(records, capsys, argv):
+    argv = ['-rp', '.+', *argv, '-f', 'records.txt']
+    assert run_local([*argv, '--sort-memory', '1K'], capsys) == run_local(argv, capsys)
@@ -0,0 +1,82 @@
+import json, re
+import pytest
+
+pytest.importorskip('rygex_ext')
+
+import rygex_ext
+from rygex.stats import Stats
+from conftest import run_cli
+
+UFW_BYTES, UFW_LINES = 139_446, 541
+TESTFILE_BYTES, TESTFILE_LINES = 481, 10
+
+
+def stats_json(workdir, argv: list[str]) -> tuple[str, dict]:
+    '''stdout of `rygex argv --stats json`, and the stats it wrote to stderr.'''
+    done = run_cli([*argv, '--stats', 'json'], cwd=workdir)
+    assert done.returncode == 0, done.stderr
+    return done.stdout.decode(), json.loads(done.stderr.decode().splitlines()[-1])
+
+
+@pytest.mark.parametrize('multi', [[], ['-m', '2']])
+@pytest.mark.parametrize('argv', [['-F', 'SPT=443'], ['-rp', r'SRC=(\S+)', '1', '-c'], ['-F', 'PROTO', '-t']])
+def test_json_counts_what_was_scanned(workdir, argv, multi):
+    plain = run_cli([*argv, '-f', 'ufw.test'], cwd=workdir).stdout.decode()
+    out, stats = stats_json(workdir, [*argv, *multi, '-f', 'ufw.test'])
+    assert out == plain
+    assert list(stats) == ['total_seconds', 'phases', 'counts', 'scan', 'workers', 'imbalance']
+    assert list(stats['scan']) == ['maps', 'map_seconds', 'bytes', 'lines', 'convert_seconds']
+    assert (stats['scan']['bytes'], stats['scan']['lines'], stats['scan']['maps']) == (UFW_BYTES, UFW_LINES, 1)
+    assert {'setup', 'search', 'print'} <= set(stats['phases'])
+    assert stats['counts']['printed'] == len(out.splitlines())
+    assert sum(w['bytes'] for w in stats['workers']) == UFW_BYTES
+    assert all(list(w) == ['pool', 'worker', 'chunks', 'bytes', 'seconds'] for w in stats['workers'])
+    assert stats['total_seconds'] >= sum(stats['phases'].values()) * 0.99
+
+
+def test_json_sums_several_files(workdir):
+    _, stats = stats_json(workdir, ['-F', 'line', '-m', '2', '-f', 'ufw.test', 'testfile'])
+    assert (stats['scan']['bytes'], stats['scan']['lines'], stats['scan']['maps']) \
+        == (UFW_BYTES + TESTFILE_BYTES, UFW_LINES + TESTFILE_LINES, 2)
+
+
+def test_python_workers_are_reported(workdir):
+    out, stats = stats_json(workdir, ['-p', r'SRC=(\S+)', '1', '-m', '2', '-f', 'ufw.test'])
+    workers = [w for w in stats['workers'] if w['pool'] == 'process']
+    assert workers and sum(w['bytes'] for w in workers) == UFW_BYTES
+    assert stats['counts']['printed'] == len(out.splitlines()) == UFW_LINES - 1
+
+
+def test_text_report(workdir):
+    done = run_cli(['-F', 'SPT=443', '-f', 'ufw.test', '--stats'], cwd=workdir)
+    assert done.returncode == 0, done.stderr
+    report = done.stderr.decode().splitlines()
+    assert re.fullmatch(r'rygex stats \(\d+\.\d{3}s, pid \d+\)', report[0])
+    assert report[1].startswith(f'  scanned   {UFW_BYTES:,} bytes, {UFW_LINES:,} lines, 1 files mapped in ')
+    assert '  printed   27' in report
+    assert any(re.fullmatch(r'  search    \d+\.\d{3}s', line) for line in report)
+
+
+def test_collect_totals_each_worker():
+    rygex_ext.set_stats(False)
+    stats = Stats()
+    stats.enabled = True
+    for worker, size, seconds in [(12, 300, 3.0), (11, 100, 0.5), (11, 100, 0.5)]:
+        stats.chunk('process', worker, size, seconds)
+    with stats.phase('search'):
+        pass
+    stats.count('matched', 2)
+    stats.count('matched', 3)
+    collected = stats.collect()
+    assert collected['workers'] == [
+        {'pool': 'process', 'worker': 11, 'chunks': 2, 'bytes': 200, 'seconds': 1.0},
+        {'pool': 'process', 'worker': 12, 'chunks': 1, 'bytes': 300, 'seconds': 3.0},
+    ]
+    assert collected['imbalance'] == 1.5
+    assert collected['counts'] == {'matched': 5} and list(collected['phases']) == ['search']
+
+
+def test_disabled_stats_drop_chunks():
+    stats = Stats()
+    stats.chunk('process', 1, 100, 1.0)
+    assert stats.chunks == []